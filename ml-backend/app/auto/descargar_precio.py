@@ -51,5 +51,17 @@ def descargar_historicos_csv():
             print(f"Sin datos para {ticket}")
 
 
+def sincronizar_almacen_precios():
+    """Actualiza el almacén local de precios (app/ml/models/almacen_precios) sólo con las filas nuevas"""
+    from app.ml.core.almacen_precios import AlmacenPrecios
+
+    df_empresas = pd.read_sql('SELECT "IdEmpresa", "Ticket" FROM public."Empresa";', engine)
+    almacen = AlmacenPrecios()
+    agregadas = almacen.sincronizar(df_empresas['IdEmpresa'].tolist(),
+                                    tickers=dict(zip(df_empresas['IdEmpresa'], df_empresas['Ticket'])))
+    print(f"Almacén local actualizado: {sum(agregadas.values())} filas nuevas en {len(agregadas)} empresas")
+
+
 if __name__ == "__main__":
+    sincronizar_almacen_precios()
     descargar_historicos_csv()
\ No newline at end of file
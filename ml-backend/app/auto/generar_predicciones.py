@@ -8,6 +8,7 @@ from app.models.empresa import Empresa
 from app.models.precio_historico import PrecioHistorico
 from app.models.modelo_ia import ModeloIA
 from app.ml.core.engine import MLEngine #Aqui esta el MLEngine 
+from app.ml.core.indicadores_incrementales import EstadoIndicadores, AlmacenEstadosIndicadores
 from app.services.resultado_service import ResultadoService
 
 logger = logging.getLogger(__name__)
@@ -19,6 +20,13 @@ def limpiar_numero(valor):
     except: 
         return 0.0
 
+def _valores_barra(p):
+    """(Close, High, Low, Volume) de un PrecioHistorico, usando el cierre si falta máximo/mínimo"""
+    return (float(p.PrecioCierre),
+            float(p.PrecioMaximo if p.PrecioMaximo else p.PrecioCierre),
+            float(p.PrecioMinimo if p.PrecioMinimo else p.PrecioCierre),
+            float(p.Volumen))
+
 def validar_modelo_existe(version):
     """Valida que el archivo .pth del modelo exista en el directorio raíz de models"""
     # Normalizar versión: "vv3" → "v3", etc.
@@ -26,7 +34,13 @@ def validar_modelo_existe(version):
     modelo_path = Path(__file__).parent.parent / "ml" / "models" / f"modelo_acciones_{version_normalizada}.pth"
     return modelo_path.exists()
 
-def ejecutar_analisis_diario(modelo_id = None):
+def ejecutar_analisis_diario(modelo_id = None, reconstruir_estados: bool = False):
+    """
+    Predicciones diarias de los modelos activos sobre todas las empresas activas.
+
+    Con `reconstruir_estados=True` se descartan los estados incrementales de indicadores
+    y se recalculan desde el historial (p.ej. tras corregir precios antiguos en la BD).
+    """
     print("🚀 Iniciando procesamiento secuencial de IA...")
     db = SessionLocal()
     try:
@@ -60,33 +74,66 @@ def ejecutar_analisis_diario(modelo_id = None):
             return {"status": "error", "mensaje": str(e)}
 
         LIMITE_DB = engine_temp.DIAS_MEMORIA_IA + 60  # Margen para EMA50 + Feriados
+        columnas_inferencia = engine_temp.FEATURES + engine_temp.FEATURES_REPORTE
+
+        # Estado incremental por ticker: sólo se leen las barras nuevas desde la última ejecución
+        almacen_estados = AlmacenEstadosIndicadores()
+        reconstruidos = 0
+
+        # Sentimiento de todas las empresas en una sola consulta
+        try:
+            sentimientos = MLEngine.precargar_sentimientos(db, [emp.IdEmpresa for emp in empresas])
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"⚠️ No se pudo precargar NewsSentiment: {e}")
+            sentimientos = {}
 
         datos_preparados = []
         for emp in empresas:
             try:
-                precios = db.query(PrecioHistorico).filter(PrecioHistorico.IdEmpresa == emp.IdEmpresa)\
-                            .order_by(PrecioHistorico.Fecha.desc()).limit(LIMITE_DB).all()
+                if reconstruir_estados:
+                    almacen_estados.invalidar(emp.Ticket)
+                estado = almacen_estados.cargar(emp.Ticket, columnas_inferencia, engine_temp.DIAS_MEMORIA_IA)
+
+                if estado is not None:
+                    # Cola guardada + barras nuevas en una sola consulta: si la cola ya no coincide con
+                    # la BD (barra insertada o corregida antes de ultima_fecha) se reconstruye el estado
+                    precios = db.query(PrecioHistorico).filter(
+                        PrecioHistorico.IdEmpresa == emp.IdEmpresa,
+                        PrecioHistorico.Fecha >= estado.fechas[0]
+                    ).order_by(PrecioHistorico.Fecha.asc()).all()
+                    cola = [p for p in precios if pd.Timestamp(p.Fecha) <= pd.Timestamp(estado.ultima_fecha)]
+
+                    if estado.coincide_historial([p.Fecha for p in cola], [_valores_barra(p)[0] for p in cola]):
+                        for p in precios[len(cola):]:
+                            estado.actualizar(p.Fecha, *_valores_barra(p))
+                    else:
+                        logger.info(f"♻️ Historial de {emp.Ticket} modificado hasta {estado.ultima_fecha}, se reconstruye el estado")
+                        almacen_estados.invalidar(emp.Ticket)
+                        estado = None
+
+                if estado is None:
+                    precios = db.query(PrecioHistorico).filter(PrecioHistorico.IdEmpresa == emp.IdEmpresa)\
+                                .order_by(PrecioHistorico.Fecha.desc()).limit(LIMITE_DB).all()
+
+                    if len(precios) < engine_temp.DIAS_MEMORIA_IA + 50:
+                        print(f"⚠️ Empresa {emp.Ticket}: insuficientes datos ({len(precios)} < {engine_temp.DIAS_MEMORIA_IA + 50})")
+                        continue
 
-                if len(precios) < engine_temp.DIAS_MEMORIA_IA + 50:
-                    print(f"⚠️ Empresa {emp.Ticket}: insuficientes datos ({len(precios)} < {engine_temp.DIAS_MEMORIA_IA + 50})")
-                    continue
+                    df = pd.DataFrame([dict(zip(('Close', 'High', 'Low', 'Volume'), _valores_barra(p)))
+                                       for p in reversed(precios)],
+                                      index=pd.DatetimeIndex([p.Fecha for p in reversed(precios)]))
 
-                df = pd.DataFrame([{'Close': float(p.PrecioCierre), 
-                                    'Volume': float(p.Volumen),
-                                    'High': float(p.PrecioMaximo if p.PrecioMaximo else p.PrecioCierre), 
-                                    'Low': float(p.PrecioMinimo if p.PrecioMinimo else p.PrecioCierre)} 
-                                   for p in reversed(precios)])
+                    estado = EstadoIndicadores.desde_historial(emp.Ticket, df, columnas_inferencia, engine_temp.DIAS_MEMORIA_IA)
+                    reconstruidos += 1
 
-                # ✅ FIX 2: Validar que el método existe
-                if not hasattr(engine_temp, 'calcular_indicadores'):
-                    logger.error(f"❌ MLEngine no tiene método calcular_indicadores")
-                    continue
+                almacen_estados.guardar(estado)
 
-                df_indicadores = engine_temp.calcular_indicadores(
-                    df,
+                df_indicadores = MLEngine._agregar_feature_sentimiento(
+                    estado.a_dataframe(),
                     empresa_id=emp.IdEmpresa,
                     ticker=emp.Ticket,
-                    db=db,
+                    sentimientos=sentimientos.get(emp.IdEmpresa, pd.Series(dtype=float)),
                 )
                 if df_indicadores is None or df_indicadores.empty:
                     logger.warning(f"⚠️ Indicadores vacíos para {emp.Ticket}")
@@ -98,6 +145,7 @@ def ejecutar_analisis_diario(modelo_id = None):
                 logger.warning(f"⚠️ Error procesando empresa {emp.Ticket}: {e}")
                 continue
 
+        print(f"♻️ Estados de indicadores reconstruidos: {reconstruidos}/{len(empresas)}")
         print(f"📈 Datos preparados para {len(datos_preparados)} empresas")
 
         # 3. Ciclo de modelos
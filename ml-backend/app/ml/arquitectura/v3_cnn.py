@@ -2,18 +2,19 @@ import torch
 import torch.nn as nn
 
 class ModeloCNN_v3(nn.Module):
-    def __init__(self, num_features, dias_pasados):
+    def __init__(self, num_features, dias_pasados, canales=32):
         super(ModeloCNN_v3, self).__init__()
+        # canales: ancho de la primera convolución (la segunda usa el doble)
         
         # Capa 1: Dilated Convolution
         # Dilation=2 permite a la red "mirar" más atrás en el tiempo sin aumentar parámetros
-        self.conv1 = nn.Conv1d(in_channels=num_features, out_channels=32, kernel_size=3, padding=2, dilation=2)
-        self.bn1 = nn.BatchNorm1d(32)
+        self.conv1 = nn.Conv1d(in_channels=num_features, out_channels=canales, kernel_size=3, padding=2, dilation=2)
+        self.bn1 = nn.BatchNorm1d(canales)
         self.relu1 = nn.ReLU()
         
         # Capa 2: Dilation mayor
-        self.conv2 = nn.Conv1d(in_channels=32, out_channels=64, kernel_size=3, padding=4, dilation=4)
-        self.bn2 = nn.BatchNorm1d(64) 
+        self.conv2 = nn.Conv1d(in_channels=canales, out_channels=2 * canales, kernel_size=3, padding=4, dilation=4)
+        self.bn2 = nn.BatchNorm1d(2 * canales) 
         self.relu2 = nn.ReLU()
         
         # En lugar de MaxPool agresivos, usamos Global Average Pooling al final
@@ -21,13 +22,13 @@ class ModeloCNN_v3(nn.Module):
         self.global_pool = nn.AdaptiveAvgPool1d(1)
         self.dropout = nn.Dropout(0.4)
         
-        # Ahora el tamaño aplanado siempre será igual al número de canales de salida (64)
-        self.fc1 = nn.Linear(64, 32)
-        self.bn3 = nn.BatchNorm1d(32)
+        # Ahora el tamaño aplanado siempre será igual al número de canales de salida (2 * canales)
+        self.fc1 = nn.Linear(2 * canales, canales)
+        self.bn3 = nn.BatchNorm1d(canales)
         self.relu3 = nn.ReLU()
         
-        self.cabeza_regresion = nn.Linear(32, 1)
-        self.cabeza_clasificacion = nn.Linear(32, 1)
+        self.cabeza_regresion = nn.Linear(canales, 1)
+        self.cabeza_clasificacion = nn.Linear(canales, 1)
 
     def forward(self, x):
         # Permutar a (Batch, Features, Secuencia_Tiempo)
@@ -42,8 +43,8 @@ class ModeloCNN_v3(nn.Module):
         x = self.relu2(x)
         
         # Pooling global y aplanamiento
-        x = self.global_pool(x) # Salida: (Batch, 64, 1)
-        x = torch.flatten(x, 1) # Salida: (Batch, 64)
+        x = self.global_pool(x) # Salida: (Batch, 2 * canales, 1)
+        x = torch.flatten(x, 1) # Salida: (Batch, 2 * canales)
         
         x = self.dropout(x)
         x = self.fc1(x)
@@ -55,5 +56,5 @@ class ModeloCNN_v3(nn.Module):
         
         return precio_predicho, direccion_predicha
 
-def obtener_modelo_v3(dias_pasados, num_features):
-    return ModeloCNN_v3(num_features, dias_pasados)
\ No newline at end of file
+def obtener_modelo_v3(dias_pasados, num_features, canales=32):
+    return ModeloCNN_v3(num_features, dias_pasados, canales)
\ No newline at end of file
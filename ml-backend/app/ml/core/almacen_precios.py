@@ -0,0 +1,202 @@
+"""Almacén local columnar de precios históricos
+
+Copia local de PrecioHistorico para no releer Postgres en cada ejecución.
+Cada empresa tiene su carpeta con un .npy por columna (Date, Open, High,
+Low, Close, Volume) que se lee con memory-map, y un manifest.json global
+guarda filas, última fecha, ticker y generación vigente de cada una.
+
+Cada escritura (anexar o reemplazar) deja todas las columnas en una carpeta
+de generación nueva (`<IdEmpresa>/g<n>/`) y recién después el manifiesto
+pasa a apuntarla: una escritura interrumpida nunca mezcla columnas viejas y
+nuevas, porque los lectores siguen viendo la generación anterior completa.
+
+La sincronización es incremental: sólo se descargan las filas con Fecha
+posterior a la última almacenada. Las correcciones de filas antiguas en la
+BD no se detectan; para eso está `sincronizar(..., completo=True)`.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.ml.core.pipeline_base import COLUMNAS_OHLCV, extraer_precios_masivo, arreglos_a_dataframe
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS_ALMACEN = ('Date',) + COLUMNAS_OHLCV
+
+
+class AlmacenPrecios:
+    """Precios OHLCV por empresa en archivos .npy memory-mapped con sincronización incremental"""
+
+    def __init__(self, base_path: str = "app/ml/models/almacen_precios"):
+        self.base_path = Path(base_path)
+        self.base_path.mkdir(parents=True, exist_ok=True)
+        self.ruta_manifiesto = self.base_path / "manifest.json"
+        self.manifiesto = self._leer_manifiesto()
+
+    def _leer_manifiesto(self) -> Dict[str, Dict]:
+        if not self.ruta_manifiesto.exists():
+            return {}
+        try:
+            with open(self.ruta_manifiesto, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Manifiesto del almacén de precios ilegible, se reconstruirá: {e}")
+            return {}
+
+    def _guardar_manifiesto(self):
+        tmp = self.ruta_manifiesto.with_suffix('.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.manifiesto, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.ruta_manifiesto)
+
+    @property
+    def empresas(self) -> List[int]:
+        return [int(k) for k in self.manifiesto]
+
+    def ultima_fecha(self, id_empresa: int) -> Optional[np.datetime64]:
+        info = self.manifiesto.get(str(id_empresa))
+        return np.datetime64(info['ultima_fecha'], 'ns') if info and info.get('ultima_fecha') else None
+
+    def _carpeta(self, id_empresa: int, info: Optional[Dict] = None) -> Path:
+        """Carpeta de la generación vigente (sin generación: formato anterior, columnas en la carpeta de la empresa)"""
+        carpeta = self.base_path / str(id_empresa)
+        generacion = (info or {}).get('generacion')
+        return carpeta if generacion is None else carpeta / f"g{generacion}"
+
+    def _limpiar_generaciones(self, id_empresa: int, vigente: Path):
+        """Borra generaciones anteriores y restos de escrituras interrumpidas (best effort)"""
+        for entrada in (self.base_path / str(id_empresa)).iterdir():
+            if entrada == vigente:
+                continue
+            try:
+                if entrada.is_dir():
+                    shutil.rmtree(entrada)
+                elif entrada.suffix == '.npy':
+                    entrada.unlink()
+            except OSError as e:
+                # p.ej. Windows con la generación anterior todavía mapeada: se reintenta en la próxima escritura
+                logger.debug(f"No se pudo borrar {entrada}: {e}")
+
+    def huella(self, ids_empresas: Optional[Iterable[int]] = None) -> str:
+        """Huella del contenido según el manifiesto (filas, última fecha y sincronización por empresa)"""
+        ids = self.empresas if ids_empresas is None else ids_empresas
+        entradas = {}
+        for id_empresa in sorted({int(i) for i in ids}):
+            info = self.manifiesto.get(str(id_empresa))
+            if info is not None:
+                entradas[id_empresa] = [info.get('filas'), info.get('ultima_fecha'), info.get('sincronizado')]
+        return hashlib.blake2b(json.dumps(entradas).encode(), digest_size=16).hexdigest()
+
+    def leer(self, id_empresa: int, mmap: bool = True) -> Optional[Dict[str, np.ndarray]]:
+        """Columnas de una empresa (memory-mapped, sólo lectura); None si no está en el almacén"""
+        info = self.manifiesto.get(str(id_empresa))
+        if info is None:
+            return None
+        carpeta = self._carpeta(id_empresa, info)
+        n = info['filas']
+        try:
+            # El manifiesto manda: sólo se leen las filas de la generación vigente
+            return {c: np.load(carpeta / f"{c}.npy", mmap_mode='r' if mmap else None)[:n]
+                    for c in COLUMNAS_ALMACEN}
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Almacén de precios corrupto para empresa {id_empresa}: {e}")
+            return None
+
+    def leer_dataframe(self, id_empresa: int) -> Optional[pd.DataFrame]:
+        arreglos = self.leer(id_empresa)
+        return arreglos_a_dataframe(arreglos) if arreglos is not None and len(arreglos['Date']) else None
+
+    def leer_todos(self, ids_empresas: Optional[Iterable[int]] = None) -> Dict[int, pd.DataFrame]:
+        """IdEmpresa -> DataFrame OHLCV indexado por Date, para las empresas presentes en el almacén"""
+        ids = self.empresas if ids_empresas is None else ids_empresas
+        resultado = {}
+        for id_empresa in ids:
+            df = self.leer_dataframe(id_empresa)
+            if df is not None:
+                resultado[id_empresa] = df
+        return resultado
+
+    def anexar(self, id_empresa: int, nuevos: Dict[str, np.ndarray], ticker: str = None,
+               reemplazar: bool = False) -> int:
+        """
+        Agrega filas (ordenadas por fecha) al final de la serie de una empresa, o con
+        `reemplazar=True` la sustituye entera. Las columnas se escriben en una generación
+        nueva y el manifiesto se actualiza al final (ver módulo).
+
+        Returns:
+            Cantidad de filas efectivamente agregadas (las de fecha ya almacenada se ignoran)
+        """
+        previos = None if reemplazar else self.leer(id_empresa, mmap=False)
+        ultima = None if reemplazar else self.ultima_fecha(id_empresa)
+        if ultima is not None:
+            mascara = nuevos['Date'] > ultima
+            nuevos = {c: a[mascara] for c, a in nuevos.items()}
+        agregadas = len(nuevos['Date'])
+        if agregadas == 0 and previos is not None:
+            return 0
+
+        info = self.manifiesto.get(str(id_empresa), {})
+        generacion = info.get('generacion', 0) + 1
+        carpeta = self.base_path / str(id_empresa) / f"g{generacion}"
+        if carpeta.exists():
+            shutil.rmtree(carpeta)  # resto de una escritura interrumpida que nunca llegó al manifiesto
+        carpeta.mkdir(parents=True)
+        for c in COLUMNAS_ALMACEN:
+            dtype = 'datetime64[ns]' if c == 'Date' else np.float64
+            nueva = np.asarray(nuevos[c], dtype=dtype)
+            columna = nueva if previos is None else np.concatenate([previos[c], nueva])
+            np.save(carpeta / f"{c}.npy", columna)
+
+        filas = agregadas + (0 if previos is None else len(previos['Date']))
+        fechas = nuevos['Date'] if agregadas else previos['Date']
+        info.update({
+            'filas': int(filas),
+            'ultima_fecha': str(np.datetime64(fechas[-1], 'D')) if filas else None,
+            'ticker': ticker or info.get('ticker'),
+            'sincronizado': datetime.now().isoformat(),
+            'generacion': generacion,
+        })
+        self.manifiesto[str(id_empresa)] = info
+        self._guardar_manifiesto()
+        self._limpiar_generaciones(id_empresa, carpeta)
+        return agregadas
+
+    def sincronizar(self, ids_empresas: Iterable[int], tickers: Optional[Dict[int, str]] = None,
+                    completo: bool = False) -> Dict[int, int]:
+        """
+        Trae de PrecioHistorico sólo lo nuevo desde la última Fecha de cada empresa.
+
+        Las empresas sin datos locales (o todas, con `completo=True`) se descargan
+        enteras en una consulta; las demás en otra, cada una desde su propia última fecha
+        (una empresa sin cotizaciones recientes no arrastra al resto).
+
+        Returns:
+            IdEmpresa -> filas agregadas
+        """
+        tickers = tickers or {}
+        ids = [int(i) for i in ids_empresas]
+        nuevas = [i for i in ids if completo or self.ultima_fecha(i) is None]
+        existentes = [i for i in ids if i not in set(nuevas)]
+
+        agregadas = {i: 0 for i in ids}
+        if nuevas:
+            for id_empresa, arreglos in extraer_precios_masivo(nuevas).items():
+                agregadas[id_empresa] = self.anexar(id_empresa, arreglos, tickers.get(id_empresa), reemplazar=True)
+        if existentes:
+            desde = {i: self.ultima_fecha(i) for i in existentes}
+            for id_empresa, arreglos in extraer_precios_masivo(existentes, desde_por_empresa=desde).items():
+                agregadas[id_empresa] = self.anexar(id_empresa, arreglos, tickers.get(id_empresa))
+
+        logger.info(f"Almacén de precios sincronizado: {sum(agregadas.values())} filas nuevas "
+                    f"({len(nuevas)} empresas completas, {len(existentes)} incrementales)")
+        return agregadas
@@ -0,0 +1,288 @@
+"""Búsqueda de hiperparámetros con poda asíncrona por halving sucesivo (ASHA)
+
+Cada trial es una configuración muestreada de un espacio de búsqueda
+(lr, weight decay, batch, alpha/gamma de FocalLoss, días de memoria y los
+parámetros de arquitectura que acepte la fábrica del modelo, p.ej.
+hidden_size en v1/v2/v4 o canales en v3) que se entrena con PipelineTrainer en un pool de procesos sobre
+el mismo dataset preparado (memoria compartida o memmap, como en
+entrenamiento_paralelo.py).
+
+Los trials avanzan por peldaños de épocas (min_epocas, min_epocas*eta, ...,
+max_epocas). Al terminar un peldaño el trial queda pausado en su checkpoint;
+cuando un proceso se libera se promueve el mejor trial pausado que esté en
+el 1/eta superior de su peldaño y, si no hay ninguno, se lanza uno nuevo.
+Los que nunca suben quedan podados. El scheduler de LR de todos los trials
+se planifica a max_epocas, así que un trial promovido sigue exactamente
+donde iba.
+
+Los días de memoria se recortan sobre las ventanas ya preparadas
+(DatasetVentanas.recortar_memoria): sólo valen valores <= DIAS_MEMORIA_IA.
+
+El registro (config, score por época, estado) y la tabla de posiciones por
+MetricasNormalizadas.calcular_score_global se escriben en registro.json
+después de cada tramo.
+"""
+
+import os
+import json
+import shutil
+import inspect
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.multiprocessing  # registra la serialización de tensores en memoria compartida
+
+from app.ml.core.engine import MLEngine
+from app.ml.core.dataset_ventanas import DatasetVentanas, compartir_serie
+from app.ml.core.entrenamiento_paralelo import presupuesto_hilos
+
+logger = logging.getLogger(__name__)
+
+# Lista = valores posibles; tupla (min, max) = rango continuo (log-uniforme si min > 0)
+ESPACIO_BUSQUEDA = {
+    'lr': (1e-4, 3e-3),
+    'weight_decay': (1e-5, 1e-3),
+    'batch_size': [128, 256, 512],
+    'focal_alpha': [0.25, 0.5, 0.75],
+    'focal_gamma': [1.0, 2.0, 3.0],
+    'dias_memoria': [30, 60, 90],
+}
+
+# Parámetros de arquitectura: el espacio por defecto incluye los que acepte la fábrica del modelo
+ESPACIO_ARQUITECTURA = {
+    'hidden_size': [32, 64, 128],
+    'canales': [16, 32, 64],
+}
+
+CLAVES_DATOS = ('batch_size', 'dias_memoria')
+CLAVES_ENTRENAMIENTO = tuple(MLEngine.HIPERPARAMETROS_ENTRENAMIENTO)
+
+
+def _parametros_constructor(constructor: Callable) -> set:
+    """Parámetros con nombre de la fábrica del modelo (fuera de dias_pasados y num_features)"""
+    return set(inspect.signature(constructor).parameters) - {'dias_pasados', 'num_features'}
+
+
+def espacio_por_defecto(constructor: Callable) -> Dict:
+    """ESPACIO_BUSQUEDA más los parámetros de ESPACIO_ARQUITECTURA que acepta `constructor`"""
+    aceptados = _parametros_constructor(constructor)
+    return {**ESPACIO_BUSQUEDA, **{k: v for k, v in ESPACIO_ARQUITECTURA.items() if k in aceptados}}
+
+
+def muestrear_config(espacio: Dict, rng: np.random.Generator) -> Dict:
+    """Una configuración al azar del espacio de búsqueda"""
+    config = {}
+    for nombre, dominio in espacio.items():
+        if isinstance(dominio, tuple):
+            minimo, maximo = dominio
+            if minimo > 0:
+                valor = np.exp(rng.uniform(np.log(minimo), np.log(maximo)))
+            else:
+                valor = rng.uniform(minimo, maximo)
+            config[nombre] = float(valor)
+        else:
+            valor = dominio[rng.integers(len(dominio))]
+            config[nombre] = valor.item() if isinstance(valor, np.generic) else valor
+    return config
+
+
+def peldanos_asha(min_epocas: int, max_epocas: int, eta: int) -> List[int]:
+    """Épocas acumuladas al final de cada peldaño: min_epocas * eta^k, cerrando en max_epocas"""
+    peldanos = []
+    epocas = min_epocas
+    while epocas < max_epocas:
+        peldanos.append(epocas)
+        epocas *= eta
+    return peldanos + [max_epocas]
+
+
+def _entrenar_tramo(constructor: Callable, nombre_trainer: str, log_file: str,
+                    train_ds: DatasetVentanas, val_ds: DatasetVentanas, config: Dict,
+                    max_epocas: int, hasta_epoca: int, ruta_checkpoint: str, hilos: int, semilla: int) -> Dict:
+    """Entrena un trial hasta `hasta_epoca` (reanudando de su checkpoint) dentro de un proceso worker"""
+    torch.set_num_threads(hilos)
+
+    from app.ml.core.pipeline_trainer import PipelineTrainer
+    from app.ml.core.data_utils import crear_dataloaders_generico
+
+    device = torch.device('cpu')
+    dias = config.get('dias_memoria', train_ds.dias_memoria)
+    train_loader, val_loader = crear_dataloaders_generico(
+        train_ds.recortar_memoria(dias), val_ds.recortar_memoria(dias), config.get('batch_size', 256), num_workers=0
+    )
+
+    # Misma inicialización en cada tramo; al reanudar los pesos se pisan con los del checkpoint
+    torch.manual_seed(semilla)
+    params_modelo = {k: v for k, v in config.items() if k not in CLAVES_DATOS + CLAVES_ENTRENAMIENTO}
+    modelo = constructor(dias_pasados=dias, num_features=len(MLEngine.FEATURES), **params_modelo)
+    modelo.to(device)
+
+    trainer = PipelineTrainer(nombre_trainer, log_file)
+    resultado = trainer.ejecutar_entrenamiento(
+        modelo, train_loader, val_loader, device, max_epocas, ruta_checkpoint=ruta_checkpoint,
+        hiperparametros={k: config[k] for k in CLAVES_ENTRENAMIENTO if k in config}, hasta_epoca=hasta_epoca
+    )
+    return {k: resultado[k] for k in ('historial', 'epocas', 'finalizado', 'umbral_optimo')}
+
+
+class BusquedaHiperparametros:
+    """Búsqueda ASHA en paralelo sobre un dataset preparado, con registro y tabla de posiciones"""
+
+    def __init__(self, constructor: Callable, train_ds: DatasetVentanas, val_ds: DatasetVentanas,
+                 espacio: Optional[Dict] = None, n_trials: int = 20, min_epocas: int = 2, max_epocas: int = 18,
+                 eta: int = 3, max_procesos: Optional[int] = None, semilla: int = 42,
+                 nombre: Optional[str] = None, nombre_trainer: str = "Busqueda",
+                 log_file: str = "logs/busqueda_hiperparametros.log",
+                 base_path: str = "app/ml/models/busquedas"):
+        """
+        Args:
+            constructor: fábrica del modelo (obtener_modelo_vX); recibe las claves del espacio
+                que no son de datos ni de entrenamiento (p.ej. hidden_size, o canales en v3)
+            espacio: ver ESPACIO_BUSQUEDA (por defecto, espacio_por_defecto(constructor)); una
+                clave que no es de datos, de entrenamiento ni de la fábrica es un ValueError
+            n_trials: configuraciones a probar
+            min_epocas, max_epocas, eta: peldaños de ASHA (sube el 1/eta mejor de cada peldaño)
+        """
+        self.constructor = constructor
+        self.train_ds = train_ds
+        self.val_ds = val_ds
+        self.espacio = espacio or espacio_por_defecto(constructor)
+        desconocidas = set(self.espacio) - set(CLAVES_DATOS + CLAVES_ENTRENAMIENTO) - _parametros_constructor(constructor)
+        if desconocidas:
+            raise ValueError(f"Claves del espacio que {getattr(constructor, '__name__', constructor)} "
+                             f"no acepta: {sorted(desconocidas)}")
+        self.n_trials = n_trials
+        self.eta = eta
+        self.peldanos = peldanos_asha(min_epocas, max_epocas, eta)
+        self.max_epocas = max_epocas
+        self.max_procesos = max_procesos
+        self.semilla = semilla
+        self.rng = np.random.default_rng(semilla)
+        self.nombre_trainer = nombre_trainer
+        self.log_file = log_file
+
+        self.nombre = nombre or f"busqueda_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.carpeta = Path(base_path) / self.nombre
+        self.carpeta_checkpoints = self.carpeta / "checkpoints"
+        self.carpeta_checkpoints.mkdir(parents=True, exist_ok=True)
+
+        self.trials: List[Dict] = []
+        # Por peldaño: id de trial -> score al terminarlo, e ids ya promovidos (o que no pueden seguir)
+        self.resultados: List[Dict[int, float]] = [{} for _ in self.peldanos]
+        self.promovidos: List[set] = [set() for _ in self.peldanos]
+
+    def _ruta_checkpoint(self, trial: Dict) -> str:
+        return str(self.carpeta_checkpoints / f"trial_{trial['id']}.pt")
+
+    def _siguiente_trabajo(self) -> Optional[Tuple[Dict, int]]:
+        """(trial, peldaño a alcanzar): primero promociones, del peldaño más alto al más bajo; si no, un trial nuevo"""
+        for k in reversed(range(len(self.peldanos) - 1)):
+            resultados = self.resultados[k]
+            mejores = sorted(resultados, key=resultados.get, reverse=True)[:len(resultados) // self.eta]
+            for id_trial in mejores:
+                if id_trial not in self.promovidos[k]:
+                    self.promovidos[k].add(id_trial)
+                    return self.trials[id_trial], k + 1
+
+        if len(self.trials) < self.n_trials:
+            trial = {'id': len(self.trials), 'config': muestrear_config(self.espacio, self.rng), 'estado': 'en_curso',
+                     'peldano': None, 'epocas': 0, 'score': None, 'historial': []}
+            self.trials.append(trial)
+            return trial, 0
+        return None
+
+    def _registrar_tramo(self, trial: Dict, peldano: int, resultado: Dict):
+        trial.update({'historial': resultado['historial'], 'epocas': resultado['epocas'],
+                      'score': max(resultado['historial']) if resultado['historial'] else None,
+                      'umbral_optimo': resultado['umbral_optimo'], 'peldano': peldano})
+        self.resultados[peldano][trial['id']] = trial['score'] if trial['score'] is not None else -np.inf
+
+        if resultado['finalizado'] or peldano == len(self.peldanos) - 1:
+            # Terminó (early stopping o max_epocas): compite en la tabla pero no se promueve
+            trial['estado'] = 'completado'
+            self.promovidos[peldano].add(trial['id'])
+            Path(self._ruta_checkpoint(trial)).unlink(missing_ok=True)
+        else:
+            trial['estado'] = 'pausado'
+
+    def tabla_posiciones(self) -> List[Dict]:
+        """Trials con score, del mejor al peor (mejor score global de validación alcanzado)"""
+        con_score = sorted((t for t in self.trials if t['score'] is not None), key=lambda t: t['score'], reverse=True)
+        return [{'puesto': i + 1, 'trial': t['id'], 'score': round(t['score'], 4), 'epocas': t['epocas'],
+                 'estado': t['estado'], 'config': t['config']} for i, t in enumerate(con_score)]
+
+    def _guardar_registro(self):
+        registro = {
+            'nombre': self.nombre,
+            'actualizado': datetime.now().isoformat(),
+            'espacio': {k: list(v) for k, v in self.espacio.items()},
+            'peldanos': self.peldanos,
+            'eta': self.eta,
+            'trials': self.trials,
+            'tabla_posiciones': self.tabla_posiciones(),
+        }
+        ruta = self.carpeta / "registro.json"
+        tmp = ruta.with_suffix('.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(registro, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, ruta)
+
+    def ejecutar(self) -> List[Dict]:
+        """
+        Corre la búsqueda completa.
+
+        Returns:
+            Tabla de posiciones (ver tabla_posiciones); el detalle queda en <carpeta>/registro.json
+        """
+        procesos, hilos = presupuesto_hilos(self.n_trials, self.max_procesos)
+        compartir_serie(self.train_ds, self.val_ds)
+        logger.info(f"Búsqueda {self.nombre}: {self.n_trials} trials, peldaños {self.peldanos}, "
+                    f"{procesos} procesos x {hilos} hilos")
+
+        contexto = multiprocessing.get_context('spawn')
+        en_curso = {}
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+            def lanzar():
+                while len(en_curso) < procesos:
+                    trabajo = self._siguiente_trabajo()
+                    if trabajo is None:
+                        return
+                    trial, peldano = trabajo
+                    trial['estado'] = 'en_curso'
+                    futuro = pool.submit(_entrenar_tramo, self.constructor, self.nombre_trainer, self.log_file,
+                                         self.train_ds, self.val_ds, trial['config'], self.max_epocas,
+                                         self.peldanos[peldano], self._ruta_checkpoint(trial), hilos,
+                                         self.semilla + trial['id'])
+                    en_curso[futuro] = (trial, peldano)
+
+            lanzar()
+            while en_curso:
+                hechos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    trial, peldano = en_curso.pop(futuro)
+                    try:
+                        self._registrar_tramo(trial, peldano, futuro.result())
+                        logger.info(f"Trial {trial['id']} peldaño {peldano} ({trial['epocas']} épocas): "
+                                    f"score {round(trial['score'] or 0.0, 2)} [{trial['estado']}]")
+                    except Exception as e:
+                        trial.update({'estado': 'error', 'error': str(e)})
+                        logger.error(f"Error en trial {trial['id']}: {e}", exc_info=True)
+                self._guardar_registro()
+                lanzar()
+
+        for trial in self.trials:
+            if trial['estado'] == 'pausado':
+                trial['estado'] = 'podado'
+        self._guardar_registro()
+        shutil.rmtree(self.carpeta_checkpoints, ignore_errors=True)
+
+        tabla = self.tabla_posiciones()
+        if tabla:
+            logger.info(f"Mejor trial: {tabla[0]['trial']} (score {tabla[0]['score']}) {tabla[0]['config']}")
+        return tabla
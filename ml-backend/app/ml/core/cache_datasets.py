@@ -0,0 +1,165 @@
+"""Caché en disco de datasets de entrenamiento ya preparados
+
+Guarda lo que devuelve preparar_datos_generico (matriz escalada, inicios de
+ventana, objetivos, fechas y scaler) en una carpeta por clave con archivos
+.npy y un manifest.json. Una ejecución posterior con los mismos datos de
+entrada y la misma configuración abre los arreglos con memory-map y se
+salta extracción, indicadores, escalado y ventaneo.
+
+La clave combina la huella de los datos de entrada (almacén de precios o
+CSV) con MLEngine.FEATURES, DIAS_MEMORIA_IA, DIAS_PREDICCION, DTYPE_FEATURES
+y los parámetros del scaler. VERSION_CACHE invalida todo lo anterior cuando
+cambia el procesamiento en sí.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import joblib
+import numpy as np
+from sklearn.preprocessing import RobustScaler
+
+from app.ml.core.engine import MLEngine
+from app.ml.core.dataset_ventanas import DatasetVentanas
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE = 2
+
+ARREGLOS_SPLIT = ('inicios', 'y_reg', 'y_clf', 'fechas')
+
+
+def huella_archivos(rutas: Iterable[str]) -> str:
+    """Huella barata de archivos de entrada (ruta, tamaño y fecha de modificación)"""
+    h = hashlib.blake2b(digest_size=16)
+    for ruta in sorted(rutas):
+        st = os.stat(ruta)
+        h.update(f"{ruta}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+class CacheDatasets:
+    """Datasets preparados (train/val + scaler) en disco, indexados por clave de datos y configuración"""
+
+    def __init__(self, base_path: str = "app/ml/models/cache_datasets", conservar: int = 3):
+        self.base_path = Path(base_path)
+        self.base_path.mkdir(parents=True, exist_ok=True)
+        self.conservar = conservar
+
+    @staticmethod
+    def clave(huella_datos: str, scaler_params: Optional[Dict] = None) -> str:
+        """Clave de caché: datos de entrada + features + ventanas + dtype + scaler"""
+        if scaler_params is None:
+            scaler_params = {**RobustScaler().get_params(), 'k_sketch': MLEngine.K_SKETCH_ESCALADOR,
+                             'exacto': MLEngine.ESCALADOR_EXACTO}
+        config = {
+            'version': VERSION_CACHE,
+            'datos': huella_datos,
+            'features': list(MLEngine.FEATURES),
+            'dias_memoria': MLEngine.DIAS_MEMORIA_IA,
+            'dias_prediccion': MLEngine.DIAS_PREDICCION,
+            'dtype': np.dtype(MLEngine.DTYPE_FEATURES).name,
+            'scaler': {k: repr(v) for k, v in sorted(scaler_params.items())},
+        }
+        return hashlib.blake2b(json.dumps(config, sort_keys=True).encode(), digest_size=12).hexdigest()
+
+    def cargar(self, clave: str) -> Optional[Tuple[DatasetVentanas, DatasetVentanas, RobustScaler]]:
+        """(train_ds, val_ds, scaler) con arreglos memory-mapped; None si no hay entrada válida"""
+        carpeta = self.base_path / clave
+        ruta_manifiesto = carpeta / "manifest.json"
+        if not ruta_manifiesto.exists():
+            return None
+        try:
+            with open(ruta_manifiesto, 'r', encoding='utf-8') as f:
+                manifiesto = json.load(f)
+            serie = np.load(carpeta / "serie.npy", mmap_mode='r')
+            scaler = joblib.load(carpeta / "scaler.pkl")
+            splits = {}
+            for split in ('train', 'val'):
+                a = {n: np.load(carpeta / f"{split}_{n}.npy", mmap_mode='r') for n in ARREGLOS_SPLIT}
+                splits[split] = DatasetVentanas(serie, a['inicios'], a['y_reg'], a['y_clf'],
+                                                manifiesto['dias_memoria'], a['fechas'])
+                splits[split].estadisticas = (manifiesto.get('estadisticas') or {}).get(split) \
+                    or splits[split].calcular_estadisticas()
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Caché de dataset {clave} ilegible, se vuelve a preparar: {e}")
+            return None
+
+        os.utime(ruta_manifiesto)  # marca de uso para la limpieza por antigüedad
+        return splits['train'], splits['val'], scaler
+
+    def guardar(self, clave: str, train_ds: DatasetVentanas, val_ds: DatasetVentanas,
+                scaler: RobustScaler, info: Optional[Dict] = None):
+        """Escribe la entrada en una carpeta temporal y la publica con un rename atómico"""
+        if train_ds.serie is not val_ds.serie:
+            raise ValueError("train_ds y val_ds deben compartir la misma matriz de features")
+
+        final = self.base_path / clave
+        tmp = self.base_path / f"{clave}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+
+        np.save(tmp / "serie.npy", train_ds.serie)
+        for split, ds in (('train', train_ds), ('val', val_ds)):
+            fechas = ds.fechas if ds.fechas is not None else np.full(len(ds), np.datetime64('NaT'), dtype='datetime64[ns]')
+            for nombre, arreglo in zip(ARREGLOS_SPLIT, (ds.inicios, ds.y_reg, ds.y_clf, fechas)):
+                np.save(tmp / f"{split}_{nombre}.npy", arreglo)
+        joblib.dump(scaler, tmp / "scaler.pkl")
+
+        manifiesto = {
+            'clave': clave,
+            'version': VERSION_CACHE,
+            'creado': datetime.now().isoformat(),
+            'features': list(MLEngine.FEATURES),
+            'dias_memoria': MLEngine.DIAS_MEMORIA_IA,
+            'dias_prediccion': MLEngine.DIAS_PREDICCION,
+            'filas': int(train_ds.serie.shape[0]),
+            'muestras_train': len(train_ds),
+            'muestras_val': len(val_ds),
+            'estadisticas': {'train': train_ds.estadisticas, 'val': val_ds.estadisticas},
+            **(info or {}),
+        }
+        with open(tmp / "manifest.json", 'w', encoding='utf-8') as f:
+            json.dump(manifiesto, f, indent=2, ensure_ascii=False)
+
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(tmp, final)
+        self.limpiar()
+
+    def limpiar(self):
+        """Deja sólo las `conservar` entradas usadas más recientemente"""
+        entradas = sorted(
+            (p for p in self.base_path.iterdir() if (p / "manifest.json").exists()),
+            key=lambda p: (p / "manifest.json").stat().st_mtime, reverse=True
+        )
+        for vieja in entradas[self.conservar:]:
+            shutil.rmtree(vieja, ignore_errors=True)
+
+    def obtener_o_preparar(self, huella_datos: str,
+                           preparar: Callable[[], Tuple[DatasetVentanas, DatasetVentanas, RobustScaler]],
+                           info: Optional[Dict] = None) -> Tuple[DatasetVentanas, DatasetVentanas, RobustScaler, bool]:
+        """
+        Devuelve el dataset cacheado para estos datos o lo prepara y lo guarda.
+
+        Returns:
+            (train_ds, val_ds, scaler, desde_cache)
+        """
+        clave = self.clave(huella_datos)
+        cacheado = self.cargar(clave)
+        if cacheado is not None:
+            logger.info(f"Dataset preparado leído de caché ({clave})")
+            return (*cacheado, True)
+
+        train_ds, val_ds, scaler = preparar()
+        if train_ds is not None and len(train_ds):
+            try:
+                self.guardar(clave, train_ds, val_ds, scaler, info)
+            except OSError as e:
+                logger.warning(f"⚠️ No se pudo guardar el dataset en caché: {e}")
+        return train_ds, val_ds, scaler, False
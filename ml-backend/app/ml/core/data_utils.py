@@ -4,114 +4,258 @@ from typing import List, Tuple, Optional
 import numpy as np
 import pandas as pd
 import torch
-from torch.utils.data import TensorDataset, DataLoader
+from torch.utils.data import DataLoader, Sampler, WeightedRandomSampler
 from sklearn.preprocessing import RobustScaler
-from numpy.lib.stride_tricks import sliding_window_view
 import gc
+import time
 import logging
 
 from app.ml.core.engine import MLEngine
 from app.ml.core.data_validation import DataValidator
+from app.ml.core.escalador_streaming import ajustar_escalador_robusto
+from app.ml.core.dataset_ventanas import (DatasetVentanas, MuestreadorBalanceado, MuestreadorLotes,
+                                         colar_lote, compartir_serie)
 
 logger = logging.getLogger(__name__)
 
-def preparar_datos_generico(
-    lista_dfs: List[pd.DataFrame],
-    batch_size: int = 50,
-    balance_method: str = None
-) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, RobustScaler]:
-    """Preparación universal de datos para cualquier arquitectura"""
-    # Usar el método de balanceo global si no se especifica
-    if balance_method is None:
-        balance_method = MLEngine.BALANCE_METHOD
-    
-    if not lista_dfs:
-        return None, None, None, None, None, None, None
+def _escalar_en_lugar(scaler: RobustScaler, x: np.ndarray) -> np.ndarray:
+    """Equivalente a scaler.transform(x) sin copiar ni cambiar el dtype de x"""
+    if scaler.center_ is not None:
+        x -= scaler.center_.astype(x.dtype)
+    if scaler.scale_ is not None:
+        x /= scaler.scale_.astype(x.dtype)
+    return x
 
-    scaler = RobustScaler()
-    muestras = [df[MLEngine.FEATURES].values[:100] for df in lista_dfs[:30] if len(df) > 30]
-    if muestras:
-        scaler.fit(np.vstack(muestras))
+def construir_dataset_ventanas(lista_dfs: List[pd.DataFrame],
+                               scaler: Optional[RobustScaler] = None) -> Tuple[DatasetVentanas, RobustScaler]:
+    """
+    Todas las ventanas de todas las empresas sobre una única matriz escalada.
 
-    x_chunks, y_reg_chunks, y_clf_chunks = [], [], []
+    Con `scaler` (ya ajustado) se escala cada empresa al copiarla; sin él se ajusta un
+    RobustScaler en streaming sobre todas las filas (ver escalador_streaming.py) y se
+    escala la matriz en su lugar, sin copias.
+    """
+    dias_memoria, dias_prediccion = MLEngine.DIAS_MEMORIA_IA, MLEngine.DIAS_PREDICCION
 
-    for df in lista_dfs:
-        if len(df) <= MLEngine.DIAS_MEMORIA_IA + MLEngine.DIAS_PREDICCION:
-            continue
+    dfs_utiles = [df for df in lista_dfs if len(df) > dias_memoria + dias_prediccion]
+    total_filas = sum(len(df) for df in dfs_utiles)
 
-        close_raw = df['Close'].values
-        scaled_data = scaler.transform(df[MLEngine.FEATURES].values)
-        n_validos = len(scaled_data) - MLEngine.DIAS_MEMORIA_IA - MLEngine.DIAS_PREDICCION + 1
+    # Una sola matriz escalada con todas las empresas; las ventanas se arman al vuelo
+    serie = np.empty((total_filas, len(MLEngine.FEATURES)), dtype=MLEngine.DTYPE_FEATURES)
+    inicios_chunks, y_reg_chunks, y_clf_chunks, fechas_chunks = [], [], [], []
 
-        ventanas = sliding_window_view(scaled_data, window_shape=MLEngine.DIAS_MEMORIA_IA, axis=0)
-        x_batch = ventanas.transpose(0, 2, 1)[:n_validos]
+    offset = 0
+    segmentos = []
+    for df in dfs_utiles:
+        n_filas = len(df)
+        bloque = serie[offset:offset + n_filas]
+        bloque[:] = df[MLEngine.FEATURES].to_numpy(dtype=MLEngine.DTYPE_FEATURES)
+        if scaler is not None:
+            _escalar_en_lugar(scaler, bloque)
+        segmentos.append((offset, offset + n_filas))
 
-        idx_hoy = np.arange(MLEngine.DIAS_MEMORIA_IA - 1, len(close_raw) - MLEngine.DIAS_PREDICCION)
-        idx_fut = idx_hoy + MLEngine.DIAS_PREDICCION
+        close_raw = df['Close'].to_numpy(dtype=np.float64)
+        idx_hoy = np.arange(dias_memoria - 1, n_filas - dias_prediccion)
+        idx_fut = idx_hoy + dias_prediccion
 
         log_ret = np.log(close_raw[idx_fut] / (close_raw[idx_hoy] + 1e-8))
         log_ret = np.nan_to_num(log_ret, nan=0.0, posinf=0.0, neginf=0.0)
 
-        clf_target = (log_ret > 0.005).astype(np.float32)
+        inicios_chunks.append(offset + idx_hoy - (dias_memoria - 1))
+        y_reg_chunks.append(log_ret.astype(np.float32))
+        y_clf_chunks.append((log_ret > 0.005).astype(np.float32))
+        fechas = df.index[idx_hoy] if isinstance(df.index, pd.DatetimeIndex) else pd.DatetimeIndex([pd.NaT] * len(idx_hoy))
+        fechas_chunks.append(fechas.values.astype('datetime64[ns]'))
+        offset += n_filas
+
+    if scaler is None:
+        # Mediana/IQR de todas las filas de todas las empresas (no sólo una muestra)
+        scaler = ajustar_escalador_robusto(serie, segmentos)
+        for inicio, fin in segmentos:
+            _escalar_en_lugar(scaler, serie[inicio:fin])
+
+    dataset = DatasetVentanas(
+        serie,
+        np.concatenate(inicios_chunks) if inicios_chunks else np.empty(0, dtype=np.int64),
+        np.concatenate(y_reg_chunks) if y_reg_chunks else np.empty(0, dtype=np.float32),
+        np.concatenate(y_clf_chunks) if y_clf_chunks else np.empty(0, dtype=np.float32),
+        dias_memoria,
+        np.concatenate(fechas_chunks) if fechas_chunks else np.empty(0, dtype='datetime64[ns]'),
+    )
+    del inicios_chunks, y_reg_chunks, y_clf_chunks, fechas_chunks
+    gc.collect()
+    return dataset, scaler
+
+def preparar_datos_generico(
+    lista_dfs: List[pd.DataFrame],
+    batch_size: int = 50
+) -> Tuple[DatasetVentanas, DatasetVentanas, RobustScaler]:
+    """
+    Preparación universal de datos para cualquier arquitectura.
+
+    Returns:
+        (train_ds, val_ds, scaler): datasets de ventanas perezosas sobre una
+        única matriz escalada (ver dataset_ventanas.py), sin balancear
+    """
+    if not lista_dfs:
+        return None, None, None
 
-        x_chunks.append(x_batch)
-        y_reg_chunks.append(log_ret)
-        y_clf_chunks.append(clf_target)
+    dias_memoria, dias_prediccion = MLEngine.DIAS_MEMORIA_IA, MLEngine.DIAS_PREDICCION
 
-    total_filas = sum(len(x) for x in x_chunks)
-    split_idx = int(0.9 * total_filas)
+    dataset, scaler = construir_dataset_ventanas(lista_dfs)
 
-    gap_purgado = MLEngine.DIAS_MEMORIA_IA + MLEngine.DIAS_PREDICCION
+    total_muestras = len(dataset)
+    split_idx = int(0.9 * total_muestras)
+
+    gap_purgado = dias_memoria + dias_prediccion
     val_start_idx = split_idx + gap_purgado
 
-    if val_start_idx >= total_filas:
+    if val_start_idx >= total_muestras:
         val_start_idx = split_idx
 
-    x_total = np.empty((total_filas, MLEngine.DIAS_MEMORIA_IA, len(MLEngine.FEATURES)), dtype=np.float32)
-    y_reg_total = np.empty(total_filas, dtype=np.float32)
-    y_clf_total = np.empty(total_filas, dtype=np.float32)
+    # El balanceo de clases se aplica en el DataLoader (crear_dataloaders_generico)
+    train_ds = dataset.subconjunto(np.arange(split_idx))
+    val_ds = dataset.subconjunto(np.arange(val_start_idx, total_muestras))
 
-    idx = 0
-    for cx, cy_r, cy_c in zip(x_chunks, y_reg_chunks, y_clf_chunks):
-        n = len(cx)
-        x_total[idx:idx+n], y_reg_total[idx:idx+n], y_clf_total[idx:idx+n] = cx, cy_r, cy_c
-        idx += n
+    # Estadísticas una sola vez sobre los arreglos (el trainer las lee sin recorrer el DataLoader)
+    train_ds.estadisticas = train_ds.calcular_estadisticas()
+    val_ds.estadisticas = val_ds.calcular_estadisticas()
+    logger.info(f"📊 Train: {train_ds.estadisticas['conteo_clases']} (positivos {train_ds.estadisticas['ratio_positivo']:.1%}), "
+                f"Val: {val_ds.estadisticas['conteo_clases']}")
+    return train_ds, val_ds, scaler
 
-    del x_chunks, y_reg_chunks, y_clf_chunks
-    gc.collect()
+def fecha_corte_datasets(*datasets: DatasetVentanas) -> Optional[str]:
+    """Última fecha "hoy" con objetivo conocido entre los datasets (corte de entrenamiento, 'YYYY-MM-DD')"""
+    fechas = [ds.fechas[~np.isnat(ds.fechas)] for ds in datasets if ds is not None and ds.fechas is not None]
+    fechas = [f for f in fechas if len(f)]
+    return str(np.datetime64(max(f.max() for f in fechas), 'D')) if fechas else None
 
-    x_t_bal, y_clf_t_bal = DataValidator.balancear_dataset(
-        X=x_total[:split_idx],
-        y_clf=y_clf_total[:split_idx],
-        method=balance_method
-    )
-    n_original = len(y_clf_total[:split_idx])
-    n_balanceado = len(y_clf_t_bal)
-    
-    if n_balanceado != n_original:
-        logger.info(f"🔄 Balanceo {balance_method.upper()}: {n_original} → {n_balanceado} muestras (entrenamiento)")
-        # Muestrear y_reg aleatoriamente para que coincida con el tamaño balanceado
-        indices = np.random.choice(n_original, n_balanceado, replace=True)
-        y_reg_t_bal = y_reg_total[:split_idx][indices]
-    else:
-        y_reg_t_bal = y_reg_total[:split_idx]
-    
-    return (x_t_bal, y_reg_t_bal, y_clf_t_bal,
-            x_total[val_start_idx:], y_reg_total[val_start_idx:], y_clf_total[val_start_idx:], scaler)
+def preparar_datos_incrementales(
+    lista_dfs: List[pd.DataFrame],
+    scaler: RobustScaler,
+    fecha_corte: str,
+    replay: float = None,
+    fraccion_val: float = None,
+    semilla: int = 42
+) -> Tuple[Optional[DatasetVentanas], Optional[DatasetVentanas]]:
+    """
+    Datasets para ajuste fino desde una versión anterior: escalado con el scaler guardado,
+    muestras con fecha posterior a `fecha_corte` más una muestra de repaso de las anteriores.
+
+    Las últimas fechas nuevas (`fraccion_val`) quedan para validación; entre ambas partes se
+    purgan DIAS_PREDICCION fechas si alcanzan los días nuevos. El repaso (`replay` muestras
+    antiguas por cada nueva) evita que el modelo olvide el histórico.
+
+    Returns:
+        (train_ds, val_ds), o (None, None) si no hay muestras nuevas
+    """
+    replay = MLEngine.REPLAY_INCREMENTAL if replay is None else replay
+    fraccion_val = MLEngine.FRACCION_VAL_INCREMENTAL if fraccion_val is None else fraccion_val
+    if not lista_dfs:
+        return None, None
+
+    dataset, _ = construir_dataset_ventanas(lista_dfs, scaler)
+    corte = np.datetime64(fecha_corte, 'ns')
+    nuevas = np.flatnonzero(dataset.fechas > corte)
+    if len(nuevas) == 0:
+        logger.info(f"Sin muestras posteriores a {fecha_corte}: no hay nada que ajustar")
+        return None, None
+
+    # Fechas nuevas en orden: las últimas validan, las anteriores (menos la purga) entrenan
+    fechas_nuevas = np.unique(dataset.fechas[nuevas])
+    n_val = max(1, int(round(len(fechas_nuevas) * fraccion_val)))
+    purga = MLEngine.DIAS_PREDICCION if len(fechas_nuevas) > n_val + MLEngine.DIAS_PREDICCION else 0
+    if purga == 0:
+        logger.warning(f"⚠️ Sólo {len(fechas_nuevas)} fechas nuevas: validación incremental sin purga")
+    fechas_train = fechas_nuevas[:max(0, len(fechas_nuevas) - n_val - purga)]
+
+    fechas_muestra = dataset.fechas[nuevas]
+    indices_val = nuevas[fechas_muestra >= fechas_nuevas[-n_val]]
+    indices_nuevos = nuevas[np.isin(fechas_muestra, fechas_train)]
+
+    antiguas = np.flatnonzero(dataset.fechas <= corte)
+    n_replay = min(len(antiguas), int(round(max(len(indices_nuevos), len(indices_val)) * replay)))
+    rng = np.random.default_rng(semilla)
+    indices_replay = np.sort(rng.choice(antiguas, size=n_replay, replace=False)) if n_replay else antiguas[:0]
+
+    train_ds = dataset.subconjunto(np.concatenate([indices_replay, indices_nuevos]))
+    val_ds = dataset.subconjunto(indices_val)
+    train_ds.estadisticas = train_ds.calcular_estadisticas()
+    val_ds.estadisticas = val_ds.calcular_estadisticas()
+    logger.info(f"🔁 Incremental desde {fecha_corte}: {len(indices_nuevos)} muestras nuevas + {n_replay} de repaso, "
+                f"{len(indices_val)} de validación ({len(fechas_nuevas)} fechas nuevas)")
+    return train_ds, val_ds
+
+def crear_sampler_balanceo(y_clf: np.ndarray, balance_method: str = None) -> Optional[Sampler]:
+    """Sampler de entrenamiento según el método de balanceo (None = barajado simple)"""
+    if balance_method is None:
+        balance_method = MLEngine.BALANCE_METHOD
+
+    if balance_method == 'weighted':
+        pesos = DataValidator.pesos_balanceo(y_clf)
+        return WeightedRandomSampler(torch.from_numpy(pesos), num_samples=len(pesos), replacement=True)
+    if balance_method in ('undersample', 'oversample', 'smote'):
+        sampler = MuestreadorBalanceado(y_clf, balance_method)
+        logger.info(f"🔄 Balanceo {balance_method.upper()}: {len(y_clf)} → {len(sampler)} muestras por época (entrenamiento)")
+        return sampler
+    return None
 
 def crear_dataloaders_generico(
-    x_t: np.ndarray,
-    yr_t: np.ndarray,
-    yc_t: np.ndarray,
-    x_v: np.ndarray,
-    yr_v: np.ndarray,
-    yc_v: np.ndarray,
+    train_ds: DatasetVentanas,
+    val_ds: DatasetVentanas,
     batch_size: int = 64,
-    drop_last: bool = True
+    drop_last: bool = True,
+    balance_method: str = None,
+    num_workers: int = None
 ) -> Tuple[DataLoader, DataLoader]:
-    """Crea dataloaders estandarizados para todos los pipelines"""
-    train_ds = TensorDataset(torch.tensor(x_t), torch.tensor(yr_t).view(-1,1), torch.tensor(yc_t).view(-1,1))
-    val_ds = TensorDataset(torch.tensor(x_v), torch.tensor(yr_v).view(-1,1), torch.tensor(yc_v).view(-1,1))
+    """
+    Crea dataloaders estandarizados para todos los pipelines.
+
+    El balanceo es perezoso (sampler) y cada lote se arma con un solo gather
+    (MuestreadorLotes + DatasetVentanas.__getitems__). Con workers, la serie
+    pasa a memoria compartida y los workers son persistentes con prefetch.
+    """
+    if num_workers is None:
+        num_workers = MLEngine.DATALOADER_WORKERS
+    if num_workers > 0:
+        compartir_serie(train_ds, val_ds)
+
+    sampler = crear_sampler_balanceo(train_ds.y_clf, balance_method)
+    lotes_train = MuestreadorLotes(len(train_ds), batch_size, drop_last, sampler=sampler, barajar=True)
+    lotes_val = MuestreadorLotes(len(val_ds), batch_size, drop_last)
+
+    opciones = dict(collate_fn=colar_lote, num_workers=num_workers, pin_memory=torch.cuda.is_available())
+    if num_workers > 0:
+        opciones.update(persistent_workers=True, prefetch_factor=MLEngine.DATALOADER_PREFETCH)
+
+    return (DataLoader(train_ds, batch_sampler=lotes_train, **opciones),
+            DataLoader(val_ds, batch_sampler=lotes_val, **opciones))
+
+def ratio_positivo_loader(loader: DataLoader) -> Optional[float]:
+    """
+    Fracción de positivos que entrega el loader de entrenamiento, en O(1) a partir de
+    las estadísticas del dataset y del sampler de balanceo. None si el dataset no las tiene.
+    """
+    estadisticas = getattr(loader.dataset, 'estadisticas', None)
+    if not estadisticas:
+        return None
+    sampler = getattr(loader.batch_sampler, 'sampler', None)
+    if isinstance(sampler, MuestreadorBalanceado):
+        return sampler.ratio_positivo
+    if isinstance(sampler, WeightedRandomSampler):
+        # Pesos inversos a la frecuencia: clases equiprobables (si existen ambas)
+        return 0.5 if 0 < estadisticas['ratio_positivo'] < 1 else estadisticas['ratio_positivo']
+    return estadisticas['ratio_positivo']
 
-    return (DataLoader(train_ds, batch_size=batch_size, shuffle=True, num_workers=0, drop_last=drop_last),
-            DataLoader(val_ds, batch_size=batch_size, shuffle=False, num_workers=0, drop_last=drop_last))
\ No newline at end of file
+def medir_rendimiento_loader(loader: DataLoader, max_lotes: Optional[int] = None) -> dict:
+    """Lotes y muestras por segundo que entrega un DataLoader sin entrenar (cota superior del pipeline de datos)"""
+    lotes = muestras = 0
+    inicio = time.perf_counter()
+    for x_b, _, _ in loader:
+        lotes += 1
+        muestras += len(x_b)
+        if max_lotes is not None and lotes >= max_lotes:
+            break
+    duracion = max(time.perf_counter() - inicio, 1e-9)
+    return {'lotes': lotes, 'segundos': duracion,
+            'lotes_por_seg': lotes / duracion, 'muestras_por_seg': muestras / duracion}
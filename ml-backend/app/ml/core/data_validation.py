@@ -1,17 +1,51 @@
 """Módulo centralizado de validación y sanitización de datos"""
 
+import hashlib
+import warnings
 import numpy as np
 import pandas as pd
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 import logging
 from sklearn.preprocessing import MinMaxScaler
 
 
 logger = logging.getLogger(__name__)
 
+def _rellenar_ffill_bfill(valores: np.ndarray) -> np.ndarray:
+    """ffill().bfill() por columna sobre un arreglo 2D (las columnas sin datos quedan NaN)"""
+    if len(valores) == 0:
+        return valores
+    validos = ~np.isnan(valores)
+    idx = np.where(validos, np.arange(len(valores))[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    out = np.take_along_axis(valores, idx, axis=0)
+
+    primer_idx = np.argmax(validos, axis=0)
+    primer_valor = valores[primer_idx, np.arange(valores.shape[1])]
+    sin_previo = ~np.maximum.accumulate(validos, axis=0)
+    return np.where(sin_previo, primer_valor, out)
+
+
 class DataValidator:
     """Centraliza validación y sanitización de datos"""
 
+    # Clave en df.attrs con la huella del DataFrame ya validado
+    MARCA_VALIDADO = 'huella_validacion'
+
+    @staticmethod
+    def huella(df: pd.DataFrame) -> str:
+        """Huella del contenido (valores, índice y columnas) de un DataFrame"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+        h.update(repr(list(df.columns)).encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def esta_validado(df: pd.DataFrame) -> bool:
+        """True si df ya salió de validar_y_limpiar y no cambió desde entonces"""
+        marca = df.attrs.get(DataValidator.MARCA_VALIDADO)
+        return marca is not None and marca == DataValidator.huella(df)
+
     @staticmethod
     def sanitizar_datos(df: pd.DataFrame,
                         fillna_strategy: str = 'ffill') -> pd.DataFrame:
@@ -22,29 +56,53 @@ class DataValidator:
             df: DataFrame a sanitizar
             fillna_strategy: 'ffill', 'bfill', 'mean', 'zero'
         """
+        numericas = df.select_dtypes(include=[np.number]).columns
+        valores = df[numericas].to_numpy(copy=True)
+        if valores.dtype.kind != 'f':
+            valores = valores.astype(np.float64)
+
         # 1. Reemplazar infinitos
-        df = df.replace([np.inf, -np.inf], np.nan)
+        valores[np.isinf(valores)] = np.nan
 
         # 2. Eliminar filas con muchos NaN
-        df = df.dropna(thresh=len(df.columns) * 0.8)
+        no_nulos = (~np.isnan(valores)).sum(axis=1)
+        otras = df.columns.difference(numericas, sort=False)
+        if len(otras):
+            no_nulos += df[otras].notna().to_numpy().sum(axis=1)
+        filas = no_nulos >= len(df.columns) * 0.8
+        valores = valores[filas]
 
         # 3. Rellenar según estrategia
         if fillna_strategy == 'ffill':
-            df = df.ffill().bfill()
+            valores = _rellenar_ffill_bfill(valores)
         elif fillna_strategy == 'mean':
-            df = df.fillna(df.mean())
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                medias = np.nanmean(valores, axis=0)
+            valores = np.where(np.isnan(valores), medias, valores)
         elif fillna_strategy == 'zero':
-            df = df.fillna(0)
-
-        # 4. Clip de valores extremos (3 sigmas)
-        for col in df.select_dtypes(include=[np.number]):
-            mean = df[col].mean()
-            std = df[col].std()
-            lower = mean - 3 * std
-            upper = mean + 3 * std
-            df[col] = df[col].clip(lower, upper)
-
-        return df
+            valores = np.where(np.isnan(valores), 0.0, valores).astype(valores.dtype, copy=False)
+
+        # 4. Clip de valores extremos (3 sigmas) de todas las columnas a la vez.
+        #    Columnas sin desviación definida (NaN) no se recortan, igual que Series.clip(NaN, NaN)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            mean = np.nanmean(valores, axis=0, dtype=np.float64)
+            std = np.nanstd(valores, axis=0, ddof=1, dtype=np.float64)
+        lower = np.nan_to_num(mean - 3 * std, nan=-np.inf)
+        upper = np.nan_to_num(mean + 3 * std, nan=np.inf)
+        np.clip(valores, lower.astype(valores.dtype), upper.astype(valores.dtype), out=valores)
+
+        limpios = pd.DataFrame(valores, index=df.index[filas], columns=numericas)
+        if len(otras) == 0 and (df.dtypes == valores.dtype).all():
+            # Caso habitual: todas las columnas del mismo tipo flotante, sin reconstruir columna a columna
+            limpios.attrs = dict(df.attrs)
+            return limpios
+
+        resultado = df.iloc[filas].copy()
+        flotantes = {c: t for c, t in df[numericas].dtypes.items() if t.kind == 'f' and t != valores.dtype}
+        resultado[numericas] = limpios.astype(flotantes) if flotantes else limpios
+        return resultado
 
     @staticmethod
     def validar_dataset_completo(df: pd.DataFrame,
@@ -91,6 +149,38 @@ class DataValidator:
 
         return resultados
 
+    @staticmethod
+    def mascara_outliers(df: pd.DataFrame,
+                         method: str = 'iqr',
+                         threshold: float = 1.5) -> pd.DataFrame:
+        """
+        Máscara booleana de outliers para todas las columnas numéricas a la vez.
+
+        Args:
+            df: DataFrame a analizar
+            method: 'iqr' (un solo np.nanquantile para todas las columnas) o 'zscore'
+            threshold: Umbral para detección
+
+        Returns:
+            DataFrame bool (filas × columnas numéricas); NaN nunca es outlier
+        """
+        numericas = df.select_dtypes(include=[np.number]).columns
+        valores = df[numericas].to_numpy(dtype=np.float64)
+        mascara = np.zeros(valores.shape, dtype=bool)
+
+        if len(valores) and len(numericas):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                if method == 'iqr':
+                    q1, q3 = np.nanquantile(valores, [0.25, 0.75], axis=0)
+                    iqr = q3 - q1
+                    mascara = (valores < q1 - threshold * iqr) | (valores > q3 + threshold * iqr)
+                elif method == 'zscore':
+                    z_scores = np.abs((valores - np.nanmean(valores, axis=0)) / np.nanstd(valores, axis=0, ddof=1))
+                    mascara = z_scores > threshold
+
+        return pd.DataFrame(mascara, index=df.index, columns=numericas)
+
     @staticmethod
     def detectar_outliers(df: pd.DataFrame,
                             method: str = 'iqr',
@@ -106,26 +196,82 @@ class DataValidator:
         Returns:
             Dict con índices de outliers por columna
         """
-        outliers = {}
-
-        for col in df.select_dtypes(include=[np.number]).columns:
-            if method == 'iqr':
-                Q1 = df[col].quantile(0.25)
-                Q3 = df[col].quantile(0.75)
-                IQR = Q3 - Q1
-                lower_bound = Q1 - threshold * IQR
-                upper_bound = Q3 + threshold * IQR
-                outlier_indices = df[(df[col] < lower_bound) | (df[col] > upper_bound)].index.tolist()
-            elif method == 'zscore':
-                z_scores = np.abs((df[col] - df[col].mean()) / df[col].std())
-                outlier_indices = df[z_scores > threshold].index.tolist()
+        mascara = DataValidator.mascara_outliers(df, method=method, threshold=threshold)
+        valores = mascara.to_numpy()
+        return {col: df.index[valores[:, j]].tolist()
+                for j, col in enumerate(mascara.columns) if valores[:, j].any()}
+
+    @staticmethod
+    def puerta_calidad(dfs: Dict[Any, pd.DataFrame],
+                       method: str = 'iqr',
+                       threshold: float = 3.0,
+                       max_fraccion: float = 0.15) -> Tuple[Dict[Any, pd.DataFrame], Dict[str, Any]]:
+        """
+        Control de calidad de todo el universo antes de entrenar.
+
+        Descarta los DataFrames cuya fracción de celdas outlier (outliers
+        extremos por defecto) supera `max_fraccion`.
+
+        Returns:
+            (DataFrames aceptados, reporte con fracciones por origen y descartados)
+        """
+        aceptados, fracciones, descartados = {}, {}, []
+        for origen, df in dfs.items():
+            mascara = DataValidator.mascara_outliers(df, method=method, threshold=threshold).to_numpy()
+            fraccion = float(mascara.mean()) if mascara.size else 0.0
+            fracciones[origen] = fraccion
+            if fraccion > max_fraccion:
+                descartados.append(origen)
+                logger.warning(f"⚠️ {origen}: {fraccion:.1%} de celdas outlier > {max_fraccion:.0%}, se descarta")
             else:
-                continue
+                aceptados[origen] = df
+
+        reporte = {
+            'total': len(dfs),
+            'aceptados': len(aceptados),
+            'descartados': descartados,
+            'fraccion_media': float(np.mean(list(fracciones.values()))) if fracciones else 0.0,
+            'fracciones': fracciones,
+        }
+        logger.info(f"Puerta de calidad: {len(aceptados)}/{len(dfs)} DataFrames aceptados "
+                    f"(outliers medios {reporte['fraccion_media']:.2%})")
+        return aceptados, reporte
 
-            if outlier_indices:
-                outliers[col] = outlier_indices
+    @staticmethod
+    def indices_balanceo(y_clf: np.ndarray, method: str = 'undersample',
+                         rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """
+        Índices de muestra balanceados por clase (sin tocar las ventanas).
 
-        return outliers
+        'undersample' toma de cada clase tantas muestras como tiene la minoritaria,
+        'oversample' repite con reemplazo hasta igualar a la mayoritaria. 'smote'
+        no puede interpolar índices y se trata como 'oversample'. Cualquier otro
+        método devuelve todos los índices.
+        """
+        y = np.asarray(y_clf).reshape(-1)
+        if method == 'smote':
+            logger.warning("SMOTE no aplica a índices de muestra, se usa 'oversample'")
+            method = 'oversample'
+        if method not in ('undersample', 'oversample') or len(y) == 0:
+            return np.arange(len(y))
+
+        rng = rng if rng is not None else np.random.default_rng(42)
+        por_clase = [np.flatnonzero(y == c) for c in np.unique(y)]
+        objetivo = (min if method == 'undersample' else max)(len(ix) for ix in por_clase)
+        elegidos = [
+            ix if len(ix) == objetivo
+            else rng.choice(ix, objetivo, replace=False) if len(ix) > objetivo
+            else np.concatenate([ix, rng.choice(ix, objetivo - len(ix), replace=True)])
+            for ix in por_clase
+        ]
+        return np.sort(np.concatenate(elegidos))
+
+    @staticmethod
+    def pesos_balanceo(y_clf: np.ndarray) -> np.ndarray:
+        """Peso por muestra inverso a la frecuencia de su clase (para WeightedRandomSampler)"""
+        y = np.asarray(y_clf).reshape(-1)
+        clases, inversa, conteos = np.unique(y, return_inverse=True, return_counts=True)
+        return (len(y) / (len(clases) * conteos))[inversa]
 
     @staticmethod
     def balancear_dataset(X: np.ndarray,
@@ -167,6 +313,9 @@ class DataValidator:
         """
         Valida y limpia un dataframe de una sola vez.
 
+        El resultado queda marcado en df.attrs con su huella: si se vuelve a
+        pasar sin cambios, se devuelve tal cual sin repetir la limpieza.
+
         Args:
             df: DataFrame a validar y limpiar
             min_filas: Número mínimo de filas requeridas
@@ -192,6 +341,9 @@ class DataValidator:
                 return None
 
         try:
+            if DataValidator.esta_validado(df):
+                return df
+
             # Sanitizar datos
             df_limpio = DataValidator.sanitizar_datos(df, fillna_strategy='ffill')
 
@@ -200,6 +352,7 @@ class DataValidator:
                 logger.warning("Dataset quedó vacío después de limpieza")
                 return None
 
+            df_limpio.attrs[DataValidator.MARCA_VALIDADO] = DataValidator.huella(df_limpio)
             logger.debug(f"Dataset validado y limpio: {len(df_limpio)} filas, {len(df_limpio.columns)} columnas")
             return df_limpio
 
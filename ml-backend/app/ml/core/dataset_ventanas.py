@@ -0,0 +1,248 @@
+"""Dataset de ventanas temporales construidas al vuelo
+
+En lugar de materializar un tensor (N, DIAS_MEMORIA_IA, F) con todas las
+ventanas, se guarda una sola matriz escalada (filas de todas las empresas
+concatenadas) y, por muestra, la fila donde empieza su ventana. Cada
+ventana es una vista de `sliding_window_view` sobre esa matriz, así que la
+memoria pico queda del orden de la matriz de features cruda.
+
+Los lotes se arman con `__getitems__` (un solo gather por lote) y se pasan
+tal cual con `colar_lote`. Para DataLoaders con workers la matriz viaja por
+memoria compartida (o se reabre el memmap), nunca como copia serializada.
+"""
+
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+import torch
+from numpy.lib.stride_tricks import sliding_window_view
+from torch.utils.data import Dataset, Sampler
+
+from app.ml.core.data_validation import DataValidator
+
+
+class DatasetVentanas(Dataset):
+    """Muestras (x, y_reg, y_clf) con x = serie[inicio : inicio + dias_memoria]"""
+
+    def __init__(self, serie: np.ndarray, inicios: np.ndarray, y_reg: np.ndarray, y_clf: np.ndarray,
+                 dias_memoria: int, fechas: Optional[np.ndarray] = None):
+        """
+        Args:
+            serie: matriz escalada (filas, F) con las empresas concatenadas
+            inicios: fila de inicio de cada ventana (nunca cruza de una empresa a otra)
+            y_reg, y_clf: objetivos por muestra
+            dias_memoria: largo de la ventana
+            fechas: fecha "hoy" (última fila de la ventana) de cada muestra, opcional
+        """
+        self.serie = serie
+        self.inicios = np.asarray(inicios, dtype=np.int64)
+        self.y_reg = np.asarray(y_reg, dtype=np.float32)
+        self.y_clf = np.asarray(y_clf, dtype=np.float32)
+        self.dias_memoria = dias_memoria
+        self.fechas = fechas
+        self.estadisticas = None  # ver calcular_estadisticas (se fija al preparar o al leer de caché)
+        self._serie_compartida = None
+        self._crear_vistas()
+
+    def _crear_vistas(self):
+        # (filas - dias_memoria + 1, F, dias_memoria): vista sin copia
+        self._ventanas = sliding_window_view(self.serie, self.dias_memoria, axis=0)
+        self._desplazamientos = np.arange(self.dias_memoria, dtype=np.int64)
+
+    def __getstate__(self):
+        # Al pasar a un worker: memmap se reabre por ruta y la serie compartida viaja como tensor en shm
+        estado = self.__dict__.copy()
+        del estado['_ventanas'], estado['_desplazamientos']
+        if isinstance(self.serie, np.memmap) and self.serie.filename:
+            estado['serie'] = ('memmap', str(self.serie.filename), self.serie.shape)
+        elif self._serie_compartida is not None:
+            estado['serie'] = None
+        return estado
+
+    def __setstate__(self, estado):
+        serie = estado['serie']
+        if estado.get('_serie_compartida') is not None:
+            estado['serie'] = estado['_serie_compartida'].numpy()
+        elif isinstance(serie, tuple):
+            _, ruta, forma = serie
+            estado['serie'] = np.load(ruta, mmap_mode='r')[:forma[0]]
+        self.__dict__.update(estado)
+        self._crear_vistas()
+
+    def __len__(self) -> int:
+        return len(self.inicios)
+
+    def __getitem__(self, i):
+        x = self._ventanas[self.inicios[i]].T.copy()
+        return (torch.from_numpy(x),
+                torch.from_numpy(self.y_reg[i:i + 1].copy()),
+                torch.from_numpy(self.y_clf[i:i + 1].copy()))
+
+    def __getitems__(self, indices: Sequence[int]):
+        """Lote completo en un solo gather: (x (B, dias, F), y_reg (B, 1), y_clf (B, 1))"""
+        idx = np.asarray(indices, dtype=np.int64)
+        x = self.serie[self.inicios[idx, None] + self._desplazamientos]
+        return (torch.from_numpy(x),
+                torch.from_numpy(self.y_reg[idx, None]),
+                torch.from_numpy(self.y_clf[idx, None]))
+
+    def calcular_estadisticas(self, filas_por_bloque: int = 65_536) -> dict:
+        """
+        Estadísticas del dataset en una pasada sobre los arreglos: conteo de clases,
+        media/desvío de y_reg y rango de cada feature en las filas que cubren sus ventanas.
+        """
+        y_clf = self.y_clf.reshape(-1)
+        positivos = int(np.count_nonzero(y_clf > 0.5))
+        n = len(y_clf)
+
+        # Filas cubiertas por alguna ventana (arreglo de diferencias + cumsum)
+        filas = self.serie.shape[0]
+        delta = np.zeros(filas + 1, dtype=np.int64)
+        np.add.at(delta, self.inicios, 1)
+        np.add.at(delta, self.inicios + self.dias_memoria, -1)
+        cubiertas = np.cumsum(delta[:-1]) > 0
+
+        f = self.serie.shape[1]
+        minimos = np.full(f, np.inf)
+        maximos = np.full(f, -np.inf)
+        for inicio in range(0, filas, filas_por_bloque):
+            bloque = self.serie[inicio:inicio + filas_por_bloque][cubiertas[inicio:inicio + filas_por_bloque]]
+            if len(bloque):
+                minimos = np.fmin(minimos, np.nanmin(bloque, axis=0))
+                maximos = np.fmax(maximos, np.nanmax(bloque, axis=0))
+
+        y_reg = self.y_reg.astype(np.float64)
+        return {
+            'n_muestras': n,
+            'conteo_clases': {'0': n - positivos, '1': positivos},
+            'ratio_positivo': positivos / n if n else 0.0,
+            'y_reg_media': float(y_reg.mean()) if n else 0.0,
+            'y_reg_std': float(y_reg.std()) if n else 0.0,
+            'features_min': minimos.tolist(),
+            'features_max': maximos.tolist(),
+        }
+
+    def subconjunto(self, indices: np.ndarray) -> 'DatasetVentanas':
+        """Nuevo dataset con las muestras `indices` (comparte la serie, no copia ventanas)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        ds = DatasetVentanas(
+            self.serie, self.inicios[indices], self.y_reg[indices], self.y_clf[indices],
+            self.dias_memoria, None if self.fechas is None else self.fechas[indices]
+        )
+        ds._serie_compartida = self._serie_compartida
+        return ds
+
+    def recortar_memoria(self, dias_memoria: int) -> 'DatasetVentanas':
+        """
+        Mismas muestras con ventanas más cortas: los últimos `dias_memoria` días de cada
+        ventana (mismo "hoy" y mismos objetivos). Comparte la serie, no copia nada.
+        """
+        if dias_memoria == self.dias_memoria:
+            return self
+        if not 0 < dias_memoria < self.dias_memoria:
+            raise ValueError(f"dias_memoria debe estar entre 1 y {self.dias_memoria}")
+        ds = DatasetVentanas(self.serie, self.inicios + (self.dias_memoria - dias_memoria), self.y_reg,
+                             self.y_clf, dias_memoria, self.fechas)
+        ds._serie_compartida = self._serie_compartida
+        if self.estadisticas is not None:
+            ds.estadisticas = ds.calcular_estadisticas()
+        return ds
+
+    def ventanas(self, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """Materializa las ventanas pedidas como arreglo (n, dias_memoria, F) (uso puntual, no para entrenar)"""
+        inicios = self.inicios if indices is None else self.inicios[indices]
+        return self._ventanas[inicios].transpose(0, 2, 1)
+
+
+class MuestreadorBalanceado(Sampler):
+    """
+    Sampler que balancea las clases por índices, sorteando de nuevo en cada época.
+
+    Con 'undersample' cada época ve una selección distinta de la clase
+    mayoritaria; con 'oversample' cambian las repeticiones de la minoritaria.
+    """
+
+    def __init__(self, y_clf: np.ndarray, method: str = 'undersample', semilla: int = 42):
+        self.y_clf = np.asarray(y_clf).reshape(-1)
+        self.method = method
+        self.rng = np.random.default_rng(semilla)
+        conteos = np.unique(self.y_clf, return_counts=True)[1]
+        if method in ('undersample', 'oversample', 'smote') and len(conteos):
+            self._largo = len(conteos) * int(conteos.min() if method == 'undersample' else conteos.max())
+        else:
+            self._largo = len(self.y_clf)
+
+    @property
+    def ratio_positivo(self) -> float:
+        """Fracción de positivos que ve el modelo por época"""
+        if self._largo == len(self.y_clf):
+            return float(np.mean(self.y_clf > 0.5)) if len(self.y_clf) else 0.0
+        return 0.5
+
+    def __iter__(self):
+        indices = DataValidator.indices_balanceo(self.y_clf, self.method, self.rng)
+        return iter(self.rng.permutation(indices).tolist())
+
+    def __len__(self) -> int:
+        return self._largo
+
+
+class MuestreadorLotes(Sampler):
+    """
+    Batch sampler que entrega cada lote como un arreglo de índices.
+
+    Sin sampler base recorre bloques contiguos (validación) o una permutación
+    (entrenamiento); con sampler base agrupa su orden. Los índices de cada lote
+    se ordenan para que el gather de `__getitems__` lea la serie hacia adelante.
+    """
+
+    def __init__(self, n_muestras: int, batch_size: int, drop_last: bool = False,
+                 sampler: Optional[Sampler] = None, barajar: bool = False, semilla: int = 42):
+        self.n_muestras = n_muestras
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.sampler = sampler
+        self.barajar = barajar
+        self.rng = np.random.default_rng(semilla)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        if self.sampler is not None:
+            orden = np.fromiter(iter(self.sampler), dtype=np.int64)
+        elif self.barajar:
+            orden = self.rng.permutation(self.n_muestras)
+        else:
+            orden = None
+
+        total = self.n_muestras if orden is None else len(orden)
+        for inicio in range(0, total, self.batch_size):
+            fin = min(inicio + self.batch_size, total)
+            if self.drop_last and fin - inicio < self.batch_size:
+                break
+            yield np.arange(inicio, fin) if orden is None else np.sort(orden[inicio:fin])
+
+    def __len__(self) -> int:
+        total = len(self.sampler) if self.sampler is not None else self.n_muestras
+        return total // self.batch_size if self.drop_last else -(-total // self.batch_size)
+
+
+def colar_lote(lote):
+    """collate_fn para DatasetVentanas: `__getitems__` ya devuelve el lote apilado"""
+    return lote
+
+
+def compartir_serie(*datasets: DatasetVentanas):
+    """
+    Pasa la matriz de features de los datasets a memoria compartida (una vez por
+    matriz) para que los workers del DataLoader la lean sin copiarla.
+    Las series memory-mapped ya se comparten por el page cache y no se tocan.
+    """
+    compartidas = {}
+    for ds in datasets:
+        if ds._serie_compartida is not None or isinstance(ds.serie, np.memmap):
+            continue
+        clave = id(ds.serie)
+        if clave not in compartidas:
+            tensor = torch.from_numpy(np.ascontiguousarray(ds.serie)).share_memory_()
+            compartidas[clave] = (tensor, tensor.numpy())
+        ds._serie_compartida, ds.serie = compartidas[clave]
+        ds._crear_vistas()
@@ -20,6 +20,7 @@ from app.ml.arquitectura.v2_bidireccional import ModeloBidireccional_v2
 from app.ml.arquitectura.v3_cnn import ModeloCNN_v3
 from app.ml.arquitectura.v4_lstm_cnn import ModeloLSTMCNN_v4
 from app.ml.core.technical_indicators import TechnicalIndicators # Asumiendo que moviste los indicadores aquí
+from app.ml.core.registro_features import calcular_indicadores_arrays
 
 logger = logging.getLogger(__name__)
 
@@ -30,9 +31,52 @@ class MLEngine:
     DIAS_PREDICCION = 21
     
     # ⚖️ CONFIGURACIÓN GLOBAL DE BALANCEO DE CLASES
-    # Opciones: 'smote', 'oversample', 'undersample', 'none'
-    #Smote no es eficiente para grandes datasets
+    # Opciones: 'oversample', 'undersample', 'weighted', 'none'
+    # Se aplica en el DataLoader sobre índices de muestra ('smote' se trata como 'oversample')
     BALANCE_METHOD = 'undersample'
+
+    # 🚚 CARGA DE DATOS DE ENTRENAMIENTO
+    # 0 = lotes armados en el proceso principal; > 0 = workers con la serie en memoria compartida
+    DATALOADER_WORKERS = 0
+    DATALOADER_PREFETCH = 4  # lotes adelantados por worker
+
+    # 🧵 ENTRENAMIENTO DE VARIAS ARQUITECTURAS (sólo CPU)
+    # True = un proceso por modelo con su propio presupuesto de hilos (ver entrenamiento_paralelo.py)
+    ENTRENAMIENTO_PARALELO = False
+    PROCESOS_ENTRENAMIENTO = None  # None = min(modelos, núcleos)
+    # > 1 = cada modelo se entrena con DistributedDataParallel (gloo) en N procesos locales
+    PROCESOS_DDP = 1
+
+    # 🧮 PRECISIÓN DE ENTRENAMIENTO: 'fp32' o 'bf16' (autocast bfloat16 en forward, pérdida y evaluación)
+    PRECISION_ENTRENAMIENTO = 'fp32'
+    # Adopción por arquitectura tras comparar con PipelineTrainer.comparar_precisiones, p.ej. {'v3': 'bf16'}
+    PRECISION_POR_VERSION = {}
+
+    # 🎛️ HIPERPARÁMETROS DE ENTRENAMIENTO (por defecto; la búsqueda los varía por trial)
+    HIPERPARAMETROS_ENTRENAMIENTO = {'lr': 1e-3, 'weight_decay': 1e-4, 'focal_alpha': 0.25, 'focal_gamma': 2.0}
+
+    # 🔁 REENTRENAMIENTO INCREMENTAL (ajuste fino desde la última versión con sus pesos y scaler)
+    EPOCAS_INCREMENTAL = 5
+    LR_INCREMENTAL = 1e-4
+    REPLAY_INCREMENTAL = 2.0        # muestras antiguas de repaso por cada muestra nueva
+    FRACCION_VAL_INCREMENTAL = 0.2  # últimas fechas nuevas reservadas para validación
+
+    # 💾 CHECKPOINTS DE ENTRENAMIENTO (reanudar tras un reinicio con el mismo IdModelo)
+    CHECKPOINT_CADA_EPOCAS = 1  # 0 = sin checkpoints
+
+    # ⏱️ PERFILADO DE ENTRENAMIENTO (perfil.json con tiempos por etapa, muestras/seg y RSS pico por época)
+    PERFILAR_ENTRENAMIENTO = True
+    EPOCA_TORCH_PROFILER = None  # época (1-based) a capturar con torch.profiler; None = ninguna
+    DIR_TRAZAS_PERFIL = "logs/perfiles"
+
+    # 📏 ESCALADO GLOBAL: RobustScaler (mediana/IQR) sobre todas las filas con sketches KLL fusionables
+    K_SKETCH_ESCALADOR = 256  # más grande = cuantiles más precisos (error de rango ~1/k)
+    HILOS_ESCALADOR = None    # None = núcleos disponibles
+    ESCALADOR_EXACTO = False  # True = percentiles exactos (copia temporal de la matriz completa)
+
+    # Precisión de features, validación y escalado (los acumuladores de indicadores siguen en float64)
+    DTYPE_FEATURES = np.float32
+    TOLERANCIA_DERIVA_FLOAT32 = 1e-3  # máxima deriva por feature vs float64 (unidades escaladas, ver verificar_deriva_float32)
     
     # Umbrales calibrados
     UMBRAL_ALCISTA = 0.65  # Será sobrescrito por umbral optimizado si está disponible
@@ -55,6 +99,9 @@ class MLEngine:
         'NewsSentiment'     # Sentimiento de noticias semanales (0.0-1.0)
     ]
 
+    # Indicadores extra que sólo se usan en el reporte de predecir() (features_dict)
+    FEATURES_REPORTE = ['EMA50']
+
     def __init__(self, version="v1"):
         # Normalizar versión: "vv3" → "v3", "vv1" → "v1", etc.
         self.version = version.lstrip('v') if version.startswith('vv') else version
@@ -123,9 +170,10 @@ class MLEngine:
             logger.warning(f"⚠️ No se pudo cargar umbral optimizado: {e}")
 
     def _preparar_tensor(self, df_ind):
-        scaled_data = self.scaler.transform(df_ind[self.FEATURES].values)
+        ventana = df_ind[self.FEATURES].to_numpy(dtype=self.DTYPE_FEATURES)[-self.DIAS_MEMORIA_IA:]
+        scaled_data = self.scaler.transform(ventana)
         
-        tensor = torch.tensor(scaled_data[-self.DIAS_MEMORIA_IA:], dtype=torch.float32).unsqueeze(0).to(self.device)
+        tensor = torch.tensor(scaled_data, dtype=torch.float32).unsqueeze(0).to(self.device)
         return tensor
 
     def predecir(self, df_ind):
@@ -205,55 +253,106 @@ class MLEngine:
             logger.error(f"❌ Error en predicción: {e}", exc_info=True)
             return None
 
+    VENTANA_SENTIMIENTO_DIAS = 7
+
+    @staticmethod
+    def _sentimiento_diario(rows) -> pd.Series:
+        """Promedio diario de sentimiento (índice de fechas normalizadas, ordenado) a partir de filas (fecha, score)"""
+        sent_df = pd.DataFrame(rows, columns=['fecha', 'score'])
+        if sent_df.empty:
+            return pd.Series(dtype=float)
+        sent_df['fecha'] = pd.to_datetime(sent_df['fecha']).dt.normalize()
+        return sent_df.groupby('fecha')['score'].mean().dropna().sort_index()
+
     @staticmethod
-    def _agregar_feature_sentimiento(df: pd.DataFrame, empresa_id: int = None, ticker: str = None, db=None) -> pd.DataFrame:
-        """Agrega un feature de sentimiento de noticias a la matriz de features con fallback neutral."""
+    def precargar_sentimientos(db, empresa_ids=None) -> dict:
+        """
+        Carga en una sola consulta el sentimiento diario de varias empresas.
+
+        Returns:
+            Dict IdEmpresa -> pd.Series de promedios diarios (para `sentimientos=` en _agregar_feature_sentimiento)
+        """
+        from app.models.noticia_sentimiento import NoticiaSentimiento
+
+        query = db.query(
+            NoticiaSentimiento.IdEmpresa.label('id'),
+            NoticiaSentimiento.FechaPublicacionNoticia.label('fecha'),
+            NoticiaSentimiento.PuntuacionSentimiento.label('score')
+        ).filter(NoticiaSentimiento.IdEmpresa.isnot(None))
+        if empresa_ids is not None:
+            query = query.filter(NoticiaSentimiento.IdEmpresa.in_(list(empresa_ids)))
+
+        rows = pd.DataFrame(query.all(), columns=['id', 'fecha', 'score'])
+        return {id_empresa: MLEngine._sentimiento_diario(grupo[['fecha', 'score']])
+                for id_empresa, grupo in rows.groupby('id')}
+
+    @staticmethod
+    def _unir_sentimiento_ventana(index: pd.Index, daily_scores: pd.Series) -> pd.Series:
+        """Promedio de los días con noticias en la ventana [fecha - 7d, fecha] de cada fila (0.5 si no hay)"""
+        resultado = np.full(len(index), 0.5)
+        if daily_scores is None or daily_scores.empty or len(index) == 0:
+            return pd.Series(resultado, index=index)
+
+        fechas = pd.DatetimeIndex(pd.to_datetime(index))
+        if fechas.tz is not None:
+            fechas = fechas.tz_localize(None)
+        fechas = fechas.normalize().values.astype('datetime64[ns]')
+        dias = daily_scores.index.values.astype('datetime64[ns]')
+
+        # Sumas acumuladas + searchsorted: cada ventana en O(log n)
+        acumulado = np.concatenate([[0.0], np.cumsum(daily_scores.to_numpy(dtype=np.float64))])
+        izq = np.searchsorted(dias, fechas - np.timedelta64(MLEngine.VENTANA_SENTIMIENTO_DIAS, 'D'), side='left')
+        der = np.searchsorted(dias, fechas, side='right')
+        conteo = der - izq
+        con_noticias = conteo > 0
+        resultado[con_noticias] = (acumulado[der] - acumulado[izq])[con_noticias] / conteo[con_noticias]
+        return pd.Series(resultado, index=index)
+
+    @staticmethod
+    def _agregar_feature_sentimiento(df: pd.DataFrame, empresa_id: int = None, ticker: str = None, db=None,
+                                     sentimientos: pd.Series = None) -> pd.DataFrame:
+        """
+        Agrega un feature de sentimiento de noticias a la matriz de features con fallback neutral.
+
+        Args:
+            sentimientos: serie diaria ya cargada (ver precargar_sentimientos); evita consultar la BD
+        """
         if 'NewsSentiment' in df.columns:
             df['NewsSentiment'] = pd.to_numeric(df['NewsSentiment'], errors='coerce').fillna(0.5).clip(0, 1)
             return df
 
         sentiment_series = pd.Series(0.5, index=df.index, dtype=float)
+        sesion_propia = None
 
         try:
-            from app.models.noticia_sentimiento import NoticiaSentimiento
-            from app.db.sessions import SessionLocal
+            if sentimientos is None and (empresa_id is not None or ticker is not None):
+                from app.models.noticia_sentimiento import NoticiaSentimiento
+                from app.db.sessions import SessionLocal
 
-            if db is None:
-                db = SessionLocal()
+                if db is None:
+                    db = sesion_propia = SessionLocal()
 
-            filtros = []
-            if empresa_id is not None:
-                filtros.append(NoticiaSentimiento.IdEmpresa == empresa_id)
-            if ticker is not None:
-                filtros.append(NoticiaSentimiento.Ticker == str(ticker).upper())
+                filtros = []
+                if empresa_id is not None:
+                    filtros.append(NoticiaSentimiento.IdEmpresa == empresa_id)
+                if ticker is not None:
+                    filtros.append(NoticiaSentimiento.Ticker == str(ticker).upper())
 
-            if filtros:
                 rows = db.query(
                     NoticiaSentimiento.FechaPublicacionNoticia.label('fecha'),
                     NoticiaSentimiento.PuntuacionSentimiento.label('score')
                 ).filter(*filtros).all()
+                sentimientos = MLEngine._sentimiento_diario(rows)
 
-                if rows:
-                    sent_df = pd.DataFrame(rows, columns=['fecha', 'score'])
-                    sent_df['fecha'] = pd.to_datetime(sent_df['fecha']).dt.normalize()
-                    daily_scores = sent_df.groupby('fecha')['score'].mean()
-
-                    for idx in df.index:
-                        try:
-                            fecha_idx = pd.to_datetime(idx).normalize()
-                        except Exception:
-                            fecha_idx = pd.Timestamp(idx).normalize()
-
-                        start = fecha_idx - pd.Timedelta(days=7)
-                        window = daily_scores[(daily_scores.index >= start) & (daily_scores.index <= fecha_idx)]
-                        if not window.empty:
-                            sentiment_series.loc[idx] = float(window.mean())
+            if sentimientos is not None:
+                sentiment_series = MLEngine._unir_sentimiento_ventana(df.index, sentimientos)
         except Exception as exc:
             logger.warning(f"⚠️ No se pudo incorporar NewsSentiment para {ticker or empresa_id}: {exc}")
         finally:
-            if db is not None and hasattr(db, 'close') and db is not None:
+            # Sólo se cierra la sesión abierta aquí; la del llamador sigue siendo suya
+            if sesion_propia is not None:
                 try:
-                    db.close()
+                    sesion_propia.close()
                 except Exception:
                     pass
 
@@ -261,18 +360,10 @@ class MLEngine:
         return df
 
     @staticmethod
-    def calcular_indicadores(df: pd.DataFrame, empresa_id: int = None, ticker: str = None, db=None) -> pd.DataFrame:
+    def _calcular_indicadores_pandas(df: pd.DataFrame) -> pd.DataFrame:
+        """Implementación pandas original, conservada como referencia de paridad del kernel NumPy"""
         df_clean = df.copy()
-        
-        # Validar que Close y Volume existan y sean válidos
-        if 'Close' not in df_clean.columns or 'Volume' not in df_clean.columns:
-            logger.error("❌ Columnas Close o Volume faltantes")
-            return None
-        
-        if df_clean['Close'].isna().all() or (df_clean['Close'] <= 0).all():
-            logger.error("❌ Todos los valores de Close son inválidos")
-            return None
-        
+
         # Indicadores Tendenciales
         df_clean['EMA50'] = df_clean['Close'].ewm(span=50, adjust=False).mean()
         df_clean['MACD'] = df_clean['Close'].ewm(span=12, adjust=False).mean() - df_clean['Close'].ewm(span=26, adjust=False).mean()
@@ -352,8 +443,55 @@ class MLEngine:
         # Llenar NaN y reemplazar infinitos
         df_clean = df_clean.replace([np.inf, -np.inf], 0).ffill().bfill().fillna(0)
 
+        return df_clean
+
+    @staticmethod
+    def calcular_indicadores(df: pd.DataFrame, empresa_id: int = None, ticker: str = None, db=None,
+                             columnas: list = None, sentimientos: pd.Series = None, dtype=None) -> pd.DataFrame:
+        """
+        Calcula indicadores técnicos + NewsSentiment.
+
+        Args:
+            columnas: features a calcular (p. ej. MLEngine.FEATURES). None calcula
+                todos los indicadores del registro; con una lista sólo se resuelven
+                sus dependencias y se omiten las columnas que nadie usa.
+            sentimientos: serie diaria precargada (ver precargar_sentimientos)
+            dtype: tipo de las columnas devueltas (None = float64, p. ej. MLEngine.DTYPE_FEATURES)
+        """
+        df_clean = df.copy()
+        
+        # Validar que Close y Volume existan y sean válidos
+        if 'Close' not in df_clean.columns or 'Volume' not in df_clean.columns:
+            logger.error("❌ Columnas Close o Volume faltantes")
+            return None
+        
+        if df_clean['Close'].isna().all() or (df_clean['Close'] <= 0).all():
+            logger.error("❌ Todos los valores de Close son inválidos")
+            return None
+        
+        # Kernel NumPy vectorizado resuelto sobre el registro de features (ver registro_features.py)
+        indicadores = calcular_indicadores_arrays(
+            df_clean['Close'].to_numpy(dtype=np.float64),
+            df_clean['High'].to_numpy(dtype=np.float64),
+            df_clean['Low'].to_numpy(dtype=np.float64),
+            df_clean['Volume'].to_numpy(dtype=np.float64),
+            columnas=columnas,
+            dtype=dtype or np.float64
+        )
+        
+        # Llenar NaN y reemplazar infinitos de las columnas originales (los indicadores ya vienen saneados)
+        df_clean = df_clean.replace([np.inf, -np.inf], 0).ffill().bfill().fillna(0)
+        if dtype is not None:
+            df_clean = df_clean.astype(dtype)
+        df_clean = pd.concat(
+            [df_clean.drop(columns=[c for c in indicadores if c in df_clean.columns]),
+             pd.DataFrame(indicadores, index=df_clean.index)],
+            axis=1
+        )
+
         # Integrar feature de sentimiento de noticias como último feature del vector
-        df_clean = MLEngine._agregar_feature_sentimiento(df_clean, empresa_id=empresa_id, ticker=ticker, db=db)
+        df_clean = MLEngine._agregar_feature_sentimiento(df_clean, empresa_id=empresa_id, ticker=ticker, db=db,
+                                                        sentimientos=sentimientos)
         
         # Validar que no haya NaN en features críticas
         critical_features = ['Close', 'Volume', 'EMA50', 'RSI', 'MACD', 'ATR', 'NewsSentiment']
@@ -0,0 +1,210 @@
+"""Entrenamiento data-parallel en CPU con torch.distributed (backend gloo)
+
+N procesos locales entrenan el mismo modelo envuelto en
+DistributedDataParallel; cada uno recorre su parte del dataset con un
+DistributedSampler y los gradientes se promedian en cada paso. La
+validación se reparte en tramos contiguos y PipelineTrainer junta las
+predicciones de todos los procesos, así que umbral, métricas y early
+stopping son idénticos en todos los rangos.
+
+El balanceo de clases se resuelve antes de lanzar los procesos (índices
+fijos con semilla común): DistributedSampler necesita el mismo universo de
+muestras en todos los rangos. 'weighted' se aproxima con 'oversample'.
+
+El dataset se comparte igual que en entrenamiento_paralelo.py: memmap por
+ruta o memoria compartida, sin copias por proceso.
+"""
+
+import os
+import time
+import socket
+import logging
+import tempfile
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+from app.ml.core.engine import MLEngine
+from app.ml.core.data_validation import DataValidator
+from app.ml.core.dataset_ventanas import DatasetVentanas, MuestreadorLotes, colar_lote, compartir_serie
+
+logger = logging.getLogger(__name__)
+
+
+def _direccion_libre() -> str:
+    """init_method TCP en localhost con un puerto libre"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return f"tcp://127.0.0.1:{s.getsockname()[1]}"
+
+
+def _iniciar_proceso(rango: int, mundo: int, direccion: str, hilos: int):
+    torch.set_num_threads(hilos)
+    dist.init_process_group('gloo', init_method=direccion, rank=rango, world_size=mundo)
+    torch.manual_seed(42)
+
+
+def _loaders_distribuidos(train_ds: DatasetVentanas, val_ds: DatasetVentanas, rango: int, mundo: int,
+                          batch_size: int):
+    sampler = DistributedSampler(train_ds, num_replicas=mundo, rank=rango, shuffle=True, seed=42, drop_last=True)
+    train_loader = DataLoader(train_ds, batch_sampler=MuestreadorLotes(len(sampler), batch_size, True, sampler=sampler),
+                              collate_fn=colar_lote)
+    tramo = np.array_split(np.arange(len(val_ds)), mundo)[rango]
+    val_local = val_ds.subconjunto(tramo)
+    val_loader = DataLoader(val_local, batch_sampler=MuestreadorLotes(len(val_local), batch_size),
+                            collate_fn=colar_lote)
+    return train_loader, val_loader
+
+
+def _worker_ddp(rango: int, mundo: int, direccion: str, hilos: int, constructor: Callable,
+                train_ds: DatasetVentanas, val_ds: DatasetVentanas, nombre_trainer: str, log_file: str,
+                batch_size: int, epochs: int, ruta_resultado: str, precision: Optional[str] = None,
+                ruta_checkpoint: Optional[str] = None):
+    from app.ml.core.pipeline_trainer import PipelineTrainer
+
+    _iniciar_proceso(rango, mundo, direccion, hilos)
+    try:
+        device = torch.device('cpu')
+        train_loader, val_loader = _loaders_distribuidos(train_ds, val_ds, rango, mundo, batch_size)
+        modelo = DistributedDataParallel(
+            constructor(dias_pasados=MLEngine.DIAS_MEMORIA_IA, num_features=len(MLEngine.FEATURES))
+        )
+
+        trainer = PipelineTrainer(nombre_trainer, log_file, precision=precision)
+        if rango > 0:
+            trainer.logger.setLevel(logging.WARNING)
+
+        # Todos los rangos reanudan del mismo checkpoint; sólo el rango 0 lo escribe
+        resultado = trainer.ejecutar_entrenamiento(modelo, train_loader, val_loader, device, epochs,
+                                                   ruta_checkpoint=ruta_checkpoint)
+        # Colectiva: todos los rangos evalúan su tramo
+        metricas = trainer.evaluar_modelo(modelo, val_loader, device, umbral_decision=resultado["umbral_optimo"])
+
+        if rango == 0:
+            torch.save({"pesos": resultado["pesos"], "umbral_optimo": resultado["umbral_optimo"],
+                        "metricas": metricas, "perfil": resultado["perfil"]}, ruta_resultado)
+    finally:
+        dist.destroy_process_group()
+
+
+def _preparar_train_balanceado(train_ds: DatasetVentanas, balance_method: Optional[str]) -> DatasetVentanas:
+    """Subconjunto balanceado fijo (mismo en todos los rangos) con sus estadísticas"""
+    metodo = balance_method or MLEngine.BALANCE_METHOD
+    if metodo == 'weighted':
+        metodo = 'oversample'
+    train_bal = train_ds.subconjunto(DataValidator.indices_balanceo(train_ds.y_clf, metodo))
+    train_bal.estadisticas = train_bal.calcular_estadisticas()
+    return train_bal
+
+
+def entrenar_distribuido(constructor: Callable, train_ds: DatasetVentanas, val_ds: DatasetVentanas,
+                         nombre_trainer: str, log_file: str, procesos: int = 2, batch_size: int = 256,
+                         epochs: int = 50, balance_method: Optional[str] = None,
+                         precision: Optional[str] = None, ruta_checkpoint: Optional[str] = None) -> Dict:
+    """
+    Entrena un modelo con DDP en `procesos` procesos locales.
+
+    `batch_size` es por proceso (el lote efectivo es batch_size * procesos).
+
+    Returns:
+        {"pesos", "umbral_optimo", "metricas"} del rango 0 (iguales en todos) y su "perfil"
+    """
+    hilos = max(1, (os.cpu_count() or 1) // procesos)
+    train_bal = _preparar_train_balanceado(train_ds, balance_method)
+    compartir_serie(train_bal, val_ds)
+    logger.info(f"Entrenamiento DDP (gloo): {procesos} procesos x {hilos} hilos, "
+                f"{len(train_bal)} muestras de entrenamiento")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta_resultado = os.path.join(tmp, "resultado.pt")
+        mp.spawn(_worker_ddp, nprocs=procesos, join=True,
+                 args=(procesos, _direccion_libre(), hilos, constructor, train_bal, val_ds,
+                       nombre_trainer, log_file, batch_size, epochs, ruta_resultado, precision, ruta_checkpoint))
+        return torch.load(ruta_resultado, weights_only=False)
+
+
+def _worker_rendimiento(rango: int, mundo: int, direccion: str, hilos: int, constructor: Callable,
+                        train_ds: DatasetVentanas, batch_size: int, lotes: int, calentamiento: int,
+                        ruta_resultado: str):
+    _iniciar_proceso(rango, mundo, direccion, hilos)
+    try:
+        sampler = DistributedSampler(train_ds, num_replicas=mundo, rank=rango, shuffle=True, seed=42, drop_last=True)
+        loader = DataLoader(train_ds, batch_sampler=MuestreadorLotes(len(sampler), batch_size, True, sampler=sampler),
+                            collate_fn=colar_lote)
+        if len(loader) == 0:
+            # Sin lotes el bucle de abajo nunca avanzaría
+            raise ValueError(f"Sin lotes completos: {len(train_ds)} muestras < batch_size {batch_size} x {mundo} procesos")
+        modelo = DistributedDataParallel(
+            constructor(dias_pasados=MLEngine.DIAS_MEMORIA_IA, num_features=len(MLEngine.FEATURES))
+        )
+        optimizer = torch.optim.AdamW(modelo.parameters(), lr=1e-3)
+        criterion_reg, criterion_clf = nn.HuberLoss(delta=0.01), nn.BCEWithLogitsLoss()
+
+        modelo.train()
+        inicio = None
+        pasos = 0
+        while pasos < calentamiento + lotes:
+            for x_b, yr_b, yc_b in loader:
+                if pasos == calentamiento:
+                    dist.barrier()
+                    inicio = time.perf_counter()
+                optimizer.zero_grad()
+                p_reg, l_clf = modelo(x_b)
+                (criterion_reg(p_reg, yr_b) + criterion_clf(l_clf, yc_b)).backward()
+                optimizer.step()
+                pasos += 1
+                if pasos >= calentamiento + lotes:
+                    break
+
+        # El proceso más lento marca el ritmo
+        duracion = torch.tensor([time.perf_counter() - inicio], dtype=torch.float64)
+        dist.all_reduce(duracion, op=dist.ReduceOp.MAX)
+        if rango == 0:
+            torch.save({"segundos": duracion.item(), "muestras": lotes * batch_size * mundo}, ruta_resultado)
+    finally:
+        dist.destroy_process_group()
+
+
+def reporte_escalado(constructor: Callable, train_ds: DatasetVentanas, procesos: Iterable[int] = (1, 2, 4),
+                     batch_size: int = 256, lotes: int = 30, calentamiento: int = 3) -> List[Dict]:
+    """
+    Rendimiento de entrenamiento DDP según la cantidad de procesos (pasos de optimización reales).
+
+    Se omiten (con un aviso) las cantidades de procesos para las que
+    len(train_ds) // procesos < batch_size, porque ninguna réplica tendría un lote.
+
+    Returns:
+        Una fila por cantidad de procesos: muestras/seg, aceleración y eficiencia respecto
+        de la primera fila (1 proceso si no se omitió)
+    """
+    compartir_serie(train_ds)
+    filas = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in procesos:
+            # DistributedSampler y MuestreadorLotes descartan el resto: cada réplica necesita un lote completo
+            if len(train_ds) // n < batch_size:
+                logger.warning(f"DDP {n} procesos omitido: {len(train_ds)} muestras no alcanzan "
+                               f"para un lote de {batch_size} por proceso")
+                continue
+            hilos = max(1, (os.cpu_count() or 1) // n)
+            ruta = os.path.join(tmp, f"rendimiento_{n}.pt")
+            mp.spawn(_worker_rendimiento, nprocs=n, join=True,
+                     args=(n, _direccion_libre(), hilos, constructor, train_ds, batch_size, lotes, calentamiento, ruta))
+            r = torch.load(ruta)
+            filas.append({"procesos": n, "hilos_por_proceso": hilos,
+                          "muestras_por_seg": r["muestras"] / r["segundos"]})
+
+    base = filas[0]["muestras_por_seg"] if filas else 1.0
+    for fila in filas:
+        fila["aceleracion"] = fila["muestras_por_seg"] / base
+        fila["eficiencia"] = fila["aceleracion"] / fila["procesos"]
+        logger.info(f"DDP {fila['procesos']} procesos: {fila['muestras_por_seg']:.0f} muestras/s "
+                    f"(x{fila['aceleracion']:.2f}, eficiencia {fila['eficiencia']:.0%})")
+    return filas
@@ -0,0 +1,94 @@
+"""Entrenamiento de varias arquitecturas en paralelo sobre los mismos datos
+
+Cada modelo se entrena en su propio proceso (contexto 'spawn', sin heredar
+el estado de OpenMP del padre) con un presupuesto fijo de hilos de torch.
+Los datasets viajan sin copiar la matriz de features: si vienen de la caché
+se reabren por ruta (memmap) y si no, se pasan a memoria compartida antes
+de lanzar los procesos (ver DatasetVentanas.__getstate__).
+
+El registro de resultados (MetricaService, ModelVersionManager) queda en
+el proceso principal, a medida que cada modelo termina.
+"""
+
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+import torch
+import torch.multiprocessing  # registra la serialización de tensores en memoria compartida
+
+from app.ml.core.engine import MLEngine
+from app.ml.core.dataset_ventanas import DatasetVentanas, compartir_serie
+
+logger = logging.getLogger(__name__)
+
+
+def presupuesto_hilos(n_modelos: int, max_procesos: Optional[int] = None) -> Tuple[int, int]:
+    """(procesos, hilos por proceso) para repartir los núcleos disponibles sin sobresuscribir"""
+    nucleos = os.cpu_count() or 1
+    procesos = max(1, min(n_modelos, max_procesos or nucleos, nucleos))
+    return procesos, max(1, nucleos // procesos)
+
+
+def _entrenar_modelo_worker(constructor: Callable, nombre_trainer: str, log_file: str,
+                            train_ds: DatasetVentanas, val_ds: DatasetVentanas,
+                            hilos: int, batch_size: int, epochs: int, precision: Optional[str] = None,
+                            ruta_checkpoint: Optional[str] = None) -> Dict:
+    """Entrena y evalúa un modelo en CPU dentro de un proceso worker"""
+    torch.set_num_threads(hilos)
+
+    from app.ml.core.pipeline_trainer import PipelineTrainer
+    from app.ml.core.data_utils import crear_dataloaders_generico
+
+    device = torch.device('cpu')
+    train_loader, val_loader = crear_dataloaders_generico(train_ds, val_ds, batch_size, num_workers=0)
+    modelo = constructor(dias_pasados=MLEngine.DIAS_MEMORIA_IA, num_features=len(MLEngine.FEATURES))
+    modelo.to(device)
+
+    trainer = PipelineTrainer(nombre_trainer, log_file, precision=precision)
+    resultado = trainer.ejecutar_entrenamiento(modelo, train_loader, val_loader, device, epochs,
+                                               ruta_checkpoint=ruta_checkpoint)
+    metricas = trainer.evaluar_modelo(modelo, val_loader, device, umbral_decision=resultado["umbral_optimo"])
+
+    return {"pesos": resultado["pesos"], "umbral_optimo": resultado["umbral_optimo"], "metricas": metricas,
+            "perfil": resultado["perfil"]}
+
+
+def entrenar_en_paralelo(tareas: Dict[Hashable, Callable], train_ds: DatasetVentanas, val_ds: DatasetVentanas,
+                         nombre_trainer: str, log_file: str, batch_size: int = 256, epochs: int = 50,
+                         max_procesos: Optional[int] = None,
+                         precisiones: Optional[Dict[Hashable, str]] = None,
+                         checkpoints: Optional[Dict[Hashable, str]] = None) -> Iterator[Tuple[Hashable, Dict]]:
+    """
+    Entrena cada modelo de `tareas` en un proceso aparte y entrega los resultados según terminan.
+
+    Args:
+        tareas: clave (p.ej. IdModelo) -> constructor del modelo (obtener_modelo_vX)
+        train_ds, val_ds: datasets preparados (se comparten, no se copian)
+        nombre_trainer, log_file: configuración del PipelineTrainer de cada worker
+        precisiones: clave -> 'fp32'/'bf16' (por defecto MLEngine.PRECISION_ENTRENAMIENTO)
+        checkpoints: clave -> ruta de checkpoint para guardar y reanudar (ver PipelineTrainer)
+
+    Yields:
+        (clave, {"pesos", "umbral_optimo", "metricas", "perfil"}); un modelo que falla se registra y se omite
+    """
+    procesos, hilos = presupuesto_hilos(len(tareas), max_procesos)
+    compartir_serie(train_ds, val_ds)
+    logger.info(f"Entrenamiento paralelo: {len(tareas)} modelos, {procesos} procesos x {hilos} hilos")
+
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+        futuros = {
+            pool.submit(_entrenar_modelo_worker, constructor, nombre_trainer, log_file,
+                        train_ds, val_ds, hilos, batch_size, epochs, (precisiones or {}).get(clave),
+                        (checkpoints or {}).get(clave)): clave
+            for clave, constructor in tareas.items()
+        }
+        for futuro in as_completed(futuros):
+            clave = futuros[futuro]
+            try:
+                yield clave, futuro.result()
+            except Exception as e:
+                logger.error(f"Error entrenando modelo {clave} en paralelo: {e}", exc_info=True)
@@ -0,0 +1,162 @@
+"""RobustScaler global ajustado en streaming con sketches de cuantiles KLL
+
+El escalado usa mediana e IQR (percentiles 25-75) por feature, como
+RobustScaler. En lugar de juntar todas las filas para ordenarlas, cada
+bloque (una empresa) actualiza un sketch KLL por columna: memoria
+O(k · log(n/k)) por feature y error de rango del orden de 1/k. Los sketches
+se fusionan, así que varios workers pueden procesar empresas distintas y
+combinar el resultado al final.
+
+El artefacto final es un sklearn RobustScaler con center_ y scale_ (dos
+vectores de F valores): se guarda con joblib como siempre y MLEngine lo
+carga sin cambios.
+
+Alternativa exacta: `exacto=True` calcula los percentiles con
+np.nanpercentile sobre la serie completa (necesita una copia temporal del
+tamaño de la serie para ordenarla).
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from sklearn.preprocessing import RobustScaler
+
+from app.ml.core.engine import MLEngine
+
+CUANTILES_ROBUSTOS = (0.25, 0.5, 0.75)
+
+
+class SketchKLL:
+    """Sketch KLL de cuantiles de una variable (fusionable)"""
+
+    def __init__(self, k: int = 256, semilla: int = 0):
+        self.k = k
+        self.n = 0
+        self.niveles: List[np.ndarray] = [np.empty(0)]  # nivel h: elementos con peso 2^h
+        self.rng = np.random.default_rng(semilla)
+
+    def _capacidad(self, nivel: int) -> int:
+        # Los niveles bajos (peso chico) reciben menos espacio: k * (2/3)^profundidad
+        profundidad = len(self.niveles) - 1 - nivel
+        return max(2, int(np.ceil(self.k * (2 / 3) ** profundidad)))
+
+    def _compactar(self):
+        while True:
+            llenos = [h for h, buffer in enumerate(self.niveles) if len(buffer) > self._capacidad(h)]
+            if not llenos:
+                return
+            h = llenos[0]
+            if h + 1 == len(self.niveles):
+                self.niveles.append(np.empty(0))
+            buffer = np.sort(self.niveles[h])
+            # Con largo impar un elemento se queda en el nivel (el peso total se conserva exacto)
+            resto, buffer = (buffer[:1], buffer[1:]) if len(buffer) % 2 else (buffer[:0], buffer)
+            desplazamiento = int(self.rng.integers(2))
+            self.niveles[h + 1] = np.concatenate([self.niveles[h + 1], buffer[desplazamiento::2]])
+            self.niveles[h] = resto
+
+    def actualizar(self, valores: np.ndarray):
+        """Agrega un bloque de valores (se ignoran NaN/inf)"""
+        valores = np.asarray(valores, dtype=np.float64).ravel()
+        valores = valores[np.isfinite(valores)]
+        if len(valores):
+            self.n += len(valores)
+            self.niveles[0] = np.concatenate([self.niveles[0], valores])
+            self._compactar()
+
+    def fusionar(self, otro: 'SketchKLL') -> 'SketchKLL':
+        """Incorpora otro sketch (como si hubiera visto también sus datos)"""
+        while len(self.niveles) < len(otro.niveles):
+            self.niveles.append(np.empty(0))
+        for h, buffer in enumerate(otro.niveles):
+            self.niveles[h] = np.concatenate([self.niveles[h], buffer])
+        self.n += otro.n
+        self._compactar()
+        return self
+
+    def cuantiles(self, qs: Sequence[float]) -> np.ndarray:
+        """Cuantiles aproximados (NaN si el sketch está vacío)"""
+        if self.n == 0:
+            return np.full(len(qs), np.nan)
+        valores = np.concatenate(self.niveles)
+        pesos = np.concatenate([np.full(len(b), 2.0 ** h) for h, b in enumerate(self.niveles)])
+        orden = np.argsort(valores, kind='stable')
+        acumulado = np.cumsum(pesos[orden])
+        posiciones = np.searchsorted(acumulado, np.asarray(qs) * acumulado[-1], side='left')
+        return valores[orden][np.minimum(posiciones, len(valores) - 1)]
+
+
+class EscaladorRobustoStreaming:
+    """Un SketchKLL por feature; equivale a RobustScaler(quantile_range=(25, 75))"""
+
+    def __init__(self, n_features: int, k: Optional[int] = None, semilla: int = 42):
+        k = k or MLEngine.K_SKETCH_ESCALADOR
+        self.sketches = [SketchKLL(k, semilla + j) for j in range(n_features)]
+
+    def actualizar(self, bloque: np.ndarray):
+        """Agrega un bloque de filas (filas, F), p.ej. todas las de una empresa"""
+        for j, sketch in enumerate(self.sketches):
+            sketch.actualizar(bloque[:, j])
+
+    def fusionar(self, otro: 'EscaladorRobustoStreaming') -> 'EscaladorRobustoStreaming':
+        for sketch, sketch_otro in zip(self.sketches, otro.sketches):
+            sketch.fusionar(sketch_otro)
+        return self
+
+    def cuantiles(self) -> np.ndarray:
+        """(F, 3): percentiles 25, 50 y 75 por feature"""
+        return np.array([s.cuantiles(CUANTILES_ROBUSTOS) for s in self.sketches]).reshape(-1, 3)
+
+    def a_robust_scaler(self) -> RobustScaler:
+        return _robust_scaler_desde_cuantiles(self.cuantiles())
+
+
+def _robust_scaler_desde_cuantiles(q: np.ndarray) -> RobustScaler:
+    """RobustScaler ya ajustado a partir de los percentiles (F, 3) (sin datos: centro 0 y escala 1)"""
+    centro = np.nan_to_num(q[:, 1], nan=0.0)
+    escala = q[:, 2] - q[:, 0]
+    # Igual que sklearn: IQR nulo no escala
+    escala = np.where(np.isfinite(escala) & (escala != 0), escala, 1.0)
+    scaler = RobustScaler()
+    scaler.center_ = centro
+    scaler.scale_ = escala
+    scaler.n_features_in_ = len(centro)
+    return scaler
+
+
+def ajustar_escalador_robusto(serie: np.ndarray, segmentos: Sequence[Tuple[int, int]],
+                              hilos: Optional[int] = None, exacto: Optional[bool] = None) -> RobustScaler:
+    """
+    RobustScaler sobre todas las filas de `serie`, recorrida por segmentos (inicio, fin) de
+    filas (uno por empresa).
+
+    Cada hilo acumula su propio sketch sobre un subconjunto de segmentos y al final se
+    fusionan (los ordenamientos de numpy liberan el GIL). Resultado determinista para un
+    mismo número de hilos.
+    """
+    exacto = MLEngine.ESCALADOR_EXACTO if exacto is None else exacto
+    if exacto:
+        if len(serie) == 0:
+            return _robust_scaler_desde_cuantiles(np.full((serie.shape[1], 3), np.nan))
+        return _robust_scaler_desde_cuantiles(
+            np.nanpercentile(serie, [100 * q for q in CUANTILES_ROBUSTOS], axis=0).T)
+
+    hilos = max(1, min(hilos or MLEngine.HILOS_ESCALADOR or os.cpu_count() or 1, len(segmentos) or 1))
+    n_features = serie.shape[1]
+
+    def ajustar_parte(parte: int) -> EscaladorRobustoStreaming:
+        escalador = EscaladorRobustoStreaming(n_features, semilla=42 + 1000 * parte)
+        for inicio, fin in segmentos[parte::hilos]:
+            escalador.actualizar(serie[inicio:fin])
+        return escalador
+
+    if hilos == 1:
+        return ajustar_parte(0).a_robust_scaler()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        partes = list(pool.map(ajustar_parte, range(hilos)))
+    total = partes[0]
+    for parte in partes[1:]:
+        total.fusionar(parte)
+    return total.a_robust_scaler()
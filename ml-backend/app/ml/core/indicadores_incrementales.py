@@ -0,0 +1,364 @@
+"""Estado incremental (streaming) de indicadores técnicos por ticker
+
+Mantiene los acumuladores de las EMA, buffers circulares para las ventanas
+móviles (sumas, desviaciones, máximos/mínimos) y las sumas acumuladas de
+OBV/VWAP. Agregar una barra nueva produce la siguiente fila de features en
+O(1) respecto del largo del historial, reproduciendo los mismos valores que
+registro_features.calcular_indicadores_arrays sobre el historial completo.
+
+El estado se persiste por ticker y sólo se reconstruye desde el historial
+cuando falta o queda invalidado: cambio de FEATURES o de versión del
+formato (AlmacenEstadosIndicadores.cargar), barra fuera de orden
+(`actualizar` la rechaza) o historial modificado dentro de la cola guardada
+(`coincide_historial`: una barra insertada o corregida en las últimas
+`dias_memoria` fechas). Una corrección anterior a esa cola no se detecta;
+para esos casos está la reconstrucción forzada (invalidar el ticker).
+"""
+
+import os
+import math
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from app.ml.core.registro_features import COLUMNAS_INDICADORES
+
+logger = logging.getLogger(__name__)
+
+# Subir si cambia la forma de calcular algún indicador para invalidar los estados guardados
+VERSION_ESTADO = 1
+
+
+class _Ventana:
+    """Buffer circular de tamaño fijo con semántica rolling de pandas (NaN si incompleta o con NaN)"""
+
+    __slots__ = ('tamano', 'valores')
+
+    def __init__(self, tamano: int):
+        self.tamano = tamano
+        self.valores = deque(maxlen=tamano)
+
+    def agregar(self, valor: float):
+        self.valores.append(valor)
+
+    def llena(self) -> bool:
+        return len(self.valores) == self.tamano and not any(math.isnan(v) for v in self.valores)
+
+    def suma(self) -> float:
+        return math.fsum(self.valores) if self.llena() else math.nan
+
+    def media(self) -> float:
+        return self.suma() / self.tamano if self.llena() else math.nan
+
+    def std(self) -> float:
+        return float(np.std(self.valores, ddof=1)) if self.llena() else math.nan
+
+    def maximo(self) -> float:
+        return max(self.valores) if self.llena() else math.nan
+
+    def minimo(self) -> float:
+        return min(self.valores) if self.llena() else math.nan
+
+    def argmax(self) -> float:
+        if not self.llena():
+            return math.nan
+        vals = list(self.valores)
+        return float(vals.index(max(vals)))
+
+    def argmin(self) -> float:
+        if not self.llena():
+            return math.nan
+        vals = list(self.valores)
+        return float(vals.index(min(vals)))
+
+
+def _div(a: float, b: float) -> float:
+    """División con semántica NumPy: x/0 -> ±inf, 0/0 -> NaN"""
+    if math.isnan(a) or math.isnan(b):
+        return math.nan
+    if b == 0:
+        return math.nan if a == 0 else math.copysign(math.inf, a)
+    return a / b
+
+
+def _log_ratio(a: float, b: float) -> float:
+    """log(a / b) con inf -> 0, como LogReturn en el registro de features"""
+    r = _div(a, b)
+    if math.isnan(r) or r < 0:
+        return math.nan
+    if r == 0 or math.isinf(r):
+        return 0.0
+    return math.log(r)
+
+
+def _clip_min(x: float, minimo: float) -> float:
+    return x if math.isnan(x) else max(x, minimo)
+
+
+def _sin_inf(x: float, valor: float = 0.0) -> float:
+    return valor if math.isinf(x) else x
+
+
+class EstadoIndicadores:
+    """Estado streaming de un ticker: agrega una barra y devuelve la nueva fila de features"""
+
+    def __init__(self, ticker: str, columnas: List[str], dias_memoria: int):
+        self.ticker = ticker
+        # Sólo indicadores del registro; NewsSentiment se agrega aparte
+        self.columnas = [c for c in columnas if c in COLUMNAS_INDICADORES]
+        self.dias_memoria = dias_memoria
+        self.version = VERSION_ESTADO
+        self.ultima_fecha = None
+        self.n_barras = 0
+
+        # Acumuladores
+        self.close_prev = math.nan
+        self.ema50 = self.ema12 = self.ema26 = math.nan
+        self.trix_num = [0.0, 0.0, 0.0]
+        self.trix_den = [0.0, 0.0, 0.0]
+        self.trix_prev = math.nan
+        self.obv = 0.0
+        self.vwap_pv = 0.0
+        self.vwap_v = 0.0
+
+        # Buffers circulares
+        self.close_11 = deque(maxlen=11)           # Close.shift(10)
+        self.close_20 = _Ventana(20)
+        self.logret_10 = _Ventana(10)
+        self.tr_14 = _Ventana(14)
+        self.atr_14 = _Ventana(14)
+        self.gain_14 = _Ventana(14)
+        self.loss_14 = _Ventana(14)
+        self.pos_mf_14 = _Ventana(14)
+        self.neg_mf_14 = _Ventana(14)
+        self.mfv_20 = _Ventana(20)
+        self.vol_20 = _Ventana(20)
+        self.stoch_k_3 = _Ventana(3)
+        self.high_9, self.low_9 = _Ventana(9), _Ventana(9)
+        self.high_14, self.low_14 = _Ventana(14), _Ventana(14)
+        self.high_25, self.low_25 = _Ventana(25), _Ventana(25)
+        self.high_26, self.low_26 = _Ventana(26), _Ventana(26)
+
+        # Últimas filas de features (para la ventana de inferencia) y último valor válido (ffill)
+        self.ultimo_valido: Dict[str, float] = {}
+        self.fechas = deque(maxlen=dias_memoria)
+        self.filas = deque(maxlen=dias_memoria)
+
+    @staticmethod
+    def _ema(previo: float, x: float, span: int) -> float:
+        alpha = 2.0 / (span + 1.0)
+        if math.isnan(previo):
+            return x
+        if math.isnan(x):
+            return previo
+        return alpha * x + (1 - alpha) * previo
+
+    def _trix(self, x: float) -> float:
+        """Triple EMA ajustada (adjust=True, span=15) acumulando numerador y denominador"""
+        if math.isnan(x):
+            return self.trix_prev
+        decaimiento = 1 - 2.0 / 16.0
+        valor = x
+        for etapa in range(3):
+            self.trix_num[etapa] = valor + decaimiento * self.trix_num[etapa]
+            self.trix_den[etapa] = 1.0 + decaimiento * self.trix_den[etapa]
+            valor = self.trix_num[etapa] / self.trix_den[etapa]
+        return valor
+
+    def actualizar(self, fecha, close: float, high: float, low: float, volume: float) -> Dict[str, float]:
+        """
+        Agrega una barra OHLCV y devuelve la fila de features saneada (sin NaN/inf si hay historia).
+        Las fechas no pueden retroceder (ValueError si no, sin tocar el estado); una fecha
+        repetida es otra barra, como en calcular_indicadores_arrays (la BD no las impide).
+        """
+        fecha = pd.Timestamp(fecha)
+        if self.ultima_fecha is not None and fecha < pd.Timestamp(self.ultima_fecha):
+            raise ValueError(f"Barra fuera de orden para {self.ticker}: {fecha.date()} < "
+                             f"{pd.Timestamp(self.ultima_fecha).date()} (reconstruir el estado)")
+        C, H, L, V = float(close), float(high), float(low), float(volume)
+        c_prev = self.close_prev
+        self.close_11.append(C)
+        c_10 = self.close_11[0] if len(self.close_11) == 11 else math.nan
+        delta = C - c_prev
+        rango = H - L
+        rango_seguro = _clip_min(rango, 0.001)
+
+        f = {}
+        # Tendenciales
+        self.ema50 = self._ema(self.ema50, C, 50)
+        self.ema12 = self._ema(self.ema12, C, 12)
+        self.ema26 = self._ema(self.ema26, C, 26)
+        f['EMA50'] = self.ema50
+        f['MACD'] = self.ema12 - self.ema26
+        f['LogReturn'] = _log_ratio(C, c_prev)
+        f['Momentum'] = C - c_10
+        f['ROC'] = _div(C - c_10, _clip_min(c_10, 0.001)) * 100
+        trix = self._trix(C)
+        f['TRIX'] = _sin_inf(_div(trix, self.trix_prev) - 1)
+        self.trix_prev = trix
+
+        # Volatilidad
+        self.logret_10.agregar(f['LogReturn'])
+        std10 = self.logret_10.std()
+        f['Volatilidad_10d'] = 0.0 if math.isnan(std10) else std10
+        tr = max(rango, abs(H - c_prev), abs(L - c_prev)) if not math.isnan(c_prev) else math.nan
+        self.tr_14.agregar(tr)
+        f['ATR'] = self.tr_14.media()
+
+        self.close_20.agregar(C)
+        sma20 = self.close_20.media()
+        std20 = _clip_min(self.close_20.std(), 0.001)
+        f['SMA20'] = sma20
+        f['BB_Upper'] = sma20 + 2 * std20
+        f['BB_Lower'] = sma20 - 2 * std20
+        f['Keltner_Channel'] = sma20 + 1.5 * (0.0 if math.isnan(f['ATR']) else f['ATR'])
+        f['Z_Score'] = _sin_inf(_div(C - sma20, std20))
+
+        # Osciladores
+        self.gain_14.agregar(max(delta, 0.0) if not math.isnan(delta) else math.nan)
+        self.loss_14.agregar(-min(delta, 0.0) if not math.isnan(delta) else math.nan)
+        rs = _sin_inf(_div(self.gain_14.media(), _clip_min(self.loss_14.media(), 0.001)), 1.0)
+        f['RSI'] = 100 - (100 / (1 + rs))
+
+        self.high_14.agregar(H)
+        self.low_14.agregar(L)
+        high_max, low_min = self.high_14.maximo(), self.low_14.minimo()
+        denominador = _clip_min(high_max - low_min, 0.001)
+        f['Stochastic_K'] = 100 * _div(C - low_min, denominador)
+        self.stoch_k_3.agregar(f['Stochastic_K'])
+        f['Stochastic_D'] = self.stoch_k_3.media()
+        f['Williams_R'] = -100 * _div(high_max - C, denominador)
+        f['CCI'] = _sin_inf(_div(C - sma20, 0.015 * std20))
+
+        # Volumen
+        typical_price = (H + L + C) / 3
+        money_flow = typical_price * V
+        self.pos_mf_14.agregar(money_flow if delta > 0 else 0.0)
+        self.neg_mf_14.agregar(money_flow if delta <= 0 else 0.0)
+        f['MFI'] = 100 - (100 / (1 + _div(self.pos_mf_14.suma(), _clip_min(self.neg_mf_14.suma(), 0.001))))
+        if not math.isnan(delta) and not math.isnan(V):
+            self.obv += (delta > 0) * V - (delta < 0) * V
+        f['OBV'] = self.obv
+        self.mfv_20.agregar(_sin_inf(_div((C - L) - (H - C), rango_seguro) * V))
+        self.vol_20.agregar(V)
+        f['CMF'] = _div(self.mfv_20.suma(), _clip_min(self.vol_20.suma(), 1))
+        f['Force_Index'] = delta * V
+        if not math.isnan(V * typical_price):
+            self.vwap_pv += V * typical_price
+        if not math.isnan(V):
+            self.vwap_v += V
+        f['VWAP'] = _div(self.vwap_pv, self.vwap_v)
+
+        # Direccionalidad
+        self.high_25.agregar(H)
+        self.low_25.agregar(L)
+        f['Aroon_Up'] = 100 * self.high_25.argmax() / 25
+        f['Aroon_Down'] = 100 * self.low_25.argmin() / 25
+        self.atr_14.agregar(f['ATR'])
+        f['ADX'] = self.atr_14.media()
+
+        # Ichimoku
+        self.high_9.agregar(H)
+        self.low_9.agregar(L)
+        self.high_26.agregar(H)
+        self.low_26.agregar(L)
+        f['Ichimoku_Upper'] = (self.high_9.maximo() + self.low_9.minimo()) / 2
+        f['Ichimoku_Lower'] = (self.high_26.maximo() + self.low_26.minimo()) / 2
+        f['Ultimate_Oscillator'] = _sin_inf(_div(C - L, rango_seguro) * 100)
+
+        self.close_prev = C
+        self.ultima_fecha = fecha
+        self.n_barras += 1
+
+        # Saneamiento: inf -> 0 y ffill con el último valor válido
+        fila = {'Close': C, 'High': H, 'Low': L, 'Volume': V}
+        for col in self.columnas:
+            valor = _sin_inf(f[col])
+            if math.isnan(valor):
+                valor = self.ultimo_valido.get(col, math.nan)
+            else:
+                self.ultimo_valido[col] = valor
+            fila[col] = valor
+
+        self.fechas.append(fecha)
+        self.filas.append(fila)
+        return fila
+
+    def a_dataframe(self) -> pd.DataFrame:
+        """Ventana de las últimas `dias_memoria` filas, indexada por fecha (bfill/0 para el warm-up)"""
+        df = pd.DataFrame(list(self.filas), index=pd.DatetimeIndex(list(self.fechas)))
+        return df.bfill().fillna(0)
+
+    @classmethod
+    def desde_historial(cls, ticker: str, df: pd.DataFrame, columnas: List[str], dias_memoria: int) -> 'EstadoIndicadores':
+        """Reconstruye el estado reproduciendo el historial (DataFrame OHLCV indexado por fecha, orden ascendente)"""
+        estado = cls(ticker, columnas, dias_memoria)
+        for fecha, c, h, l, v in zip(df.index, df['Close'].to_numpy(float), df['High'].to_numpy(float),
+                                     df['Low'].to_numpy(float), df['Volume'].to_numpy(float)):
+            estado.actualizar(fecha, c, h, l, v)
+        return estado
+
+    def coincide_historial(self, fechas, cierres) -> bool:
+        """
+        True si las barras de la BD desde la primera fecha guardada hasta `ultima_fecha`
+        (`fechas`/`cierres` en orden ascendente) son las mismas que las de la cola del estado.
+        Al principio sólo pueden sobrar repeticiones de la primera fecha guardada (filas con
+        esa fecha que ya salieron de la cola).
+        """
+        n = len(self.fechas)
+        fechas = [pd.Timestamp(f) for f in fechas]
+        if len(fechas) < n:
+            return False
+        guardadas = [pd.Timestamp(f) for f in self.fechas]
+        if n == 0 or any(f != guardadas[0] for f in fechas[:len(fechas) - n]) or fechas[len(fechas) - n:] != guardadas:
+            return False
+        return bool(np.allclose([fila['Close'] for fila in self.filas], np.asarray(cierres[len(cierres) - n:], dtype=float),
+                                rtol=1e-9, atol=0.0, equal_nan=True))
+
+    def es_compatible(self, columnas: List[str], dias_memoria: int) -> bool:
+        pedidas = {c for c in columnas if c in COLUMNAS_INDICADORES}
+        return (self.version == VERSION_ESTADO and self.dias_memoria == dias_memoria
+                and pedidas.issubset(self.columnas))
+
+
+class AlmacenEstadosIndicadores:
+    """Persistencia en disco (joblib) de un EstadoIndicadores por ticker"""
+
+    def __init__(self, base_path: str = "app/ml/models/estado_indicadores"):
+        self.base_path = Path(base_path)
+        self.base_path.mkdir(parents=True, exist_ok=True)
+
+    def _ruta(self, ticker: str) -> Path:
+        return self.base_path / f"{str(ticker).upper()}.pkl"
+
+    def cargar(self, ticker: str, columnas: List[str], dias_memoria: int) -> Optional[EstadoIndicadores]:
+        """Devuelve el estado guardado o None si falta, está corrupto o quedó invalidado"""
+        ruta = self._ruta(ticker)
+        if not ruta.exists():
+            return None
+        try:
+            estado = joblib.load(ruta)
+        except Exception as e:
+            logger.warning(f"⚠️ Estado de indicadores corrupto para {ticker}: {e}")
+            return None
+        if not isinstance(estado, EstadoIndicadores) or not estado.es_compatible(columnas, dias_memoria):
+            logger.info(f"♻️ Estado de indicadores de {ticker} invalidado, se reconstruirá")
+            return None
+        return estado
+
+    def guardar(self, estado: EstadoIndicadores):
+        """Escritura atómica: archivo temporal + os.replace"""
+        ruta = self._ruta(estado.ticker)
+        tmp = ruta.with_suffix('.tmp')
+        joblib.dump(estado, tmp)
+        os.replace(tmp, ruta)
+
+    def invalidar(self, ticker: str):
+        ruta = self._ruta(ticker)
+        if ruta.exists():
+            ruta.unlink()
@@ -0,0 +1,140 @@
+"""Cálculo de indicadores en modo panel (todas las empresas a la vez)
+
+Los DataFrames OHLCV de varias empresas se apilan en arreglos (T, N)
+(barras × empresas) y el registro de features se evalúa una sola vez por
+bloque de empresas, en lugar de una llamada a MLEngine.calcular_indicadores
+por DataFrame.
+
+Cada empresa ocupa una columna alineada a la izquierda: su barra i está en
+la fila i y el resto de la columna es relleno NaN (mascara = False). Como
+todos los kernels son causales en el eje temporal, el relleno final no
+afecta a las filas válidas y el resultado es idéntico al cálculo por
+DataFrame. Las fechas se conservan por empresa para reconstruir el índice.
+"""
+
+import logging
+from typing import Dict, Hashable, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.ml.core.indicadores_vectorizados import rellenar
+from app.ml.core.registro_features import COLUMNAS_BASE, calcular_indicadores_arrays
+
+logger = logging.getLogger(__name__)
+
+
+class PanelOHLCV:
+    """Arreglos (T, N) alineados a la izquierda con máscara de filas válidas"""
+
+    def __init__(self, claves: List[Hashable], indices: List[pd.Index],
+                 columnas: Dict[str, np.ndarray], longitudes: np.ndarray):
+        self.claves = claves
+        self.indices = indices
+        self.columnas = columnas
+        self.longitudes = longitudes
+
+    @property
+    def forma(self):
+        return (int(self.longitudes.max(initial=0)), len(self.claves))
+
+    @property
+    def mascara(self) -> np.ndarray:
+        """True donde la fila t existe para la empresa n"""
+        return np.arange(self.forma[0])[:, None] < self.longitudes[None, :]
+
+    @classmethod
+    def desde_dataframes(cls, dfs: Dict[Hashable, pd.DataFrame],
+                         columnas: Optional[Iterable[str]] = None) -> 'PanelOHLCV':
+        """
+        Apila DataFrames de distinta longitud en un panel.
+
+        Args:
+            dfs: clave (id/ticker) -> DataFrame con al menos Close, High, Low, Volume
+            columnas: columnas a apilar (None = unión de las columnas de todos los DataFrames)
+        """
+        claves = list(dfs)
+        if columnas is None:
+            columnas = list(dict.fromkeys(c for df in dfs.values() for c in df.columns))
+        longitudes = np.array([len(dfs[k]) for k in claves], dtype=np.int64)
+        T, N = int(longitudes.max(initial=0)), len(claves)
+
+        arreglos = {}
+        for col in columnas:
+            panel = np.full((T, N), np.nan)
+            for j, k in enumerate(claves):
+                if col in dfs[k].columns:
+                    panel[:longitudes[j], j] = dfs[k][col].to_numpy(dtype=np.float64, na_value=np.nan)
+            arreglos[col] = panel
+
+        return cls(claves, [dfs[k].index for k in claves], arreglos, longitudes)
+
+
+def _agrupar_en_bloques(longitudes: List[int], celdas_por_bloque: int, empresas_por_bloque: int) -> List[slice]:
+    """Cortes consecutivos (longitudes ya ordenadas) con T_max * N <= celdas_por_bloque"""
+    bloques, inicio = [], 0
+    for fin in range(1, len(longitudes) + 1):
+        n = fin - inicio
+        if n > empresas_por_bloque or (n > 1 and longitudes[fin - 1] * n > celdas_por_bloque):
+            bloques.append(slice(inicio, fin - 1))
+            inicio = fin - 1
+    if inicio < len(longitudes):
+        bloques.append(slice(inicio, len(longitudes)))
+    return bloques
+
+
+def calcular_indicadores_panel(dfs: Dict[Hashable, pd.DataFrame], columnas: Optional[Iterable[str]] = None,
+                               celdas_por_bloque: int = 16_384,
+                               empresas_por_bloque: int = 256, dtype=np.float64) -> Dict[Hashable, pd.DataFrame]:
+    """
+    Equivalente a MLEngine.calcular_indicadores (sin NewsSentiment) para muchos DataFrames.
+
+    Las empresas se ordenan por longitud y se agrupan en paneles de a lo sumo
+    `celdas_por_bloque` celdas (T × N): historias cortas se apilan por
+    decenas, historias largas en pocos paneles que aún caben en caché.
+
+    Args:
+        dfs: clave -> DataFrame OHLCV
+        columnas: features a calcular (None = todas las del registro)
+        celdas_por_bloque: tamaño máximo de cada panel (filas × empresas)
+        empresas_por_bloque: tope de empresas por panel
+        dtype: tipo de las columnas devueltas (los kernels acumulan en float64)
+
+    Returns:
+        clave -> DataFrame con las columnas originales saneadas + indicadores,
+        en el mismo orden de `dfs`. Las claves con datos inválidos se omiten.
+    """
+    validos = {}
+    for clave, df in dfs.items():
+        if df is None or df.empty or any(c not in df.columns for c in COLUMNAS_BASE):
+            logger.warning(f"⚠️ {clave}: DataFrame vacío o sin columnas OHLCV, se omite del panel")
+            continue
+        close = df['Close'].to_numpy(dtype=np.float64, na_value=np.nan)
+        if np.isnan(close).all() or (close <= 0).all():
+            logger.warning(f"⚠️ {clave}: todos los valores de Close son inválidos")
+            continue
+        validos[clave] = df
+
+    ordenadas = sorted(validos, key=lambda k: len(validos[k]))
+    resultados = {}
+
+    longitudes = [len(validos[k]) for k in ordenadas]
+    for corte in _agrupar_en_bloques(longitudes, celdas_por_bloque, empresas_por_bloque):
+        bloque = {k: validos[k] for k in ordenadas[corte]}
+        panel = PanelOHLCV.desde_dataframes(bloque)
+
+        indicadores = calcular_indicadores_arrays(
+            panel.columnas['Close'], panel.columnas['High'],
+            panel.columnas['Low'], panel.columnas['Volume'],
+            columnas=columnas, dtype=dtype
+        )
+        # Columnas originales: inf -> 0, ffill, bfill, 0 (igual que el camino por DataFrame)
+        originales = {c: rellenar(a).astype(dtype, copy=False) for c, a in panel.columnas.items() if c not in indicadores}
+
+        for j, clave in enumerate(panel.claves):
+            n = panel.longitudes[j]
+            datos = {c: a[:n, j] for c, a in originales.items() if c in bloque[clave].columns}
+            datos.update({c: a[:n, j] for c, a in indicadores.items()})
+            resultados[clave] = pd.DataFrame(datos, index=panel.indices[j])
+
+    return {k: resultados[k] for k in dfs if k in resultados}
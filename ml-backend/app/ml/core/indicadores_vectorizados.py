@@ -0,0 +1,337 @@
+"""Kernels NumPy vectorizados para el cálculo de indicadores técnicos
+
+Todas las funciones operan sobre el eje 0 (tiempo) y aceptan arreglos de
+forma (T,) o (T, N), por lo que sirven tanto para una serie como para un
+panel de tickers. Reproducen la semántica de pandas usada por
+MLEngine.calcular_indicadores: las ventanas incompletas o con NaN
+devuelven NaN (min_periods = window). La composición de los indicadores
+vive en registro_features.py.
+"""
+
+import time
+import logging
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+from numpy.lib.stride_tricks import sliding_window_view
+
+logger = logging.getLogger(__name__)
+
+def _como_2d(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float64)
+    return x.reshape(len(x), -1)
+
+
+def _restaurar_forma(resultado: np.ndarray, original: np.ndarray) -> np.ndarray:
+    return resultado.reshape(np.shape(original))
+
+
+def desplazar(x: np.ndarray, n: int = 1) -> np.ndarray:
+    """Equivalente a Series.shift(n) (n > 0) rellenando con NaN"""
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full_like(x, np.nan)
+    if n < len(x):
+        out[n:] = x[:-n]
+    return out
+
+
+def diferencia(x: np.ndarray) -> np.ndarray:
+    """Equivalente a Series.diff()"""
+    return np.asarray(x, dtype=np.float64) - desplazar(x, 1)
+
+
+def reemplazar_infinitos(x: np.ndarray, valor: float = 0.0) -> np.ndarray:
+    return np.where(np.isinf(x), valor, x)
+
+
+def _conteo_nan_ventana(nan_mask: np.ndarray, window: int) -> np.ndarray:
+    """Cantidad de NaN dentro de cada ventana que termina en t (NaN si la ventana está incompleta)"""
+    cs = np.cumsum(nan_mask, axis=0, dtype=np.int64)
+    out = np.full(nan_mask.shape, np.nan)
+    if len(nan_mask) >= window:
+        conteo = cs[window - 1:].astype(np.float64)
+        conteo[1:] -= cs[:-window]
+        out[window - 1:] = conteo
+    return out
+
+
+def rolling_sum(x: np.ndarray, window: int) -> np.ndarray:
+    """Suma móvil O(n) por diferencia de sumas acumuladas"""
+    a = _como_2d(x)
+    nan_mask = np.isnan(a)
+    cs = np.cumsum(np.where(nan_mask, 0.0, a), axis=0)
+    out = np.full(a.shape, np.nan)
+    if len(a) >= window:
+        suma = cs[window - 1:].copy()
+        suma[1:] -= cs[:-window]
+        out[window - 1:] = suma
+    out[~(_conteo_nan_ventana(nan_mask, window) == 0)] = np.nan
+    return _restaurar_forma(out, x)
+
+
+def rolling_mean(x: np.ndarray, window: int) -> np.ndarray:
+    return rolling_sum(x, window) / window
+
+
+def rolling_std(x: np.ndarray, window: int, filas_por_bloque: int = 4096) -> np.ndarray:
+    """Desviación estándar móvil (ddof=1).
+
+    A diferencia de las sumas, la varianza por sumas acumuladas sufre
+    cancelación numérica en series de precios con mucha tendencia, así que
+    se calcula en dos pasadas sobre vistas deslizantes (O(n·window), con
+    window <= 26 en este motor), procesando por bloques para acotar memoria.
+    """
+    a = _como_2d(x)
+    T, N = a.shape
+    out = np.full((T, N), np.nan)
+    if T < window:
+        return _restaurar_forma(out, x)
+
+    ventanas = sliding_window_view(a, window, axis=0)  # (T-window+1, N, window)
+    for inicio in range(0, len(ventanas), filas_por_bloque):
+        bloque = ventanas[inicio:inicio + filas_por_bloque]
+        out[window - 1 + inicio: window - 1 + inicio + len(bloque)] = bloque.std(axis=-1, ddof=1)
+    return _restaurar_forma(out, x)
+
+
+def _extremo_movil(x: np.ndarray, window: int, buscar_minimo: bool):
+    """
+    Máximo (o mínimo) móvil y su posición dentro de la ventana en O(n).
+
+    Algoritmo de van Herk / Gil-Werman: se parte la serie en bloques de
+    tamaño `window`, se calculan prefijos y sufijos acumulados de cada bloque
+    y cada ventana se resuelve combinando un sufijo y un prefijo. La posición
+    devuelta es la primera ocurrencia, igual que Series.argmax().
+    """
+    a = _como_2d(x)
+    T, N = a.shape
+    valor = np.full((T, N), np.nan)
+    posicion = np.full((T, N), np.nan)
+    if T < window:
+        return valor, posicion
+
+    nan_mask = np.isnan(a)
+    b = -a if buscar_minimo else a.copy()
+    b[nan_mask] = -np.inf
+
+    pad = (-T) % window
+    if pad:
+        b = np.vstack([b, np.full((pad, N), -np.inf)])
+    n_bloques = len(b) // window
+    bloques = b.reshape(n_bloques, window, N)
+    pos = np.broadcast_to(np.arange(len(b)).reshape(n_bloques, window, 1), bloques.shape)
+
+    # Prefijos: máximo acumulado y primera posición donde se alcanza
+    prefijo = np.maximum.accumulate(bloques, axis=1)
+    previo = np.concatenate([np.full((n_bloques, 1, N), -np.inf), prefijo[:, :-1]], axis=1)
+    record = bloques > previo
+    record[:, 0] = True
+    idx_prefijo = np.maximum.accumulate(np.where(record, pos, -1), axis=1)
+
+    # Sufijos: máximo acumulado desde la derecha y posición más a la izquierda
+    sufijo = np.maximum.accumulate(bloques[:, ::-1], axis=1)[:, ::-1]
+    siguiente = np.concatenate([sufijo[:, 1:], np.full((n_bloques, 1, N), -np.inf)], axis=1)
+    record_suf = bloques >= siguiente
+    idx_sufijo = np.minimum.accumulate(np.where(record_suf, pos, len(b))[:, ::-1], axis=1)[:, ::-1]
+
+    prefijo, idx_prefijo = prefijo.reshape(-1, N), idx_prefijo.reshape(-1, N)
+    sufijo, idx_sufijo = sufijo.reshape(-1, N), idx_sufijo.reshape(-1, N)
+
+    inicio = np.arange(T - window + 1)
+    fin = inicio + window - 1
+    izq, der = sufijo[inicio], prefijo[fin]
+    gana_izq = izq >= der
+    valor[window - 1:] = np.where(gana_izq, izq, der)
+    posicion[window - 1:] = np.where(gana_izq, idx_sufijo[inicio], idx_prefijo[fin]) - inicio[:, None]
+
+    invalido = ~(_conteo_nan_ventana(nan_mask, window) == 0)
+    valor[invalido] = np.nan
+    posicion[invalido] = np.nan
+    if buscar_minimo:
+        valor = -valor
+    return valor, posicion
+
+
+def rolling_max(x: np.ndarray, window: int) -> np.ndarray:
+    return _restaurar_forma(_extremo_movil(x, window, buscar_minimo=False)[0], x)
+
+
+def rolling_min(x: np.ndarray, window: int) -> np.ndarray:
+    return _restaurar_forma(_extremo_movil(x, window, buscar_minimo=True)[0], x)
+
+
+def rolling_argmax(x: np.ndarray, window: int) -> np.ndarray:
+    """Posición (0..window-1) del máximo dentro de cada ventana"""
+    return _restaurar_forma(_extremo_movil(x, window, buscar_minimo=False)[1], x)
+
+
+def rolling_argmin(x: np.ndarray, window: int) -> np.ndarray:
+    """Posición (0..window-1) del mínimo dentro de cada ventana"""
+    return _restaurar_forma(_extremo_movil(x, window, buscar_minimo=True)[1], x)
+
+
+def _ema_con_huecos(x: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    ema(adjust=False) de una columna con NaN intermedios, tramo a tramo.
+
+    Como pandas (ignore_na=False), el peso del último valor decae también en
+    los huecos: tras k NaN el siguiente dato pesa α frente a (1-α)^(k+1) del
+    valor previo, normalizados. En los huecos se mantiene el último valor.
+    """
+    decaimiento = 1.0 - alpha
+    out = np.full(len(x), np.nan)
+    idx = np.flatnonzero(~np.isnan(x))
+    previo, fin_previo = None, None
+    for tramo in np.split(idx, np.flatnonzero(np.diff(idx) > 1) + 1):
+        inicio, fin = tramo[0], tramo[-1] + 1
+        y0 = x[inicio]
+        if previo is not None:
+            out[fin_previo:inicio] = previo
+            peso = decaimiento ** (inicio - fin_previo + 1)
+            y0 = (peso * previo + alpha * y0) / (peso + alpha)
+        out[inicio] = y0
+        out[inicio + 1:fin], _ = lfilter([alpha], [1.0, -decaimiento], x[inicio + 1:fin], zi=[decaimiento * y0])
+        previo, fin_previo = out[fin - 1], fin
+    if previo is not None:
+        out[fin_previo:] = previo
+    return out
+
+
+def ema(x: np.ndarray, span: int, adjust: bool = False) -> np.ndarray:
+    """
+    Media móvil exponencial equivalente a Series.ewm(span=span, adjust=adjust).mean().
+
+    Se resuelve como un filtro IIR de primer orden (scipy.signal.lfilter), O(n)
+    en C. Los NaN iniciales se respetan por columna; en los NaN intermedios se
+    repite el último valor y los pesos siguen decayendo (ignore_na=False de
+    pandas). Con adjust=False las columnas con huecos se filtran por tramos.
+    """
+    a = _como_2d(x)
+    alpha = 2.0 / (span + 1.0)
+    decaimiento = 1.0 - alpha
+
+    validos = ~np.isnan(a)
+    hay_dato = np.maximum.accumulate(validos, axis=0)
+
+    if adjust:
+        # y_t = Σ (1-α)^k x_{t-k} / Σ (1-α)^k sobre los datos válidos (los NaN sólo decaen)
+        numerador = lfilter([1.0], [1.0, -decaimiento], np.where(validos, a, 0.0), axis=0)
+        denominador = lfilter([1.0], [1.0, -decaimiento], validos.astype(np.float64), axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = numerador / denominador
+    else:
+        # y_t = α x_t + (1-α) y_{t-1}, con y_0 = x_0 (primer dato válido)
+        primer_idx = np.argmax(validos, axis=0)
+        primer_valor = a[primer_idx, np.arange(a.shape[1])]
+        entrada = np.nan_to_num(np.where(hay_dato, a, primer_valor), nan=0.0)
+        zi = (decaimiento * entrada[0])[None, :]
+        out, _ = lfilter([alpha], [1.0, -decaimiento], entrada, axis=0, zi=zi)
+        for j in np.flatnonzero((hay_dato & ~validos).any(axis=0)):
+            out[:, j] = _ema_con_huecos(a[:, j], alpha)
+
+    out[~hay_dato] = np.nan
+    return _restaurar_forma(out, x)
+
+
+def cumsum_nan(x: np.ndarray) -> np.ndarray:
+    """Equivalente a Series.cumsum(): ignora NaN pero los conserva en su posición"""
+    a = np.asarray(x, dtype=np.float64)
+    out = np.cumsum(np.where(np.isnan(a), 0.0, a), axis=0)
+    out[np.isnan(a)] = np.nan
+    return out
+
+
+def rellenar(x: np.ndarray) -> np.ndarray:
+    """Equivalente a replace([inf, -inf], 0).ffill().bfill().fillna(0) por columna"""
+    a = _como_2d(reemplazar_infinitos(np.asarray(x, dtype=np.float64)))
+    T = len(a)
+    if T == 0:
+        return _restaurar_forma(a, x)
+    validos = ~np.isnan(a)
+
+    idx = np.where(validos, np.arange(T)[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    out = np.take_along_axis(a, idx, axis=0)
+
+    # bfill de los NaN iniciales con el primer valor válido de cada columna
+    primer_idx = np.argmax(validos, axis=0)
+    primer_valor = a[primer_idx, np.arange(a.shape[1])]
+    sin_previo = ~np.maximum.accumulate(validos, axis=0)
+    out = np.where(sin_previo, primer_valor, out)
+    return _restaurar_forma(np.nan_to_num(out, nan=0.0), x)
+
+
+def comparar_con_pandas(df: pd.DataFrame, tolerancia: float = 1e-6) -> Dict[str, float]:
+    """
+    Prueba de paridad: error relativo máximo por columna entre el kernel
+    NumPy y la implementación pandas de referencia de MLEngine.
+
+    El error se mide sobre max(|referencia|, 1); los NaN deben coincidir en posición.
+
+    Raises:
+        AssertionError: si alguna columna supera `tolerancia` o difiere en sus NaN
+    """
+    from app.ml.core.engine import MLEngine
+    from app.ml.core.registro_features import calcular_indicadores_arrays, COLUMNAS_INDICADORES
+
+    referencia = MLEngine._calcular_indicadores_pandas(df)
+    vectorizado = calcular_indicadores_arrays(df['Close'].values, df['High'].values,
+                                              df['Low'].values, df['Volume'].values)
+    errores = {}
+    for col in COLUMNAS_INDICADORES:
+        ref = referencia[col].to_numpy(dtype=np.float64)
+        vec = np.asarray(vectorizado[col], dtype=np.float64)
+        if not np.array_equal(np.isnan(ref), np.isnan(vec)):
+            errores[col] = float('inf')
+            continue
+        escala = np.maximum(np.abs(ref), 1.0)
+        errores[col] = float(np.nanmax(np.abs(vec - ref) / escala, initial=0.0))
+
+    excedidas = {c: e for c, e in errores.items() if e > tolerancia}
+    if excedidas:
+        detalle = ', '.join(f"{c}={e:.2e}" for c, e in sorted(excedidas.items(), key=lambda x: -x[1]))
+        raise AssertionError(f"Paridad NumPy/pandas por encima de {tolerancia:.0e}: {detalle}")
+    return errores
+
+
+def benchmark(n_filas: int = 10_000, repeticiones: int = 3, semilla: int = 42) -> Dict[str, float]:
+    """Mide el tiempo de la versión pandas vs. NumPy sobre una serie sintética de n_filas"""
+    from app.ml.core.engine import MLEngine
+    from app.ml.core.registro_features import calcular_indicadores_arrays
+
+    rng = np.random.default_rng(semilla)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n_filas)))
+    spread = np.abs(rng.normal(0, 0.01, n_filas)) * close
+    df = pd.DataFrame({
+        'Open': close, 'High': close + spread, 'Low': close - spread,
+        'Close': close, 'Volume': rng.integers(1_000, 1_000_000, n_filas).astype(float)
+    }, index=pd.date_range('2000-01-01', periods=n_filas, freq='D'))
+
+    def _medir(fn):
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            fn()
+            tiempos.append(time.perf_counter() - inicio)
+        return min(tiempos)
+
+    t_pandas = _medir(lambda: MLEngine._calcular_indicadores_pandas(df))
+    t_numpy = _medir(lambda: calcular_indicadores_arrays(df['Close'].values, df['High'].values,
+                                                         df['Low'].values, df['Volume'].values))
+    resultado = {
+        'filas': n_filas,
+        'pandas_s': t_pandas,
+        'numpy_s': t_numpy,
+        'speedup': t_pandas / t_numpy if t_numpy > 0 else float('inf'),
+        'max_error_relativo': max(comparar_con_pandas(df).values()),
+    }
+    return resultado
+
+
+if __name__ == "__main__":
+    # python -m app.ml.core.indicadores_vectorizados
+    r = benchmark()
+    print(f"{r['filas']} filas | pandas: {r['pandas_s']*1000:.1f} ms | numpy: {r['numpy_s']*1000:.1f} ms | "
+          f"speedup x{r['speedup']:.1f} | error máx: {r['max_error_relativo']:.2e}")
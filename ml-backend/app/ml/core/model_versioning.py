@@ -19,6 +19,9 @@ class ModelVersionManager:
         self.versiones_dir = self.base_path / "versiones"
         self.versiones_dir.mkdir(exist_ok=True)
 
+        self.checkpoints_dir = self.base_path / "checkpoints"
+        self.checkpoints_dir.mkdir(exist_ok=True)
+
     def guardar_modelo_versionado(
         self,
         modelo_weights: Dict,
@@ -26,11 +29,19 @@ class ModelVersionManager:
         metricas: Dict[str, float],
         nombre_modelo: str,
         version: str,
-        descripcion: str = ""
+        descripcion: str = "",
+        fecha_corte: str = None,
+        version_padre: str = None,
+        perfil: Dict[str, Any] = None
     ) -> str:
         """
         Guarda modelo con versión única
 
+        Args:
+            fecha_corte: última fecha con la que se entrenó ('YYYY-MM-DD'), base del reentrenamiento incremental
+            version_padre: version_id desde cuyos pesos se hizo el ajuste fino (None = desde cero)
+            perfil: traza de rendimiento del entrenamiento (ver perfilador.py), se guarda en perfil.json
+
         Returns:
             Ruta del modelo guardado
         """
@@ -49,6 +60,25 @@ class ModelVersionManager:
         scaler_path = version_dir / "scaler.pkl"
         joblib.dump(scaler, scaler_path)
 
+        archivos = {
+            "modelo": str(model_path.relative_to(self.base_path)),
+            "scaler": str(scaler_path.relative_to(self.base_path))
+        }
+
+        # Perfil de entrenamiento (la traza de torch.profiler, si hubo, se mueve junto a la versión)
+        if perfil is not None:
+            perfil = dict(perfil)
+            traza = perfil.get("traza_torch")
+            if traza and os.path.exists(traza):
+                traza_path = version_dir / "traza_torch.json"
+                shutil.move(traza, traza_path)
+                perfil["traza_torch"] = str(traza_path.relative_to(self.base_path))
+                archivos["traza_torch"] = perfil["traza_torch"]
+            perfil_path = version_dir / "perfil.json"
+            with open(perfil_path, 'w', encoding='utf-8') as f:
+                json.dump(perfil, f, indent=2, ensure_ascii=False)
+            archivos["perfil"] = str(perfil_path.relative_to(self.base_path))
+
         # Metadatos
         metadata = {
             "version_id": version_id,
@@ -57,10 +87,9 @@ class ModelVersionManager:
             "descripcion": descripcion,
             "fecha_creacion": datetime.now().isoformat(),
             "metricas": metricas,
-            "archivos": {
-                "modelo": str(model_path.relative_to(self.base_path)),
-                "scaler": str(scaler_path.relative_to(self.base_path))
-            }
+            "fecha_corte": fecha_corte,
+            "version_padre": version_padre,
+            "archivos": archivos
         }
 
         metadata_path = version_dir / "metadata.json"
@@ -79,6 +108,14 @@ class ModelVersionManager:
 
         return str(version_dir)
 
+    def ruta_checkpoint(self, id_modelo: int) -> str:
+        """Checkpoint de entrenamiento en curso de un modelo (uno por IdModelo)"""
+        return str(self.checkpoints_dir / f"modelo_{id_modelo}.pt")
+
+    def eliminar_checkpoint(self, id_modelo: int):
+        """Borra el checkpoint una vez que el modelo quedó versionado"""
+        Path(self.ruta_checkpoint(id_modelo)).unlink(missing_ok=True)
+
     def cargar_modelo_versionado(self, version_id: str, num_features: int):
         """Carga un modelo específico por versión"""
         version_dir = self.versiones_dir / version_id
@@ -119,6 +156,11 @@ class ModelVersionManager:
         versiones.sort(key=lambda x: x['fecha_creacion'], reverse=True)
         return versiones
 
+    def ultima_version(self, nombre_modelo: str) -> Dict[str, Any]:
+        """Metadatos de la versión más reciente de un modelo (None si no hay ninguna)"""
+        versiones = self.listar_versiones(nombre_modelo)
+        return versiones[0] if versiones else None
+
     def comparar_versiones(self, version_ids: list) -> Dict[str, Any]:
         """Compara métricas entre versiones"""
         comparacion = {"versiones": {}}
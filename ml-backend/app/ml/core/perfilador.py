@@ -0,0 +1,168 @@
+"""Perfilado del entrenamiento por etapas
+
+Acumula por época el tiempo de cada etapa del bucle (carga de datos,
+forward, backward, paso del optimizador, validación y búsqueda de umbral),
+las muestras por segundo y el pico de memoria residente (RSS) del proceso.
+`resumen()` devuelve un dict serializable a JSON que se guarda junto a la
+versión del modelo (perfil.json).
+
+Opcionalmente una época se captura con torch.profiler: en esa época cada
+etapa queda marcada con record_function y la traza se exporta en formato
+Chrome (chrome://tracing o Perfetto).
+"""
+
+import os
+import sys
+import time
+import logging
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import psutil
+import torch
+
+try:
+    import resource  # sólo Unix
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+ETAPAS = ('datos', 'forward', 'backward', 'optimizador', 'validacion', 'umbral')
+
+
+def rss_pico_mb() -> float:
+    """Pico de memoria residente del proceso (MB) desde que arrancó"""
+    if resource is not None:
+        # ru_maxrss: KB en Linux, bytes en macOS
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    memoria = psutil.Process().memory_info()
+    return getattr(memoria, 'peak_wset', memoria.rss) / 1024 ** 2
+
+
+class PerfiladorEntrenamiento:
+    """Tiempos por etapa y época, muestras/seg y RSS pico (ver módulo)"""
+
+    def __init__(self, activo: bool = True, epoca_torch: Optional[int] = None,
+                 dir_trazas: Optional[str] = None, sincronizar: Optional[Callable] = None,
+                 info: Optional[Dict] = None):
+        """
+        Args:
+            activo: False = las etapas no miden nada (sin costo)
+            epoca_torch: época (1-based) a capturar con torch.profiler (None = ninguna)
+            dir_trazas: carpeta de la traza Chrome de torch.profiler
+            sincronizar: se llama al cerrar cada etapa (p.ej. torch.cuda.synchronize)
+            info: datos fijos que encabezan el resumen (arquitectura, precisión, ...)
+        """
+        self.activo = activo
+        self.epoca_torch = epoca_torch
+        self.dir_trazas = dir_trazas
+        self.sincronizar = sincronizar
+        self.info = info or {}
+        self.epocas: List[Dict] = []
+        self.traza_torch = None
+        self.operaciones_torch = None
+        self._tiempos = None
+        self._inicio_epoca = None
+        self._epoca = None
+        self._profiler = None
+
+    def iniciar_epoca(self, epoca: int):
+        """`epoca` 0-based, como en el bucle de entrenamiento"""
+        if not self.activo:
+            return
+        self._epoca = epoca
+        self._tiempos = dict.fromkeys(ETAPAS, 0.0)
+        if self.epoca_torch == epoca + 1 and self.dir_trazas:
+            actividades = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                actividades.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(activities=actividades, profile_memory=True)
+            self._profiler.__enter__()
+        self._inicio_epoca = time.perf_counter()
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        """Suma el tiempo del bloque a la etapa `nombre` de la época en curso"""
+        if not self.activo or self._tiempos is None:
+            yield
+            return
+        marca = torch.profiler.record_function(nombre) if self._profiler is not None else nullcontext()
+        inicio = time.perf_counter()
+        try:
+            with marca:
+                yield
+        finally:
+            if self.sincronizar is not None:
+                self.sincronizar()
+            self._tiempos[nombre] = self._tiempos.get(nombre, 0.0) + time.perf_counter() - inicio
+
+    def acumular(self, nombre: str, segundos: float):
+        """Tiempo medido por fuera (p.ej. la espera del DataLoader entre lotes)"""
+        if self.activo and self._tiempos is not None:
+            self._tiempos[nombre] = self._tiempos.get(nombre, 0.0) + segundos
+
+    def cerrar_epoca(self, muestras: int, segundos_entrenamiento: float):
+        """Registra la época (llamar después de validación y umbral)"""
+        if not self.activo or self._tiempos is None:
+            return
+        self.epocas.append({
+            'epoca': self._epoca + 1,
+            'segundos': round(time.perf_counter() - self._inicio_epoca, 4),
+            'segundos_entrenamiento': round(segundos_entrenamiento, 4),
+            'etapas': {k: round(v, 4) for k, v in self._tiempos.items()},
+            'muestras': int(muestras),
+            'muestras_por_seg': round(muestras / max(segundos_entrenamiento, 1e-9), 1),
+            'rss_pico_mb': round(rss_pico_mb(), 1),
+        })
+        self._tiempos = None
+        if self._profiler is not None:
+            self._exportar_torch()
+
+    def _exportar_torch(self):
+        profiler, self._profiler = self._profiler, None
+        profiler.__exit__(None, None, None)
+        try:
+            os.makedirs(self.dir_trazas, exist_ok=True)
+            nombre = self.info.get('arquitectura', 'modelo')
+            ruta = os.path.join(self.dir_trazas, f"torch_{nombre}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                                                 f"_epoca{self._epoca + 1}.json")
+            profiler.export_chrome_trace(ruta)
+            self.traza_torch = ruta
+            # Las operaciones más costosas también van al resumen (la traza completa puede pesar decenas de MB)
+            promedios = sorted(profiler.key_averages(), key=lambda e: e.self_cpu_time_total, reverse=True)
+            self.operaciones_torch = [
+                {'operacion': e.key, 'llamadas': e.count, 'cpu_propio_ms': round(e.self_cpu_time_total / 1000, 3)}
+                for e in promedios[:15]
+            ]
+        except Exception as e:
+            logger.warning(f"No se pudo exportar la traza de torch.profiler: {e}")
+
+    def estado(self) -> Dict:
+        """Lo acumulado hasta ahora (para el checkpoint de entrenamiento)"""
+        return {'epocas': self.epocas, 'traza_torch': self.traza_torch, 'operaciones_torch': self.operaciones_torch}
+
+    def restaurar(self, estado: Optional[Dict]):
+        """Continúa un perfil guardado con estado() al reanudar desde checkpoint"""
+        for clave, valor in (estado or {}).items():
+            setattr(self, clave, valor)
+
+    def resumen(self) -> Dict:
+        """Traza JSON: épocas, totales por etapa, muestras/seg global y RSS pico"""
+        totales = dict.fromkeys(ETAPAS, 0.0)
+        for epoca in self.epocas:
+            for k, v in epoca['etapas'].items():
+                totales[k] = totales.get(k, 0.0) + v
+        muestras = sum(e['muestras'] for e in self.epocas)
+        segundos_train = sum(e['segundos_entrenamiento'] for e in self.epocas)
+        return {
+            **self.info,
+            'epocas': self.epocas,
+            'totales': {k: round(v, 4) for k, v in totales.items()},
+            'muestras_por_seg': round(muestras / segundos_train, 1) if segundos_train else 0.0,
+            'rss_pico_mb': max((e['rss_pico_mb'] for e in self.epocas), default=round(rss_pico_mb(), 1)),
+            'traza_torch': self.traza_torch,
+            'operaciones_torch': self.operaciones_torch,
+        }
@@ -5,44 +5,141 @@ from torch.utils.data import TensorDataset, DataLoader
 from sklearn.preprocessing import RobustScaler
 from numpy.lib.stride_tricks import sliding_window_view
 import gc
-from typing import Tuple, List, Optional
+from typing import Tuple, List, Optional, Dict, Iterable
 from tqdm import tqdm
+from sqlalchemy import select, cast, Float, and_, or_
 
 from app.db.sessions import SessionLocal
 from app.models.precio_historico import PrecioHistorico
 from app.ml.core.engine import MLEngine
 from app.ml.core.data_utils import preparar_datos_generico, crear_dataloaders_generico
 from app.ml.core.data_validation import DataValidator
+from app.ml.core.indicadores_panel import calcular_indicadores_panel
 
-def _procesar_dataframe_crudo(df: pd.DataFrame, origen_id: str) -> Optional[pd.DataFrame]:
-    """
-    Motor central de procesamiento. Toma un DataFrame crudo estandarizado,
-    aplica indicadores y valida. No le importa si viene de BD o CSV.
-    """
+def _validar_crudo(df: pd.DataFrame, origen_id: str, dtype=None) -> Optional[pd.DataFrame]:
+    """Validación previa al cálculo de indicadores"""
     if len(df) < 60:
         return None
 
-    df = df.astype(float)
-    df.replace([np.inf, -np.inf], np.nan, inplace=True) # Prevenir veneno
-
-    # Validar datos antes de procesar
+    # Los infinitos se tratan como NaN dentro de la validación
+    df = df.astype(dtype or MLEngine.DTYPE_FEATURES)
     df_valido = DataValidator.validar_y_limpiar(df)
 
     if df_valido is None or df_valido.empty:
         print(f"Datos inválidos para origen {origen_id}")
         return None
+    return df_valido
 
-    # Calcular indicadores técnicos (SMA, Bandas, RSI, etc.)
-    df_procesado = MLEngine.calcular_indicadores(df_valido)
-    df_procesado.ffill(inplace=True)
-    df_procesado.bfill(inplace=True)
+def procesar_dataframes_crudos(dfs: Dict[str, pd.DataFrame],
+                               sentimientos: Optional[Dict[str, pd.Series]] = None,
+                               dtype=None) -> Dict[str, pd.DataFrame]:
+    """
+    Procesa muchos DataFrames crudos a la vez: valida cada uno, calcula los
+    indicadores de todos en modo panel (ver indicadores_panel.py) y vuelve a validar.
 
-    # Validar datos procesados
-    df_procesado_valido = DataValidator.validar_y_limpiar(df_procesado)
-    return df_procesado_valido if df_procesado_valido is not None and not df_procesado_valido.empty else None
+    Args:
+        sentimientos: origen_id -> serie diaria precargada (MLEngine.precargar_sentimientos).
+            Sin serie, NewsSentiment queda neutral (0.5) sin consultar la BD.
+        dtype: precisión de trabajo (None = MLEngine.DTYPE_FEATURES)
 
-def extraer_y_procesar_empresa(id_empresa: int) -> Optional[pd.DataFrame]:
-    """Extrae datos de la Base de Datos en Supabase (Producción)"""
+    Returns:
+        origen_id -> DataFrame procesado (se omiten los inválidos)
+    """
+    dtype = dtype or MLEngine.DTYPE_FEATURES
+    validos = {}
+    for origen_id, df in dfs.items():
+        df_valido = _validar_crudo(df, origen_id, dtype)
+        if df_valido is not None:
+            validos[origen_id] = df_valido
+
+    # Sólo los indicadores que consumen los modelos (y sus dependencias), en una pasada por bloque
+    procesados = calcular_indicadores_panel(validos, columnas=MLEngine.FEATURES, dtype=dtype)
+
+    resultados = {}
+    for origen_id, df_procesado in procesados.items():
+        df_procesado = MLEngine._agregar_feature_sentimiento(
+            df_procesado, sentimientos=(sentimientos or {}).get(origen_id))
+        df_procesado['NewsSentiment'] = df_procesado['NewsSentiment'].astype(dtype)
+
+        # Validar datos procesados
+        df_procesado_valido = DataValidator.validar_y_limpiar(df_procesado)
+        if df_procesado_valido is not None and not df_procesado_valido.empty:
+            resultados[origen_id] = df_procesado_valido
+    return resultados
+
+def medir_deriva_float32(dfs: Dict[str, pd.DataFrame]) -> Dict[str, float]:
+    """
+    Cota de la deriva que introduce el modo float32 en las entradas del modelo.
+
+    Procesa los mismos DataFrames crudos en float64 y float32, los escala con
+    un RobustScaler ajustado en float64 y devuelve, por feature, la máxima
+    diferencia absoluta en unidades escaladas.
+    """
+    p64 = procesar_dataframes_crudos(dfs, dtype=np.float64)
+    p32 = procesar_dataframes_crudos(dfs, dtype=np.float32)
+    comunes = [k for k in p64 if k in p32 and len(p64[k]) == len(p32[k])]
+    if not comunes:
+        return {}
+
+    scaler = RobustScaler().fit(np.vstack([p64[k][MLEngine.FEATURES].to_numpy() for k in comunes]))
+    deriva = np.zeros(len(MLEngine.FEATURES))
+    for k in comunes:
+        x64 = scaler.transform(p64[k][MLEngine.FEATURES].to_numpy(dtype=np.float64))
+        x32 = scaler.transform(p32[k][MLEngine.FEATURES].to_numpy(dtype=np.float32))
+        deriva = np.maximum(deriva, np.abs(x64 - x32).max(axis=0))
+    return dict(zip(MLEngine.FEATURES, deriva.tolist()))
+
+def _frame_sintetico_deriva(filas: int = 1500, semilla: int = 0) -> pd.DataFrame:
+    """OHLCV fijo (paseo aleatorio con semilla) para verificar_deriva_float32"""
+    rng = np.random.default_rng(semilla)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, filas)))
+    rango = close * rng.uniform(0.002, 0.03, filas)
+    return pd.DataFrame({
+        'Open': close * (1 + rng.normal(0, 0.005, filas)),
+        'High': close + rango,
+        'Low': close - rango,
+        'Close': close,
+        'Volume': rng.integers(1_000_000, 50_000_000, filas).astype(np.float64),
+    }, index=pd.bdate_range('2015-01-01', periods=filas, name='Date'))
+
+def verificar_deriva_float32(dfs: Optional[Dict[str, pd.DataFrame]] = None,
+                             tolerancia: Optional[float] = None) -> Dict[str, float]:
+    """
+    Falla si el modo float32 se aleja de float64 más de `tolerancia` unidades escaladas.
+
+    Sin `dfs` usa un frame sintético fijo (_frame_sintetico_deriva), donde toda
+    feature queda por debajo de 1e-5. La tolerancia por defecto es la cota de ese
+    frame; con históricos reales de precios de centavos (data/*.csv) RSI y CMF
+    llegan a ~1.6e-3, así que ahí conviene pasar una tolerancia mayor.
+
+    Args:
+        tolerancia: máxima diferencia absoluta por feature (None = MLEngine.TOLERANCIA_DERIVA_FLOAT32)
+
+    Returns:
+        La deriva por feature (medir_deriva_float32)
+
+    Raises:
+        AssertionError: si alguna feature supera la tolerancia o no hay datos comparables
+    """
+    tolerancia = MLEngine.TOLERANCIA_DERIVA_FLOAT32 if tolerancia is None else tolerancia
+    deriva = medir_deriva_float32(dfs if dfs is not None else {'sintetico': _frame_sintetico_deriva()})
+    if not deriva:
+        raise AssertionError("Sin datos comparables entre float64 y float32 para medir la deriva")
+    excedidas = {f: d for f, d in deriva.items() if not d <= tolerancia}
+    if excedidas:
+        detalle = ', '.join(f"{f}={d:.2e}" for f, d in sorted(excedidas.items(), key=lambda x: -x[1]))
+        raise AssertionError(f"Deriva float32 por encima de {tolerancia:.0e} (unidades escaladas): {detalle}")
+    return deriva
+
+def _procesar_dataframe_crudo(df: pd.DataFrame, origen_id: str) -> Optional[pd.DataFrame]:
+    """
+    Motor central de procesamiento. Toma un DataFrame crudo estandarizado,
+    aplica indicadores y valida. No le importa si viene de BD o CSV.
+    """
+    return procesar_dataframes_crudos({origen_id: df}).get(origen_id)
+
+def extraer_precios_empresa(id_empresa: int) -> Optional[pd.DataFrame]:
+    """Extrae el OHLCV crudo de una empresa desde la Base de Datos (sin procesar)"""
     db = SessionLocal()
     try:
         query = db.query(
@@ -62,18 +159,98 @@ def extraer_y_procesar_empresa(id_empresa: int) -> Optional[pd.DataFrame]:
             return None
 
         df.set_index('Date', inplace=True)
-        return _procesar_dataframe_crudo(df, origen_id=f"Empresa_BD_{id_empresa}")
+        return df
 
     except Exception as e:
-        print(f"Error procesando empresa {id_empresa}: {str(e)}")
+        print(f"Error extrayendo empresa {id_empresa}: {str(e)}")
         return None
     finally:
         db.close()
 
-def extraer_y_procesar_desde_csv(ruta_csv: str) -> Optional[pd.DataFrame]:
+COLUMNAS_OHLCV = ('Open', 'High', 'Low', 'Close', 'Volume')
+
+def extraer_precios_masivo(ids_empresas: Optional[Iterable[int]] = None,
+                           filas_por_lote: int = 50_000,
+                           fecha_desde=None,
+                           desde_por_empresa: Optional[Dict[int, object]] = None) -> Dict[int, Dict[str, np.ndarray]]:
+    """
+    Extrae el OHLCV de muchas empresas en una sola consulta ordenada.
+
+    Usa un cursor del lado del servidor (stream_results) que entrega las filas
+    en lotes de `filas_por_lote` tuplas planas (sin objetos ORM); cada lote se
+    convierte a arreglos NumPy y al final se corta por IdEmpresa.
+
+    Args:
+        fecha_desde: si se indica, sólo filas con Fecha estrictamente posterior
+        desde_por_empresa: IdEmpresa -> fecha; cada empresa trae sólo sus filas posteriores
+            (las empresas con la misma fecha comparten una condición IN)
+
+    Returns:
+        IdEmpresa -> {'Date': datetime64[ns], 'Open'...'Volume': float64}
+    """
+    consulta = select(
+        PrecioHistorico.IdEmpresa,
+        PrecioHistorico.Fecha,
+        cast(PrecioHistorico.PrecioApertura, Float),
+        cast(PrecioHistorico.PrecioMaximo, Float),
+        cast(PrecioHistorico.PrecioMinimo, Float),
+        cast(PrecioHistorico.PrecioCierre, Float),
+        cast(PrecioHistorico.Volumen, Float)
+    ).order_by(PrecioHistorico.IdEmpresa, PrecioHistorico.Fecha)
+    if ids_empresas is not None:
+        consulta = consulta.where(PrecioHistorico.IdEmpresa.in_(list(ids_empresas)))
+    if fecha_desde is not None:
+        consulta = consulta.where(PrecioHistorico.Fecha > pd.Timestamp(fecha_desde).date())
+    if desde_por_empresa:
+        grupos: Dict[object, List[int]] = {}
+        for id_empresa, fecha in desde_por_empresa.items():
+            grupos.setdefault(pd.Timestamp(fecha).date(), []).append(int(id_empresa))
+        consulta = consulta.where(or_(*(and_(PrecioHistorico.IdEmpresa.in_(ids), PrecioHistorico.Fecha > fecha)
+                                        for fecha, ids in grupos.items())))
+
+    partes = {c: [] for c in ('IdEmpresa', 'Date') + COLUMNAS_OHLCV}
+    db = SessionLocal()
+    try:
+        resultado = db.execute(consulta.execution_options(stream_results=True, yield_per=filas_por_lote))
+        for lote in resultado.partitions():
+            columnas = list(zip(*lote))
+            partes['IdEmpresa'].append(np.fromiter(columnas[0], dtype=np.int64, count=len(lote)))
+            partes['Date'].append(np.array(columnas[1], dtype='datetime64[ns]'))
+            for nombre, valores in zip(COLUMNAS_OHLCV, columnas[2:]):
+                partes[nombre].append(np.array(valores, dtype=np.float64))  # None -> NaN
+    finally:
+        db.close()
+
+    if not partes['IdEmpresa']:
+        return {}
+    arreglos = {c: np.concatenate(v) for c, v in partes.items()}
+
+    # Filas ya ordenadas por IdEmpresa: cortes donde cambia el id
+    ids = arreglos.pop('IdEmpresa')
+    inicios = np.concatenate([[0], np.flatnonzero(np.diff(ids)) + 1])
+    fines = np.append(inicios[1:], len(ids))
+    return {int(ids[i]): {c: a[i:f] for c, a in arreglos.items()} for i, f in zip(inicios, fines)}
+
+def arreglos_a_dataframe(arreglos: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """DataFrame OHLCV indexado por 'Date' a partir de la salida de extraer_precios_masivo"""
+    return pd.DataFrame({c: arreglos[c] for c in COLUMNAS_OHLCV},
+                        index=pd.DatetimeIndex(arreglos['Date'], name='Date'))
+
+def extraer_y_procesar_empresa(id_empresa: int) -> Optional[pd.DataFrame]:
+    """Extrae datos de la Base de Datos en Supabase (Producción)"""
+    df = extraer_precios_empresa(id_empresa)
+    if df is None:
+        return None
+    try:
+        return _procesar_dataframe_crudo(df, origen_id=f"Empresa_BD_{id_empresa}")
+    except Exception as e:
+        print(f"Error procesando empresa {id_empresa}: {str(e)}")
+        return None
+
+def leer_csv_crudo(ruta_csv: str) -> Optional[pd.DataFrame]:
     """
     Adaptador para archivos CSV locales. 
-    Traduce las columnas de Supabase al estándar del pipeline.
+    Traduce las columnas de Supabase al estándar del pipeline (sin procesar).
     """
     try:
         df = pd.read_csv(ruta_csv)
@@ -100,19 +277,29 @@ def extraer_y_procesar_desde_csv(ruta_csv: str) -> Optional[pd.DataFrame]:
         df.set_index('Date', inplace=True)
         
         # Dejar solo el OHLCV para recalcular indicadores limpios
-        df = df[['Open', 'High', 'Low', 'Close', 'Volume']]
-
-        return _procesar_dataframe_crudo(df, origen_id=f"CSV_{ruta_csv}")
+        return df[['Open', 'High', 'Low', 'Close', 'Volume']]
 
     except Exception as e:
         print(f"Error leyendo CSV {ruta_csv}: {str(e)}")
         return None
 
+def extraer_y_procesar_desde_csv(ruta_csv: str) -> Optional[pd.DataFrame]:
+    """Lee un CSV local y lo procesa con el motor central"""
+    df = leer_csv_crudo(ruta_csv)
+    if df is None:
+        return None
+    try:
+        return _procesar_dataframe_crudo(df, origen_id=f"CSV_{ruta_csv}")
+    except Exception as e:
+        print(f"Error procesando CSV {ruta_csv}: {str(e)}")
+        return None
+
 def preparar_datos(lista_dfs: List[pd.DataFrame], batch_size: int = 50):
     """Valida y prepara la memoria tensorial universalmente"""
     dfs_validos = []
 
     for df in lista_dfs:
+        # Los DataFrames que ya vienen de procesar_dataframes_crudos llevan la marca de validados
         df_valido = DataValidator.validar_y_limpiar(df)
         if df_valido is not None and not df_valido.empty:
             dfs_validos.append(df_valido)
@@ -120,9 +307,8 @@ def preparar_datos(lista_dfs: List[pd.DataFrame], batch_size: int = 50):
     if not dfs_validos:
         raise ValueError("No hay dataframes válidos después de la validación")
 
-    # Usa MLEngine.BALANCE_METHOD automáticamente
     return preparar_datos_generico(dfs_validos, batch_size)
 
-def crear_dataloaders(x_t, yr_t, yc_t, x_v, yr_v, yc_v, batch_size=256):
-    """Crea los lotes para PyTorch"""
-    return crear_dataloaders_generico(x_t, yr_t, yc_t, x_v, yr_v, yc_v, batch_size, drop_last=True)
\ No newline at end of file
+def crear_dataloaders(train_ds, val_ds, batch_size=256):
+    """Crea los lotes para PyTorch (balanceo de clases con MLEngine.BALANCE_METHOD)"""
+    return crear_dataloaders_generico(train_ds, val_ds, batch_size, drop_last=True)
\ No newline at end of file
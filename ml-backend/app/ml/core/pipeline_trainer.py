@@ -1,19 +1,24 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
+import torch.distributed as dist
 from torch.optim.lr_scheduler import CosineAnnealingLR
 import numpy as np
 import copy
+import os
 import sys
+import time
 from tqdm import tqdm
 import logging
 
 from app.ml.core.engine import MLEngine
 from app.ml.core.logger import configurar_logger
 from app.ml.core.metrics import MetricasNormalizadas
-from app.ml.core.validation import validacion_cruzada_k_fold
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, confusion_matrix, mean_absolute_error
+from app.ml.core.validation import validacion_walk_forward
+from sklearn.metrics import roc_auc_score
 from app.ml.core.early_stopping import EarlyStopping
+from app.ml.core.data_utils import ratio_positivo_loader
+from app.ml.core.perfilador import PerfiladorEntrenamiento
 
 class FocalLoss(nn.Module):
     def __init__(self, alpha = 0.25, gamma=2.0, pos_weight=None):
@@ -29,33 +34,85 @@ class FocalLoss(nn.Module):
         focal_loss = self.alpha * (1-pt )**self.gamma * bce_loss
         return focal_loss.mean()
 
+def _es_distribuido() -> bool:
+    """True dentro de un proceso de entrenamiento DDP (ver entrenamiento_distribuido.py)"""
+    return dist.is_available() and dist.is_initialized()
+
+def _rango() -> int:
+    return dist.get_rank() if _es_distribuido() else 0
+
+def _autocast(device, precision: str):
+    """Contexto de precisión mixta: 'bf16' = autocast bfloat16 (pesos maestros en fp32), 'fp32' = sin cambios"""
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=precision == 'bf16')
+
+def _generadores_muestreo(loader) -> list:
+    """Generadores numpy de los samplers del loader (para reanudar con el mismo orden de lotes)"""
+    generadores = []
+    for s in (loader.batch_sampler, getattr(loader.batch_sampler, 'sampler', None), loader.sampler):
+        rng = getattr(s, 'rng', None)
+        if isinstance(rng, np.random.Generator) and all(rng is not g for g in generadores):
+            generadores.append(rng)
+    return generadores
+
 class PipelineTrainer:
-    def __init__(self, architecture_name: str, log_file: str):
+    def __init__(self, architecture_name: str, log_file: str, precision: str = None):
         self.architecture_name = architecture_name
+        self.log_file = log_file
         self.logger = configurar_logger(f"ML.Trainer.{architecture_name}", archivo_log=log_file)
+        # Precisión de forward/pérdida/evaluación: 'fp32' o 'bf16' (None = MLEngine.PRECISION_ENTRENAMIENTO)
+        self.precision = precision
+
+    def _precision(self, precision: str = None) -> str:
+        return precision or self.precision or MLEngine.PRECISION_ENTRENAMIENTO
+
+    def ejecutar_entrenamiento(self, model, train_loader, val_loader, device, epochs=50, pos_weight_factor=1.0,
+                               precision=None, ruta_checkpoint=None, hiperparametros=None, hasta_epoca=None):
+        """
+        Entrena con early stopping sobre el score global de validación.
+
+        Con `ruta_checkpoint` guarda cada MLEngine.CHECKPOINT_CADA_EPOCAS épocas el estado
+        completo (modelo, optimizador, scheduler, early stopping, época y RNG) y, si ya existe
+        un checkpoint compatible, reanuda desde la época siguiente.
+
+        `hiperparametros` reemplaza valores de MLEngine.HIPERPARAMETROS_ENTRENAMIENTO (lr,
+        weight_decay, focal_alpha, focal_gamma). `hasta_epoca` corta el entrenamiento tras esa
+        época dejando el checkpoint listo para seguir (el scheduler sigue planificado a `epochs`).
+
+        El resultado incluye "perfil": tiempos por etapa y época, muestras/seg y RSS pico
+        (ver perfilador.py), con una captura de torch.profiler si MLEngine.EPOCA_TORCH_PROFILER.
+        """
+        precision = self._precision(precision)
+        hp = {**MLEngine.HIPERPARAMETROS_ENTRENAMIENTO, **(hiperparametros or {})}
+        # drop_last: con menos muestras que un lote no hay nada que entrenar (ni pérdida media)
+        if len(train_loader) == 0:
+            raise ValueError(f"El loader de entrenamiento no tiene lotes completos ({len(train_loader.dataset)} "
+                             f"muestras): dataset menor que un lote")
 
-    def ejecutar_entrenamiento(self, model, train_loader, val_loader, device, epochs=50, pos_weight_factor=1.0):
         # Calcular pos_weight dinámicamente
         pos_weight = self._calcular_pos_weight_dinamico(train_loader, device, pos_weight_factor)
         
         criterion_reg = nn.HuberLoss(delta=0.01)
-        criterion_clf = FocalLoss(alpha = 0.25,gamma=2.0, pos_weight=pos_weight)
+        criterion_clf = FocalLoss(alpha=hp['focal_alpha'], gamma=hp['focal_gamma'], pos_weight=pos_weight)
         
         
-        optimizer = optim.AdamW(model.parameters(), lr=0.001, weight_decay=1e-4)
+        optimizer = optim.AdamW(model.parameters(), lr=hp['lr'], weight_decay=hp['weight_decay'])
 
         #Scheduler de LR para mejor convergencia
         scheduler = CosineAnnealingLR(optimizer, T_max=epochs, eta_min=1e-6)
 
+        # Con DDP los pesos se guardan del módulo interno (sin prefijo 'module.')
+        modelo_base = getattr(model, 'module', model)
+
         #Early stopping más paciente y con mejor criterio
         early_stopping = EarlyStopping(paciencia=12, 
                                         delta=0.005, 
-                                        modelo_inicial = model,
+                                        modelo_inicial = modelo_base,
                                         modo = 'max') # Maximiza el score global
 
         self.logger.info("Iniciando entrenamiento mejorado",
                         extra={"architecture": self.architecture_name, "device": device.type.upper(),
-                                "batches": len(train_loader), "epochs": epochs, "pos_weight": pos_weight.item()})
+                                "batches": len(train_loader), "epochs": epochs, "pos_weight": pos_weight.item(),
+                                "precision": precision})
 
         if torch.cuda.is_available():
             self.logger.info("GPU disponible",
@@ -64,53 +121,153 @@ class PipelineTrainer:
 
         mejor_modelo = None
         mejor_score = 0
+        muestras_entrenadas = 0
+        tiempo_entrenamiento = 0.0
+        epoca_inicial = 0
+        mejor_umbral = 0.5
+        epoch = -1
+        historial = []  # score global de validación por época
+
+        perfilador = PerfiladorEntrenamiento(
+            activo=MLEngine.PERFILAR_ENTRENAMIENTO, epoca_torch=MLEngine.EPOCA_TORCH_PROFILER,
+            dir_trazas=MLEngine.DIR_TRAZAS_PERFIL,
+            sincronizar=torch.cuda.synchronize if device.type == 'cuda' else None,
+            info={'arquitectura': self.architecture_name, 'dispositivo': device.type, 'precision': precision,
+                  'lotes_por_epoca': len(train_loader),
+                  'batch_size': train_loader.batch_size or getattr(train_loader.batch_sampler, 'batch_size', None)}
+        )
 
-        for epoch in range(epochs):
+        firma = self._firma_checkpoint(train_loader, val_loader, epochs, precision, hp)
+        estado = self._cargar_checkpoint(ruta_checkpoint, firma) if ruta_checkpoint else None
+        if estado is not None:
+            modelo_base.load_state_dict(estado['modelo'])
+            optimizer.load_state_dict(estado['optimizador'])
+            scheduler.load_state_dict(estado['scheduler'])
+            early_stopping.__dict__.update(estado['early_stopping'])
+            torch.set_rng_state(estado['rng_torch'])
+            for rng, estado_rng in zip(_generadores_muestreo(train_loader), estado['rng_muestreo']):
+                rng.bit_generator.state = estado_rng
+            epoch = estado['epoca']
+            # Un checkpoint escrito al activarse el early stopping ya no tiene épocas pendientes
+            epoca_inicial = epochs if early_stopping.detener else epoch + 1
+            mejor_umbral = estado['mejor_umbral']
+            muestras_entrenadas = estado['muestras_entrenadas']
+            tiempo_entrenamiento = estado['tiempo_entrenamiento']
+            historial = estado.get('historial', [])
+            perfilador.restaurar(estado.get('perfil'))
+            mejor_modelo = early_stopping.mejores_pesos
+            self.logger.info("Entrenamiento reanudado desde checkpoint",
+                             extra={"epoch": epoch + 1, "ruta": ruta_checkpoint,
+                                    "mejor_score": early_stopping.mejor_score})
+
+        ultima_epoca = epochs if hasta_epoca is None else min(epochs, hasta_epoca)
+        for epoch in range(epoca_inicial, ultima_epoca):
             model.train()
             train_loss = 0
             total_batches = len(train_loader)
 
-            loop = tqdm(train_loader, desc=f"Epoch [{epoch+1}/{epochs}]", leave=False, file=sys.stdout)
-
-            for x_b, yr_b, yc_b in loop:
-                x_b, yr_b, yc_b = x_b.to(device, non_blocking=True), yr_b.to(device, non_blocking=True), yc_b.to(device, non_blocking=True)
-                optimizer.zero_grad()
-
-                p_reg, l_clf = model(x_b)
+            # DistributedSampler: cada época baraja distinto pero igual en todos los procesos
+            sampler = getattr(train_loader.batch_sampler, 'sampler', None) or train_loader.sampler
+            if hasattr(sampler, 'set_epoch'):
+                sampler.set_epoch(epoch)
 
-                perdida_base = criterion_reg(p_reg, yr_b) + criterion_clf(l_clf, yc_b)
-                
-                # factor_castigo determina qué tan duro eres con la IA (ej. 0.05, 0.1, 0.5)
-                factor_castigo = 0.0
-                castigo_extremo = factor_castigo * torch.mean(torch.abs(p_reg))
+            loop = tqdm(train_loader, desc=f"Epoch [{epoch+1}/{epochs}]", leave=False, file=sys.stdout,
+                        disable=_rango() > 0)
 
-                loss = perdida_base + castigo_extremo
+            perfilador.iniciar_epoca(epoch)
+            muestras_epoca = 0
 
-                loss.backward()
+            # Rendimiento: tiempo esperando lotes vs. tiempo total de la época
+            inicio_epoca = time.perf_counter()
+            espera_datos = 0.0
+            fin_lote = inicio_epoca
 
-                #Gradient clipping más agresivo
-                torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=0.5)
+            for x_b, yr_b, yc_b in loop:
+                espera = time.perf_counter() - fin_lote
+                espera_datos += espera
+                perfilador.acumular('datos', espera)
+                with perfilador.etapa('datos'):
+                    x_b, yr_b, yc_b = x_b.to(device, non_blocking=True), yr_b.to(device, non_blocking=True), yc_b.to(device, non_blocking=True)
+                with perfilador.etapa('optimizador'):
+                    optimizer.zero_grad()
+
+                with perfilador.etapa('forward'), _autocast(device, precision):
+                    p_reg, l_clf = model(x_b)
+                    p_reg, l_clf = p_reg.float(), l_clf.float()
+
+                    perdida_base = criterion_reg(p_reg, yr_b) + criterion_clf(l_clf, yc_b)
+                    
+                    # factor_castigo determina qué tan duro eres con la IA (ej. 0.05, 0.1, 0.5)
+                    factor_castigo = 0.0
+                    castigo_extremo = factor_castigo * torch.mean(torch.abs(p_reg))
+
+                    loss = perdida_base + castigo_extremo
+
+                with perfilador.etapa('backward'):
+                    loss.backward()
+
+                with perfilador.etapa('optimizador'):
+                    #Gradient clipping más agresivo
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=0.5)
+                    optimizer.step()
 
-                optimizer.step()
                 train_loss += loss.item()
                 loop.set_postfix(loss=loss.item())
+                muestras_entrenadas += len(x_b)
+                muestras_epoca += len(x_b)
+                fin_lote = time.perf_counter()
+
+            duracion_epoca = max(time.perf_counter() - inicio_epoca, 1e-9)
+            tiempo_entrenamiento += duracion_epoca
+
+            if _es_distribuido():
+                # Pérdida media entre procesos (las métricas de validación ya se agregan en predecir_validacion)
+                perdida = torch.tensor([train_loss, total_batches], dtype=torch.float64)
+                dist.all_reduce(perdida)
+                train_loss, total_batches = perdida[0].item(), int(perdida[1].item())
 
             # Actualizar LR
             scheduler.step()
 
-            mejor_umbral = self.optimizar_umbral_decision(model, val_loader, device)
-            # Validación al final de cada epoch
-            val_metrics = self.evaluar_modelo(model, val_loader, device, umbral_decision = mejor_umbral)
-            val_score = MetricasNormalizadas.calcular_score_global(val_metrics)
+            # Validación al final de cada epoch: una sola pasada para umbral y métricas
+            with perfilador.etapa('validacion'):
+                predicciones = self.predecir_validacion(model, val_loader, device, precision=precision)
+            with perfilador.etapa('umbral'):
+                mejor_umbral = self.optimizar_umbral_decision(model, val_loader, device, predicciones=predicciones)
+            with perfilador.etapa('validacion'):
+                val_metrics = self.evaluar_modelo(model, val_loader, device, umbral_decision = mejor_umbral,
+                                                  predicciones=predicciones)
+                val_score = MetricasNormalizadas.calcular_score_global(val_metrics)
+            historial.append(float(val_score))
+            perfilador.cerrar_epoca(muestras_epoca, duracion_epoca)
 
             self.logger.info("Epoch completada",
                             extra={"epoch": epoch+1, "train_loss": train_loss/total_batches,
                             "val_accuracy": val_metrics['accuracy'], "val_auc": val_metrics['auc'],
                             "val_f1": val_metrics['f1_score'], "val_score_global": val_score,
-                            "lr": scheduler.get_last_lr()[0]})
-
-            # Early stopping con mejor criterio
-            early_stopping(val_score, model)
+                            "lr": scheduler.get_last_lr()[0],
+                            "lotes_por_seg": round(total_batches / duracion_epoca, 2),
+                            "muestras_por_seg": round(muestras_epoca / duracion_epoca, 1),
+                            "espera_datos_pct": round(100 * espera_datos / duracion_epoca, 1)})
+
+            # Early stopping con mejor criterio (val_score es idéntico en todos los procesos)
+            early_stopping(val_score, modelo_base)
+
+            cada = MLEngine.CHECKPOINT_CADA_EPOCAS
+            pausa = epoch + 1 == hasta_epoca
+            if ruta_checkpoint and (cada or pausa) and _rango() == 0 and \
+                    (pausa or early_stopping.detener or (epoch + 1) % cada == 0):
+                self._guardar_checkpoint(ruta_checkpoint, {
+                    'firma': firma, 'epoca': epoch, 'modelo': modelo_base.state_dict(),
+                    'optimizador': optimizer.state_dict(), 'scheduler': scheduler.state_dict(),
+                    'early_stopping': {k: getattr(early_stopping, k)
+                                       for k in ('mejor_score', 'contador', 'detener', 'mejores_pesos')},
+                    'rng_torch': torch.get_rng_state(),
+                    'rng_muestreo': [rng.bit_generator.state for rng in _generadores_muestreo(train_loader)],
+                    'mejor_umbral': mejor_umbral, 'muestras_entrenadas': muestras_entrenadas,
+                    'tiempo_entrenamiento': tiempo_entrenamiento, 'historial': historial,
+                    'perfil': perfilador.estado(),
+                })
 
             if early_stopping.detener:
                 self.logger.info("Early stopping activado", extra={"epoch": epoch+1, "mejor_score": early_stopping.mejor_score})
@@ -120,29 +277,67 @@ class PipelineTrainer:
 
         # Retornar mejores pesos encontrados
         if mejor_modelo is None:
-            mejor_modelo = model.state_dict()
+            mejor_modelo = modelo_base.state_dict()
 
-        # Calcular umbral óptimo final
-        umbral_final = self.optimizar_umbral_decision(model, val_loader, device)
+        # Umbral óptimo final: el de la última época (mismos pesos, no hace falta otra pasada)
+        umbral_final = mejor_umbral
 
         self.logger.info("Entrenamiento completado", extra={"epochs_completadas": epoch+1, "architecture": self.architecture_name, "umbral_final": round(umbral_final, 3)})
         
-        return {"pesos": mejor_modelo, "umbral_optimo": umbral_final}
+        return {"pesos": mejor_modelo, "umbral_optimo": umbral_final, "precision": precision,
+                "muestras_por_seg": muestras_entrenadas / max(tiempo_entrenamiento, 1e-9),
+                "historial": historial, "epocas": epoch + 1, "perfil": perfilador.resumen(),
+                "finalizado": early_stopping.detener or epoch + 1 >= epochs}
+
+    def _firma_checkpoint(self, train_loader, val_loader, epochs, precision, hiperparametros) -> dict:
+        """Lo que debe coincidir para reanudar: arquitectura, épocas, datos, hiperparámetros, precisión y procesos"""
+        return {
+            'arquitectura': self.architecture_name, 'epochs': epochs, 'precision': precision,
+            'hiperparametros': hiperparametros,
+            'muestras_train': len(train_loader.dataset), 'muestras_val': len(val_loader.dataset),
+            'lotes': len(train_loader), 'procesos': dist.get_world_size() if _es_distribuido() else 1,
+        }
+
+    def _guardar_checkpoint(self, ruta: str, estado: dict):
+        """Escritura atómica: archivo temporal + os.replace (un corte nunca deja un checkpoint a medias)"""
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        tmp = f"{ruta}.tmp"
+        torch.save(estado, tmp)
+        os.replace(tmp, ruta)
+
+    def _cargar_checkpoint(self, ruta: str, firma: dict):
+        """Estado guardado por _guardar_checkpoint; None si no existe, está corrupto o es de otra configuración"""
+        if not os.path.exists(ruta):
+            return None
+        try:
+            estado = torch.load(ruta, map_location='cpu', weights_only=False)
+        except Exception as e:
+            self.logger.warning("Checkpoint ilegible, se entrena desde cero", extra={"ruta": ruta, "error": str(e)})
+            return None
+        if estado.get('firma') != firma:
+            self.logger.warning("Checkpoint de otra configuración, se entrena desde cero",
+                                extra={"ruta": ruta, "firma_checkpoint": estado.get('firma'), "firma": firma})
+            return None
+        return estado
 
     def _calcular_pos_weight_dinamico(self, train_loader, device, factor=2.0):
         """Calcula el peso positivo dinámicamente basado en la distribución de clases"""
-        total_positivos = 0
-        total_muestras = 0
+        # O(1) con las estadísticas del dataset; sólo se recorre el loader si no las tiene
+        ratio_positivo = ratio_positivo_loader(train_loader)
+
+        if ratio_positivo is None:
+            total_positivos = 0
+            total_muestras = 0
 
-        for _, _, yc_b in train_loader:
-            yc_b = yc_b.to(device)
-            total_positivos += yc_b.sum().item()
-            total_muestras += yc_b.numel()
+            for _, _, yc_b in train_loader:
+                total_positivos += yc_b.sum().item()
+                total_muestras += yc_b.numel()
 
-        if total_muestras == 0:
-            return torch.tensor([factor]).to(device)
+            if total_muestras == 0:
+                return torch.tensor([factor]).to(device)
+
+            ratio_positivo = total_positivos / total_muestras
 
-        ratio_positivo = total_positivos / total_muestras
         ratio_negativo = 1 - ratio_positivo
 
         if ratio_positivo == 0:
@@ -152,95 +347,124 @@ class PipelineTrainer:
 
         return pos_weight
 
-    def evaluar_modelo(self, model, val_loader, device, umbral_decision=0.4):
-        """Umbral de decisión optimizable"""
+    def predecir_validacion(self, model, val_loader, device, precision=None) -> dict:
+        """Una sola pasada de inferencia sobre val_loader, volcada en arreglos preasignados"""
+        precision = self._precision(precision)
         model.eval()
-        y_real_clf, y_prob_clf, y_real_reg, y_pred_reg = [], [], [], []
-
-        with torch.no_grad():
+        capacidad = len(val_loader.dataset)
+        y_real_clf = np.empty(capacidad, dtype=np.float32)
+        y_prob_clf = np.empty(capacidad, dtype=np.float32)
+        y_real_reg = np.empty(capacidad, dtype=np.float32)
+        y_pred_reg = np.empty(capacidad, dtype=np.float32)
+
+        n = 0
+        with torch.no_grad(), _autocast(device, precision):
             for xv, yrv, ycv in val_loader:
-                xv = xv.to(device)
-                p_reg, logits = model(xv)
-
-                y_prob_clf.extend(torch.sigmoid(logits).cpu().numpy().flatten())
-                y_real_clf.extend(ycv.numpy().flatten())
-                y_pred_reg.extend(p_reg.cpu().numpy().flatten())
-                y_real_reg.extend(yrv.numpy().flatten())
+                p_reg, logits = model(xv.to(device, non_blocking=True))
+                m = len(xv)
+                y_prob_clf[n:n + m] = torch.sigmoid(logits).float().cpu().numpy().reshape(-1)
+                y_pred_reg[n:n + m] = p_reg.float().cpu().numpy().reshape(-1)
+                y_real_clf[n:n + m] = ycv.numpy().reshape(-1)
+                y_real_reg[n:n + m] = yrv.numpy().reshape(-1)
+                n += m
 
         # Sanitizar las salidas
-        y_prob_clf = np.nan_to_num(np.array(y_prob_clf), nan=0.0)
-        y_pred_reg = np.nan_to_num(np.array(y_pred_reg), nan=0.0)
+        predicciones = {
+            'y_real_clf': y_real_clf[:n],
+            'y_prob_clf': np.nan_to_num(y_prob_clf[:n], nan=0.0),
+            'y_real_reg': y_real_reg[:n],
+            'y_pred_reg': np.nan_to_num(y_pred_reg[:n], nan=0.0),
+        }
+
+        if _es_distribuido():
+            # Cada proceso evaluó su tramo de validación: se juntan en orden de rango
+            partes = [None] * dist.get_world_size()
+            dist.all_gather_object(partes, predicciones)
+            predicciones = {k: np.concatenate([p[k] for p in partes]) for k in predicciones}
+
+        return predicciones
+
+    def evaluar_modelo(self, model, val_loader, device, umbral_decision=0.4, predicciones=None, precision=None):
+        """Umbral de decisión optimizable (reutiliza `predicciones` si ya se hizo la pasada de validación)"""
+        if predicciones is None:
+            predicciones = self.predecir_validacion(model, val_loader, device, precision=precision)
+        y_real_clf = predicciones['y_real_clf'].astype(int)
+        y_prob_clf = predicciones['y_prob_clf']
 
         # Usar umbral configurable
         y_pred_clf = (y_prob_clf > umbral_decision).astype(int)
 
-        cm = confusion_matrix(y_real_clf, y_pred_clf)
-        tn, fp, fn, tp = cm.ravel() if cm.shape == (2, 2) else (0,0,0,0)
+        tp = int(np.sum((y_pred_clf == 1) & (y_real_clf == 1)))
+        fp = int(np.sum((y_pred_clf == 1) & (y_real_clf == 0)))
+        fn = int(np.sum((y_pred_clf == 0) & (y_real_clf == 1)))
+        tn = int(np.sum((y_pred_clf == 0) & (y_real_clf == 0)))
+        if len(np.unique(np.concatenate([y_real_clf, y_pred_clf]))) < 2:
+            tn, fp, fn, tp = 0, 0, 0, 0
+        n = len(y_real_clf)
 
         return {
-            'accuracy': float(accuracy_score(y_real_clf, y_pred_clf)),
-            'precision': float(precision_score(y_real_clf, y_pred_clf, zero_division=0)),
-            'recall': float(recall_score(y_real_clf, y_pred_clf, zero_division=0)),
-            'f1_score': float(f1_score(y_real_clf, y_pred_clf, zero_division=0)),
+            'accuracy': float(np.mean(y_pred_clf == y_real_clf)) if n else 0.0,
+            'precision': float(tp / (tp + fp)) if (tp + fp) > 0 else 0.0,
+            'recall': float(tp / (tp + fn)) if (tp + fn) > 0 else 0.0,
+            'f1_score': float(2 * tp / (2 * tp + fp + fn)) if tp > 0 else 0.0,
             'auc': float(roc_auc_score(y_real_clf, y_prob_clf)) if len(np.unique(y_real_clf)) > 1 else 0.5,
-            'mae': float(mean_absolute_error(y_real_reg, y_pred_reg)),
+            'mae': float(np.mean(np.abs(predicciones['y_real_reg'].astype(np.float64) - predicciones['y_pred_reg']))) if n else 0.0,
             'val_loss': 0.0,
-            'tp': int(tp),
-            'tn': int(tn),
-            'fp': int(fp),
-            'fn': int(fn)
+            'tp': tp,
+            'tn': tn,
+            'fp': fp,
+            'fn': fn
         }
 
-    def optimizar_umbral_decision(self, model, val_loader, device):
+    @staticmethod
+    def barrido_youden(y_real_clf: np.ndarray, y_prob_clf: np.ndarray,
+                       umbral_min: float = 0.1, umbral_max: float = 0.9):
+        """
+        J de Youden para todos los umbrales candidatos de una vez (curva ROC por ordenamiento).
+
+        Candidatos: 0.1 y cada probabilidad distinta en [umbral_min, umbral_max];
+        la predicción es `prob > umbral`, igual que en evaluar_modelo.
+
+        Returns:
+            (umbral, J, (tn, fp, fn, tp)) del mejor umbral (el menor ante empates)
+        """
+        y = np.asarray(y_real_clf).reshape(-1) > 0.5
+        prob = np.asarray(y_prob_clf, dtype=np.float64).reshape(-1)
+        total_pos = int(y.sum())
+        total_neg = len(y) - total_pos
+        if total_pos == 0 or total_neg == 0:
+            return 0.5, -1.0, (0, 0, 0, 0)
+
+        orden = np.argsort(prob, kind='mergesort')
+        prob_ord = prob[orden]
+        pos_acum = np.concatenate([[0], np.cumsum(y[orden])])
+
+        candidatos = np.unique(np.concatenate([[umbral_min], prob_ord[(prob_ord >= umbral_min) & (prob_ord <= umbral_max)]]))
+        # Filas con prob <= umbral quedan como negativas
+        debajo = np.searchsorted(prob_ord, candidatos, side='right')
+        fn = pos_acum[debajo]
+        tn = debajo - fn
+        tp = total_pos - fn
+        fp = total_neg - tn
+
+        j = tp / total_pos + tn / total_neg - 1
+        mejor = int(np.argmax(j))
+        return float(candidatos[mejor]), float(j[mejor]), (int(tn[mejor]), int(fp[mejor]), int(fn[mejor]), int(tp[mejor]))
+
+    def optimizar_umbral_decision(self, model, val_loader, device, predicciones=None, precision=None):
         # Encuentra el mejor umbral para MAXIMIZAR el balance usando J de Youden
-        model.eval()
-        y_real_clf, y_prob_clf = [], []
-
-        with torch.no_grad():
-            for xv, _, ycv in val_loader:
-                xv = xv.to(device)
-                _, logits = model(xv)
-                y_prob_clf.extend(torch.sigmoid(logits).cpu().numpy().flatten())
-                y_real_clf.extend(ycv.numpy().flatten())
-
-        y_real_clf = np.array(y_real_clf)
-        y_prob_clf = np.array(y_prob_clf)
-
-        mejores_umbral = 0.5
-        mejor_score = -1.0  # <--- CORRECCIÓN: Inicialización obligatoria de la variable
-
-        for umbral in np.arange(0.1, 0.9, 0.05):
-            y_pred_clf = (y_prob_clf > umbral).astype(int)
-
-            # Extraer matriz de confusión para este umbral
-            cm = confusion_matrix(y_real_clf, y_pred_clf)
-            if cm.shape == (2, 2):
-                tn, fp, fn, tp = cm.ravel()
-                
-                # Tasa de Verdaderos Positivos (Recall / Sensibilidad)
-                tpr = tp / (tp + fn) if (tp + fn) > 0 else 0
-                # Tasa de Verdaderos Negativos (Especificidad)
-                tnr = tn / (tn + fp) if (tn + fp) > 0 else 0
-                
-                # Estadístico J de Youden (balancea TP y TN)
-                score = tpr + tnr - 1
-            else:
-                score = -1.0
-
-            if score > mejor_score:
-                mejor_score = score
-                mejores_umbral = umbral
-
-        # Extraer la matriz de confusión del mejor umbral para el log
-        y_pred_final = (y_prob_clf > mejores_umbral).astype(int)
-        cm = confusion_matrix(y_real_clf, y_pred_final)
-        tn, fp, fn, tp = cm.ravel() if cm.shape == (2, 2) else (0,0,0,0)
+        if predicciones is None:
+            predicciones = self.predecir_validacion(model, val_loader, device, precision=precision)
+
+        mejores_umbral, mejor_score, (tn, fp, fn, tp) = self.barrido_youden(
+            predicciones['y_real_clf'], predicciones['y_prob_clf']
+        )
 
         # Log enriquecido
         self.logger.info(
             "Umbral optimizado", 
             extra={
-                "umbral_optimo": round(mejores_umbral, 2), 
+                "umbral_optimo": round(mejores_umbral, 4), 
                 "mejor_youden": round(mejor_score, 4),
                 "tp_estimados": int(tp),
                 "fp_estimados": int(fp),
@@ -251,46 +475,46 @@ class PipelineTrainer:
         
         return mejores_umbral
 
-    def ejecutar_validacion_cruzada(self, model_class, data_processor, device, k=5, epochs=50):
+    def comparar_precisiones(self, constructor, train_loader, val_loader, device, epochs=3,
+                             precisiones=('fp32', 'bf16'), semilla=42) -> list:
+        """
+        Entrena la misma arquitectura desde la misma inicialización en cada precisión y
+        devuelve muestras/seg y métricas de validación lado a lado (para adoptar bf16 por arquitectura).
+        """
+        filas = []
+        for precision in precisiones:
+            torch.manual_seed(semilla)
+            modelo = constructor(dias_pasados=MLEngine.DIAS_MEMORIA_IA, num_features=len(MLEngine.FEATURES)).to(device)
+            resultado = self.ejecutar_entrenamiento(modelo, train_loader, val_loader, device, epochs, precision=precision)
+            metricas = self.evaluar_modelo(modelo, val_loader, device, resultado["umbral_optimo"], precision=precision)
+            filas.append({
+                "precision": precision,
+                "muestras_por_seg": round(resultado["muestras_por_seg"], 1),
+                "accuracy": metricas["accuracy"], "auc": metricas["auc"], "f1_score": metricas["f1_score"],
+                "mae": metricas["mae"], "score_global": float(MetricasNormalizadas.calcular_score_global(metricas)),
+            })
+
+        self.logger.info("Comparación de precisión", extra={"architecture": self.architecture_name, "filas": filas})
+        return filas
+
+    def ejecutar_validacion_cruzada(self, constructor, dataset, k=5, epochs=50, batch_size=256, max_procesos=None):
         """
-        Ejecuta validación cruzada k-fold para el modelo con mejoras.
+        Validación cruzada walk-forward con purga (ver validation.validacion_walk_forward).
 
         Args:
-            model_class: Clase del modelo
-            data_processor: Instancia del data processor
-            device: Dispositivo para entrenamiento
-            k: Número de folds para validación cruzada
+            constructor: fábrica del modelo (obtener_modelo_vX)
+            dataset: DatasetVentanas a particionar (normalmente el split de entrenamiento)
+            k: Número de folds
             epochs: Número de epochs por fold
 
         Returns:
-            dict: Resultados de validación cruzada con métricas promedio
+            dict: métricas por fold, promedio y desviación
         """
-        self.logger.info("Iniciando validación cruzada mejorada", extra={"architecture": self.architecture_name, "k_folds": k, "epochs_por_fold": epochs})
+        self.logger.info("Iniciando validación cruzada walk-forward", extra={"architecture": self.architecture_name, "k_folds": k, "epochs_por_fold": epochs})
 
-        def train_fold_function(train_data, val_data):
-            # Crear modelo para este fold
-            model = model_class()
-            model.to(device)
-
-            # Preparar dataloaders
-            train_loader = data_processor.crear_dataloaders_generico(train_data, batch_size=64, shuffle=True)
-            val_loader = data_processor.crear_dataloaders_generico(val_data, batch_size=64, shuffle=False)
-
-            # Entrenar modelo con mejoras
-            mejores_pesos = self.ejecutar_entrenamiento(model, train_loader, val_loader, device, epochs)
-
-            # Cargar mejores pesos y evaluar
-            model.load_state_dict(mejores_pesos)
-            metrics = self.evaluar_modelo(model, val_loader, device)
-
-            return MetricasNormalizadas.calcular_score_global(metrics), metrics
-
-        # Ejecutar validación cruzada
-        resultados = validacion_cruzada_k_fold(
-            data_processor.df_procesado,
-            train_fold_function,
-            k=k
-        )
+        resultados = validacion_walk_forward(constructor, dataset, k=k, epochs=epochs, batch_size=batch_size,
+                                             max_procesos=max_procesos, nombre_trainer=self.architecture_name,
+                                             log_file=self.log_file, precision=self.precision)
 
         self.logger.info("Validación cruzada completada",
                         extra={"architecture": self.architecture_name, "score_promedio": resultados['score_promedio'],
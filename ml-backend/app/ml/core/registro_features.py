@@ -0,0 +1,216 @@
+"""Registro declarativo de features técnicas
+
+Cada indicador declara de qué columnas depende. Al pedir una lista de
+features se resuelve el grafo de dependencias (DAG) y se calcula cada
+intermedio una sola vez (p. ej. Close.diff(), media y desviación de 20
+días), omitiendo los indicadores que nadie pidió.
+
+Las entradas base son 'Close', 'High', 'Low' y 'Volume'. Los nombres que
+empiezan con '_' son intermedios internos y nunca se devuelven.
+"""
+
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.ml.core.indicadores_vectorizados import (
+    desplazar, reemplazar_infinitos, rolling_sum, rolling_mean, rolling_std,
+    rolling_max, rolling_min, rolling_argmax, rolling_argmin, ema, cumsum_nan, rellenar
+)
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS_BASE = ('Close', 'High', 'Low', 'Volume')
+
+
+class RegistroFeatures:
+    """Catálogo de features con sus dependencias y resolución en orden topológico"""
+
+    def __init__(self):
+        self._definiciones: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {}
+        self._publicas: List[str] = []
+
+    def registrar(self, nombre: str, depende: Iterable[str] = ()):
+        """Decorador: registra `fn(cache) -> np.ndarray` bajo `nombre`"""
+        def decorador(fn: Callable):
+            if nombre in self._definiciones:
+                raise ValueError(f"Feature duplicada en el registro: {nombre}")
+            self._definiciones[nombre] = (fn, tuple(depende))
+            if not nombre.startswith('_'):
+                self._publicas.append(nombre)
+            return fn
+        return decorador
+
+    @property
+    def columnas(self) -> List[str]:
+        """Features públicas en orden de registro"""
+        return list(self._publicas)
+
+    def conoce(self, nombre: str) -> bool:
+        """True si `nombre` es una feature pública del registro"""
+        return nombre in self._definiciones and not nombre.startswith('_')
+
+    def resolver(self, solicitadas: Iterable[str]) -> List[str]:
+        """Orden topológico (DFS) de todo lo necesario para calcular `solicitadas`"""
+        orden, visitados, en_curso = [], set(), set()
+
+        def visitar(nombre: str):
+            if nombre in visitados or nombre in COLUMNAS_BASE:
+                return
+            if nombre in en_curso:
+                raise ValueError(f"Dependencia circular en el registro de features: {nombre}")
+            if nombre not in self._definiciones:
+                raise KeyError(f"Feature no registrada: {nombre}")
+            en_curso.add(nombre)
+            for dep in self._definiciones[nombre][1]:
+                visitar(dep)
+            en_curso.discard(nombre)
+            visitados.add(nombre)
+            orden.append(nombre)
+
+        for nombre in solicitadas:
+            visitar(nombre)
+        return orden
+
+    def calcular(self, base: Dict[str, np.ndarray], solicitadas: Iterable[str],
+                 dtype=np.float64) -> Dict[str, np.ndarray]:
+        """
+        Calcula las features pedidas a partir de las columnas base.
+
+        Los kernels acumulan siempre en float64 (sumas acumuladas, OBV, VWAP);
+        `dtype` sólo define el tipo de los arreglos devueltos.
+
+        Returns:
+            Dict columna -> arreglo saneado, en el orden de registro
+        """
+        solicitadas = [c for c in solicitadas if c not in COLUMNAS_BASE]
+        cache = {col: np.asarray(base[col], dtype=np.float64) for col in COLUMNAS_BASE if col in base}
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for nombre in self.resolver(solicitadas):
+                cache[nombre] = self._definiciones[nombre][0](cache)
+
+        pedidas = set(solicitadas)
+        return {col: rellenar(cache[col]).astype(dtype, copy=False) for col in self._publicas if col in pedidas}
+
+
+REGISTRO_INDICADORES = RegistroFeatures()
+_r = REGISTRO_INDICADORES.registrar
+
+# --- Intermedios compartidos ---
+_r('_c_prev', ['Close'])(lambda c: desplazar(c['Close'], 1))
+_r('_c_10', ['Close'])(lambda c: desplazar(c['Close'], 10))
+_r('_delta', ['Close', '_c_prev'])(lambda c: c['Close'] - c['_c_prev'])
+_r('_rango', ['High', 'Low'])(lambda c: c['High'] - c['Low'])
+_r('_rango_seguro', ['_rango'])(lambda c: np.clip(c['_rango'], 0.001, None))
+_r('_ema12', ['Close'])(lambda c: ema(c['Close'], 12))
+_r('_ema26', ['Close'])(lambda c: ema(c['Close'], 26))
+_r('_trix_ema', ['Close'])(lambda c: ema(ema(ema(c['Close'], 15, adjust=True), 15, adjust=True), 15, adjust=True))
+_r('_sma20', ['Close'])(lambda c: rolling_mean(c['Close'], 20))
+_r('_std20', ['Close'])(lambda c: np.clip(rolling_std(c['Close'], 20), 0.001, None))
+_r('_true_range', ['_rango', 'High', 'Low', '_c_prev'])(
+    lambda c: np.maximum(c['_rango'], np.maximum(np.abs(c['High'] - c['_c_prev']), np.abs(c['Low'] - c['_c_prev']))))
+_r('_low_min14', ['Low'])(lambda c: rolling_min(c['Low'], 14))
+_r('_high_max14', ['High'])(lambda c: rolling_max(c['High'], 14))
+_r('_denominador_estocastico', ['_high_max14', '_low_min14'])(
+    lambda c: np.clip(c['_high_max14'] - c['_low_min14'], 0.001, None))
+_r('_typical_price', ['High', 'Low', 'Close'])(lambda c: (c['High'] + c['Low'] + c['Close']) / 3)
+_r('_money_flow', ['_typical_price', 'Volume'])(lambda c: c['_typical_price'] * c['Volume'])
+
+# --- Indicadores tendenciales ---
+_r('EMA50', ['Close'])(lambda c: ema(c['Close'], 50))
+_r('MACD', ['_ema12', '_ema26'])(lambda c: c['_ema12'] - c['_ema26'])
+_r('LogReturn', ['Close', '_c_prev'])(lambda c: reemplazar_infinitos(np.log(c['Close'] / c['_c_prev'])))
+_r('Momentum', ['Close', '_c_10'])(lambda c: c['Close'] - c['_c_10'])
+_r('ROC', ['Close', '_c_10'])(lambda c: ((c['Close'] - c['_c_10']) / np.clip(c['_c_10'], 0.001, None)) * 100)
+_r('TRIX', ['_trix_ema'])(lambda c: reemplazar_infinitos(c['_trix_ema'] / desplazar(c['_trix_ema'], 1) - 1))
+
+# --- Volatilidad ---
+_r('Volatilidad_10d', ['LogReturn'])(lambda c: np.nan_to_num(rolling_std(c['LogReturn'], 10), nan=0.0))
+_r('ATR', ['_true_range'])(lambda c: rolling_mean(c['_true_range'], 14))
+_r('SMA20', ['_sma20'])(lambda c: c['_sma20'])
+_r('BB_Upper', ['_sma20', '_std20'])(lambda c: c['_sma20'] + 2 * c['_std20'])
+_r('BB_Lower', ['_sma20', '_std20'])(lambda c: c['_sma20'] - 2 * c['_std20'])
+_r('Keltner_Channel', ['_sma20', 'ATR'])(lambda c: c['_sma20'] + 1.5 * np.nan_to_num(c['ATR'], nan=0.0))
+_r('Z_Score', ['Close', '_sma20', '_std20'])(lambda c: reemplazar_infinitos((c['Close'] - c['_sma20']) / c['_std20']))
+
+
+# --- Osciladores ---
+@_r('RSI', ['_delta'])
+def _rsi(c):
+    gain = rolling_mean(np.maximum(c['_delta'], 0), 14)
+    loss = rolling_mean(-np.minimum(c['_delta'], 0), 14)
+    rs = reemplazar_infinitos(gain / np.clip(loss, 0.001, None), 1)
+    return 100 - (100 / (1 + rs))
+
+
+_r('Stochastic_K', ['Close', '_low_min14', '_denominador_estocastico'])(
+    lambda c: 100 * ((c['Close'] - c['_low_min14']) / c['_denominador_estocastico']))
+_r('Stochastic_D', ['Stochastic_K'])(lambda c: rolling_mean(c['Stochastic_K'], 3))
+_r('Williams_R', ['Close', '_high_max14', '_denominador_estocastico'])(
+    lambda c: -100 * ((c['_high_max14'] - c['Close']) / c['_denominador_estocastico']))
+_r('CCI', ['Close', '_sma20', '_std20'])(
+    lambda c: reemplazar_infinitos((c['Close'] - c['_sma20']) / (0.015 * c['_std20'])))
+
+
+# --- Volumen ---
+@_r('MFI', ['_delta', '_money_flow'])
+def _mfi(c):
+    positive_mf = np.where(c['_delta'] > 0, c['_money_flow'], 0)
+    negative_mf = np.where(c['_delta'] <= 0, c['_money_flow'], 0)
+    return 100 - (100 / (1 + (rolling_sum(positive_mf, 14) /
+                              np.clip(rolling_sum(negative_mf, 14), 0.001, None))))
+
+
+_r('OBV', ['_delta', 'Volume'])(lambda c: np.cumsum(np.nan_to_num(np.sign(c['_delta']) * c['Volume'], nan=0.0), axis=0))
+
+
+@_r('CMF', ['Close', 'High', 'Low', 'Volume', '_rango_seguro'])
+def _cmf(c):
+    money_flow_volume = reemplazar_infinitos(
+        ((c['Close'] - c['Low']) - (c['High'] - c['Close'])) / c['_rango_seguro'] * c['Volume'])
+    return rolling_sum(money_flow_volume, 20) / np.clip(rolling_sum(c['Volume'], 20), 1, None)
+
+
+_r('Force_Index', ['_delta', 'Volume'])(lambda c: c['_delta'] * c['Volume'])
+_r('VWAP', ['Volume', '_typical_price'])(
+    lambda c: cumsum_nan(c['Volume'] * c['_typical_price']) / cumsum_nan(c['Volume']))
+
+# --- Direccionalidad ---
+_r('Aroon_Up', ['High'])(lambda c: 100 * rolling_argmax(c['High'], 25) / 25)
+_r('Aroon_Down', ['Low'])(lambda c: 100 * rolling_argmin(c['Low'], 25) / 25)
+_r('ADX', ['ATR'])(lambda c: rolling_mean(c['ATR'], 14))
+
+# --- Ichimoku ---
+_r('Ichimoku_Upper', ['High', 'Low'])(lambda c: (rolling_max(c['High'], 9) + rolling_min(c['Low'], 9)) / 2)
+_r('Ichimoku_Lower', ['High', 'Low'])(lambda c: (rolling_max(c['High'], 26) + rolling_min(c['Low'], 26)) / 2)
+
+_r('Ultimate_Oscillator', ['Close', 'Low', '_rango_seguro'])(
+    lambda c: reemplazar_infinitos(((c['Close'] - c['Low']) / c['_rango_seguro']) * 100))
+
+# Orden de columnas generado por MLEngine.calcular_indicadores
+COLUMNAS_INDICADORES = REGISTRO_INDICADORES.columnas
+
+
+def calcular_indicadores_arrays(close: np.ndarray, high: np.ndarray, low: np.ndarray,
+                                volume: np.ndarray, columnas: Optional[Iterable[str]] = None,
+                                dtype=np.float64) -> Dict[str, np.ndarray]:
+    """
+    Calcula los indicadores técnicos de MLEngine sobre arreglos NumPy.
+
+    Args:
+        close, high, low, volume: arreglos (T,) o (T, N) alineados en el tiempo
+        columnas: features a calcular (None = todas las registradas). Los
+            nombres que no son indicadores (p. ej. 'NewsSentiment') se ignoran.
+        dtype: tipo de los arreglos devueltos (np.float32 reduce a la mitad la memoria)
+
+    Returns:
+        Dict columna -> arreglo ya saneado (sin NaN ni infinitos)
+    """
+    if columnas is None:
+        columnas = COLUMNAS_INDICADORES
+    else:
+        columnas = [c for c in columnas if REGISTRO_INDICADORES.conoce(c)]
+    base = {'Close': close, 'High': high, 'Low': low, 'Volume': volume}
+    return REGISTRO_INDICADORES.calcular(base, columnas, dtype=dtype)
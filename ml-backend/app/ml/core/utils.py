@@ -77,19 +77,22 @@ def mostrar_resumen_entrenamiento(historial: Dict[str, list], tiempo_total: floa
 
 
 class Timer:
-    """Clase utilitaria para medir tiempos de ejecucion"""
-    def __init__(self, description: str = ""):
+    """Clase utilitaria para medir tiempos de ejecucion (con `registro`, guarda los segundos por descripcion)"""
+    def __init__(self, description: str = "", registro: Dict[str, float] = None):
         self.description = description
+        self.registro = registro
         self.start_time = None
 
     def __enter__(self):
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
         if self.description:
             print(f"Iniciando: {self.description}")
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        elapsed = time.time() - self.start_time
+        elapsed = time.perf_counter() - self.start_time
+        if self.registro is not None:
+            self.registro[self.description] = round(self.registro.get(self.description, 0.0) + elapsed, 4)
         if self.description:
             print(f"{self.description} completado en {elapsed:.2f}s")
         return False
\ No newline at end of file
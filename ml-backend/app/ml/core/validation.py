@@ -1,11 +1,21 @@
 """Utilidades de validación cruzada para modelos ML"""
 
-from typing import List, Callable, Dict, Any
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Callable, Dict, Any, Optional, Tuple
 import numpy as np
 from sklearn.model_selection import KFold, StratifiedKFold
 import torch
 from sklearn.model_selection import TimeSeriesSplit
 
+from app.ml.core.engine import MLEngine
+from app.ml.core.metrics import MetricasNormalizadas
+from app.ml.core.dataset_ventanas import DatasetVentanas, MuestreadorBalanceado, compartir_serie
+from app.ml.core.entrenamiento_paralelo import presupuesto_hilos, _entrenar_modelo_worker
+
+logger = logging.getLogger(__name__)
+
 def validacion_cruzada_k_fold(
     X: np.ndarray,
     y_reg: np.ndarray,
@@ -60,4 +70,115 @@ def validacion_cruzada_k_fold(
         if key != 'fold':
             print(f"{key}: {np.mean(vals):.4f} (±{np.std(vals):.4f})")
 
-    return resultados
\ No newline at end of file
+    return resultados
+
+def _muestras_por_epoca(y_clf: np.ndarray) -> int:
+    """Muestras que ve el entrenamiento por época tras el balanceo de MLEngine.BALANCE_METHOD"""
+    if MLEngine.BALANCE_METHOD in ('undersample', 'oversample', 'smote'):
+        return len(MuestreadorBalanceado(y_clf, MLEngine.BALANCE_METHOD))
+    return len(y_clf)
+
+
+def particiones_walk_forward(dataset: DatasetVentanas, k: int = 5, gap: Optional[int] = None,
+                             batch_size: int = 1) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Folds walk-forward (ventana de entrenamiento creciente) sobre un dataset de ventanas.
+
+    El eje temporal son las fechas de las muestras (todas las empresas a la vez); si el
+    dataset no tiene fechas se usa el orden de las muestras. El tiempo se parte en k + 1
+    bloques: el fold i valida en el bloque i + 1 y entrena con todo lo anterior salvo los
+    últimos `gap` pasos (purga, por defecto DIAS_MEMORIA_IA + DIAS_PREDICCION).
+
+    Se omiten los folds que no llegan a un lote completo de `batch_size` (los loaders
+    descartan el último lote incompleto): entrenamiento ya balanceado o validación.
+
+    Returns:
+        [(indices_train, indices_val), ...] sobre el dataset (no se copian ventanas)
+    """
+    if gap is None:
+        gap = MLEngine.DIAS_MEMORIA_IA + MLEngine.DIAS_PREDICCION
+
+    fechas = dataset.fechas
+    if fechas is not None and len(fechas) and not np.isnat(fechas).all():
+        _, tiempo = np.unique(fechas, return_inverse=True)
+    else:
+        tiempo = np.arange(len(dataset))
+    pasos = int(tiempo.max()) + 1 if len(tiempo) else 0
+
+    limites = np.linspace(0, pasos, k + 2).astype(np.int64)
+    particiones = []
+    for i in range(1, k + 1):
+        indices_train = np.flatnonzero(tiempo < limites[i] - gap)
+        indices_val = np.flatnonzero((tiempo >= limites[i]) & (tiempo < limites[i + 1]))
+        if len(indices_train) == 0 or len(indices_val) == 0:
+            logger.warning(f"⚠️ Fold {i}/{k} sin muestras suficientes (gap {gap}), se omite")
+            continue
+        muestras_train = _muestras_por_epoca(dataset.y_clf[indices_train])
+        if muestras_train < batch_size or len(indices_val) < batch_size:
+            logger.warning(f"⚠️ Fold {i}/{k} con menos de un lote ({muestras_train} train balanceado, "
+                           f"{len(indices_val)} val, batch_size {batch_size}), se omite")
+            continue
+        particiones.append((indices_train, indices_val))
+    return particiones
+
+
+def _entrenar_fold(constructor: Callable, nombre_trainer: str, log_file: str, dataset: DatasetVentanas,
+                   indices_train: np.ndarray, indices_val: np.ndarray, hilos: int, batch_size: int,
+                   epochs: int, precision: Optional[str] = None) -> Dict[str, Any]:
+    """Entrena y evalúa un fold dentro de un proceso worker (la serie llega compartida)"""
+    train_ds, val_ds = dataset.subconjunto(indices_train), dataset.subconjunto(indices_val)
+    train_ds.estadisticas = train_ds.calcular_estadisticas()
+    resultado = _entrenar_modelo_worker(constructor, nombre_trainer, log_file, train_ds, val_ds,
+                                        hilos, batch_size, epochs, precision)
+    return {"metricas": resultado["metricas"], "umbral_optimo": resultado["umbral_optimo"]}
+
+
+def validacion_walk_forward(constructor: Callable, dataset: DatasetVentanas, k: int = 5, epochs: int = 50,
+                            batch_size: int = 256, gap: Optional[int] = None, max_procesos: Optional[int] = None,
+                            nombre_trainer: str = "CV", log_file: str = "logs/validacion_cruzada.log",
+                            precision: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Validación cruzada walk-forward con los folds en procesos paralelos.
+
+    Usar sobre el split de entrenamiento (la validación final de preparar_datos_generico
+    queda como holdout). Cada worker arma sus subconjuntos por índices sobre la misma
+    serie compartida.
+
+    Returns:
+        {"folds": [métricas + score_global por fold], "promedio", "desviacion",
+         "score_promedio", "desviacion_estandar"}
+    """
+    particiones = particiones_walk_forward(dataset, k, gap, batch_size)
+    if not particiones:
+        raise ValueError("No hay folds walk-forward válidos para este dataset")
+
+    procesos, hilos = presupuesto_hilos(len(particiones), max_procesos)
+    compartir_serie(dataset)
+    logger.info(f"Validación walk-forward: {len(particiones)} folds, {procesos} procesos x {hilos} hilos")
+
+    folds = [None] * len(particiones)
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+        futuros = {
+            pool.submit(_entrenar_fold, constructor, nombre_trainer, log_file, dataset,
+                        indices_train, indices_val, hilos, batch_size, epochs, precision): i
+            for i, (indices_train, indices_val) in enumerate(particiones)
+        }
+        for futuro in as_completed(futuros):
+            i = futuros[futuro]
+            indices_train, indices_val = particiones[i]
+            metricas = futuro.result()["metricas"]
+            fila = {"fold": i + 1, "muestras_train": len(indices_train), "muestras_val": len(indices_val),
+                    **metricas, "score_global": float(MetricasNormalizadas.calcular_score_global(metricas))}
+            if dataset.fechas is not None:
+                fila["val_desde"] = str(np.datetime64(dataset.fechas[indices_val].min(), 'D'))
+                fila["val_hasta"] = str(np.datetime64(dataset.fechas[indices_val].max(), 'D'))
+            folds[i] = fila
+            logger.info(f"Fold {i + 1}/{len(particiones)}: score {fila['score_global']:.2f}")
+
+    claves = [c for c, v in folds[0].items() if isinstance(v, (int, float)) and c not in
+              ("fold", "muestras_train", "muestras_val")]
+    promedio = {c: float(np.mean([f[c] for f in folds])) for c in claves}
+    desviacion = {c: float(np.std([f[c] for f in folds])) for c in claves}
+    return {"folds": folds, "promedio": promedio, "desviacion": desviacion,
+            "score_promedio": promedio["score_global"], "desviacion_estandar": desviacion["score_global"]}
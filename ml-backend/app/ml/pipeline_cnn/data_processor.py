@@ -1,15 +1,20 @@
 import pandas as pd
 from typing import List, Optional
-from app.ml.core.pipeline_base import extraer_y_procesar_empresa, preparar_datos, crear_dataloaders
+from app.ml.core.pipeline_base import (extraer_y_procesar_empresa, extraer_precios_empresa,
+                                       procesar_dataframes_crudos, preparar_datos, crear_dataloaders)
 
 def extraer_y_procesar_empresa_cnn(id_empresa: int) -> Optional[pd.DataFrame]:
     """Alias para consistencia con nomenclatura CNN"""
     return extraer_y_procesar_empresa(id_empresa)
 
+def extraer_precios_empresa_cnn(id_empresa: int) -> Optional[pd.DataFrame]:
+    """Alias para consistencia con nomenclatura CNN"""
+    return extraer_precios_empresa(id_empresa)
+
 def preparar_datos_cnn(lista_dfs: List[pd.DataFrame], batch_size: int = 50):
     """Alias para consistencia con nomenclatura CNN"""
     return preparar_datos(lista_dfs, batch_size)
 
-def crear_dataloaders_cnn(x_t, yr_t, yc_t, x_v, yr_v, yc_v, batch_size=256):
+def crear_dataloaders_cnn(train_ds, val_ds, batch_size=256):
     """Alias para consistencia con nomenclatura CNN"""
-    return crear_dataloaders(x_t, yr_t, yc_t, x_v, yr_v, yc_v, batch_size)
\ No newline at end of file
+    return crear_dataloaders(train_ds, val_ds, batch_size)
\ No newline at end of file
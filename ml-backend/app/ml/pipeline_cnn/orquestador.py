@@ -1,10 +1,7 @@
 import os
-from tqdm import tqdm
-import sys
 import torch
 import joblib
 import gc
-from concurrent.futures import ProcessPoolExecutor, as_completed
 import logging
 
 from app.db.sessions import SessionLocal
@@ -13,64 +10,166 @@ from app.models.modelo_ia import ModeloIA
 from app.services.metrica_service import MetricaService
 from app.ml.arquitectura.v3_cnn import obtener_modelo_v3
 from app.ml.core.engine import MLEngine
+from app.ml.core.data_validation import DataValidator
+from app.ml.core.almacen_precios import AlmacenPrecios
+from app.ml.core.cache_datasets import CacheDatasets
+from app.ml.core.entrenamiento_paralelo import entrenar_en_paralelo
+from app.ml.core.entrenamiento_distribuido import entrenar_distribuido
+from app.ml.core.data_utils import preparar_datos_incrementales, fecha_corte_datasets
 from app.ml.core.logger import configurar_logger
 from app.ml.core.model_versioning import ModelVersionManager
 
-from app.ml.pipeline_cnn.data_processor import extraer_y_procesar_empresa_cnn, preparar_datos_cnn, crear_dataloaders_cnn
+from app.ml.pipeline_cnn.data_processor import procesar_dataframes_crudos, preparar_datos_cnn, crear_dataloaders_cnn
 from app.ml.pipeline_cnn.trainer import ejecutar_entrenamiento_cnn, evaluar_modelo_cnn
 from app.ml.core.utils import Timer
 
 # Configurar logger
 logger = configurar_logger("ML.Pipeline.CNN", archivo_log="logs/cnn_pipeline.log")
 
-def entrenar_pipeline_cnn(id_modelo: int = None):
-    """Orquesta el flujo completo de entrenamiento para CNNs"""
-    db = SessionLocal()
+def _procesar_empresas(almacen: AlmacenPrecios, ids_empresas: list, tiempos: dict = None) -> list:
+    """Extracción del almacén, indicadores en panel y puerta de calidad (segundos por etapa en `tiempos`)"""
+    with Timer("Extracción", tiempos):
+        datos_crudos = {f"Empresa_BD_{id_e}": df for id_e, df in almacen.leer_todos(ids_empresas).items()}
+
+    # Indicadores de todas las empresas en modo panel (pocas operaciones grandes en vez de una por empresa)
+    with Timer("Procesamiento en panel", tiempos):
+        procesados = procesar_dataframes_crudos(datos_crudos)
+        del datos_crudos
+        gc.collect()
+
+    # Puerta de calidad del universo completo antes de entrenar
+    procesados, reporte_calidad = DataValidator.puerta_calidad(procesados)
+    logger.info("Puerta de calidad", extra={"aceptados": reporte_calidad["aceptados"],
+                                            "descartados": reporte_calidad["descartados"]})
+    datos_procesados = list(procesados.values())
+    del procesados
+
+    logger.info("Extracción completa", extra={"empresas_validas": len(datos_procesados)})
+    return datos_procesados
+
+def _preparar_datasets(almacen: AlmacenPrecios, ids_empresas: list, tiempos: dict = None):
+    """Empresas procesadas + ventaneo y escalado (ver _procesar_empresas)"""
+    datos_procesados = _procesar_empresas(almacen, ids_empresas, tiempos)
+    train_ds, val_ds, scaler = preparar_datos_cnn(datos_procesados)
+    del datos_procesados
+    gc.collect()
+    return train_ds, val_ds, scaler
+
+def _constructor_modelo(version: str):
+    """Constructor de la arquitectura según la versión registrada en BD"""
+    return obtener_modelo_v3
+
+def _registrar_modelo(mod_db, resultado: dict, scaler, version_manager: ModelVersionManager, n_empresas: int,
+                      fecha_corte: str = None, version_padre: str = None, tiempos_pipeline: dict = None):
+    """
+    Guarda métricas en BD y el modelo versionado a partir del resultado de entrenamiento.
+    El perfil del entrenamiento se guarda con la versión, junto con los tiempos del pipeline.
+    """
+    mejores_pesos = resultado["pesos"]
+    umbral_optimo = resultado["umbral_optimo"]
+    metricas = resultado["metricas"]
+    metricas['DiasFuturo'] = MLEngine.DIAS_PREDICCION
+    metricas['umbral_optimo'] = umbral_optimo
+
+    # Guardar métricas en BD
+    db_guardado = SessionLocal()
     try:
-        # 1. Cargar configuración
-        modelos = db.query(ModeloIA).filter(ModeloIA.Activo == True, ModeloIA.Version == 'v3')
-        if id_modelo: modelos = modelos.filter(ModeloIA.IdModelo == id_modelo)
+        MetricaService.guardar_metricas(db_guardado, mod_db.IdModelo, metricas)
+    finally:
+        db_guardado.close()
 
-        empresas = db.query(Empresa).filter(Empresa.Activo == True).all()
-        ids_empresas = [e.IdEmpresa for e in empresas]
+    # Guardar modelo con versionamiento
+    ruta_version = version_manager.guardar_modelo_versionado(
+        mejores_pesos,
+        scaler,
+        metricas,
+        f"CNN_{mod_db.Version}",
+        mod_db.Version,
+        f"Ajuste incremental desde {version_padre} - {n_empresas} empresas" if version_padre
+        else f"Entrenamiento automático - {n_empresas} empresas",
+        fecha_corte=fecha_corte,
+        version_padre=version_padre,
+        perfil={**resultado["perfil"], "pipeline": tiempos_pipeline or {}} if resultado.get("perfil") else None
+    )
 
-        datos_procesados = []
-        lote_size = 20
+    # Ya versionado: el próximo entrenamiento de este IdModelo empieza de cero
+    version_manager.eliminar_checkpoint(mod_db.IdModelo)
 
-        logger.info("Iniciando extracción de datos", extra={"empresas_total": len(ids_empresas)})
+    logger.info("Modelo guardado exitosamente",
+                extra={"version": mod_db.Version, "accuracy": metricas.get('accuracy', 0),
+                        "auc": metricas.get('auc', 0), "ruta": ruta_version})
 
-        with Timer("Extracción y Procesamiento"):
-            #CREAMOS UNA SOLA BARRA DE PROGRESO GLOBAL
-            with tqdm(total=len(ids_empresas), desc="Procesando Empresas", file=sys.stdout) as pbar:
-                for i in range(0, len(ids_empresas), lote_size):
-                    lote_actual = ids_empresas[i : i + lote_size]
+def _entrenar_incremental(modelos: list, almacen: AlmacenPrecios, ids_empresas: list,
+                          version_manager: ModelVersionManager, device, tiempos: dict = None) -> list:
+    """
+    Ajuste fino desde la última versión de cada modelo (pesos y scaler guardados) con las
+    fechas posteriores a su corte más un repaso del histórico.
 
-                    with ProcessPoolExecutor(max_workers=2) as executor:
-                        futuros = [executor.submit(extraer_y_procesar_empresa_cnn, id_e) for id_e in lote_actual]
+    Returns:
+        Modelos sin versión previa utilizable (se entrenan desde cero)
+    """
+    pendientes, con_padre = [], []
+    for mod_db in modelos:
+        padre = version_manager.ultima_version(f"CNN_{mod_db.Version}")
+        if padre and padre.get('fecha_corte'):
+            con_padre.append((mod_db, padre))
+        else:
+            logger.info("Sin versión previa con fecha de corte, entrenamiento completo", extra={"version": mod_db.Version})
+            pendientes.append(mod_db)
+    if not con_padre:
+        return pendientes
 
-                        for f in as_completed(futuros):
-                            try:
-                                res = f.result(timeout=180)
-                                if res is not None:
-                                    datos_procesados.append(res)
-                            except Exception as e:
-                                logger.error("Error en procesamiento de empresa", extra={"error": str(e)}, exc_info=True)
+    with Timer("Procesamiento incremental", tiempos):
+        datos_procesados = _procesar_empresas(almacen, ids_empresas, tiempos)
 
-                            finally:
-                                pbar.update(1)
+    for mod_db, padre in con_padre:
+        pesos, scaler, _ = version_manager.cargar_modelo_versionado(padre['version_id'], len(MLEngine.FEATURES))
+        train_ds, val_ds = preparar_datos_incrementales(datos_procesados, scaler, padre['fecha_corte'])
+        if train_ds is None:
+            logger.info("Sin datos nuevos desde el último entrenamiento", extra={"version": mod_db.Version,
+                                                                               "fecha_corte": padre['fecha_corte']})
+            continue
+        train_loader, val_loader = crear_dataloaders_cnn(train_ds, val_ds)
 
-                    gc.collect()
+        modelo_pt = _constructor_modelo(mod_db.Version)(dias_pasados = MLEngine.DIAS_MEMORIA_IA, num_features = len(MLEngine.FEATURES))
+        modelo_pt.load_state_dict(pesos)
+        modelo_pt.to(device)
 
-        logger.info("Extracción completa", extra={"empresas_validas": len(datos_procesados)})
+        precision = MLEngine.PRECISION_POR_VERSION.get(mod_db.Version)
+        resultado = ejecutar_entrenamiento_cnn(modelo_pt, train_loader, val_loader, device,
+                                              epochs=MLEngine.EPOCAS_INCREMENTAL, precision=precision,
+                                              hiperparametros={'lr': MLEngine.LR_INCREMENTAL})
+        resultado["metricas"] = evaluar_modelo_cnn(modelo_pt, val_loader, device,
+                                                  umbral_decision=resultado["umbral_optimo"], precision=precision)
+        _registrar_modelo(mod_db, resultado, scaler, version_manager, len(ids_empresas),
+                          fecha_corte=fecha_corte_datasets(train_ds, val_ds), version_padre=padre['version_id'],
+                          tiempos_pipeline=tiempos)
+    return pendientes
 
-        # 3. Preparación de Tensores
-        with Timer("Preparación de Tensores"):
-            xt, yrt, yct, xv, yrv, ycv, scaler = preparar_datos_cnn(datos_procesados)
-            train_loader, val_loader = crear_dataloaders_cnn(xt, yrt, yct, xv, yrv, ycv)
-            del datos_procesados, xt, xv
-            gc.collect()
+def entrenar_pipeline_cnn(id_modelo: int = None, incremental: bool = False):
+    """
+    Orquesta el flujo completo de entrenamiento para CNNs.
+
+    Con `incremental=True` cada modelo con una versión previa se ajusta desde sus pesos
+    sólo con los días nuevos (ver _entrenar_incremental); el resto se entrena completo.
+    """
+    db = SessionLocal()
+    try:
+        # 1. Cargar configuración
+        modelos = db.query(ModeloIA).filter(ModeloIA.Activo == True, ModeloIA.Version == 'v3')
+        if id_modelo: modelos = modelos.filter(ModeloIA.IdModelo == id_modelo)
+
+        empresas = db.query(Empresa).filter(Empresa.Activo == True).all()
+        ids_empresas = [e.IdEmpresa for e in empresas]
+
+        logger.info("Iniciando extracción de datos", extra={"empresas_total": len(ids_empresas)})
+
+        # Almacén local: sólo se descargan las filas nuevas (una consulta masiva) y el resto se lee con memory-map
+        almacen = AlmacenPrecios()
+        tiempos_pipeline = {}  # segundos por etapa del pipeline, van al perfil de cada versión
+        with Timer("Sincronización del almacén local", tiempos_pipeline):
+            almacen.sincronizar(ids_empresas, tickers={e.IdEmpresa: e.Ticket for e in empresas})
 
-        # 4. Bucle de Entrenamiento por Arquitectura
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         ruta_modelos = os.path.join(os.getcwd(), "app", "ml", "models")
         os.makedirs(ruta_modelos, exist_ok=True)
@@ -78,42 +177,73 @@ def entrenar_pipeline_cnn(id_modelo: int = None):
         # Inicializar version manager
         version_manager = ModelVersionManager(ruta_modelos)
 
-        for mod_db in modelos.all():
-            logger.info("Iniciando entrenamiento de modelo", extra={"modelo": mod_db.Nombre, "version": mod_db.Version})
-
-            modelo_pt = obtener_modelo_v3(dias_pasados = MLEngine.DIAS_MEMORIA_IA, num_features = len(MLEngine.FEATURES))
-
-            modelo_pt.to(device)
-
-            resultado_entrenamiento = ejecutar_entrenamiento_cnn(modelo_pt, train_loader, val_loader, device)
-            mejores_pesos = resultado_entrenamiento["pesos"]
-            umbral_optimo = resultado_entrenamiento["umbral_optimo"]
-
-            # Evaluación y Guardado con umbral optimizado
-            metricas = evaluar_modelo_cnn(modelo_pt, val_loader, device, umbral_decision=umbral_optimo)
-            metricas['DiasFuturo'] = MLEngine.DIAS_PREDICCION
-            metricas['umbral_optimo'] = umbral_optimo
-
-            # Guardar métricas en BD
-            db_guardado = SessionLocal()
-            try:
-                MetricaService.guardar_metricas(db_guardado, mod_db.IdModelo, metricas)
-            finally:
-                db_guardado.close()
-
-            # Guardar modelo con versionamiento
-            ruta_version = version_manager.guardar_modelo_versionado(
-                mejores_pesos,
-                scaler,
-                metricas,
-                f"CNN_{mod_db.Version}",
-                mod_db.Version,
-                f"Entrenamiento automático - {len(ids_empresas)} empresas"
+        modelos_a_entrenar = modelos.all()
+        n_empresas = len(ids_empresas)
+
+        if incremental:
+            modelos_a_entrenar = _entrenar_incremental(modelos_a_entrenar, almacen, ids_empresas, version_manager, device,
+                                                       tiempos_pipeline)
+            if not modelos_a_entrenar:
+                logger.info("Pipeline CNN incremental finalizado")
+                return
+
+        # 3. Preparación de Tensores (caché en disco: con los mismos precios y configuración se saltan indicadores y ventaneo)
+        cache = CacheDatasets()
+        with Timer("Preparación de Tensores", tiempos_pipeline):
+            train_ds, val_ds, scaler, desde_cache = cache.obtener_o_preparar(
+                almacen.huella(ids_empresas), lambda: _preparar_datasets(almacen, ids_empresas, tiempos_pipeline),
+                info={'origen': 'almacen_precios', 'empresas': len(ids_empresas)}
             )
+            train_loader, val_loader = crear_dataloaders_cnn(train_ds, val_ds)
+        logger.info("Datasets listos", extra={"desde_cache": desde_cache, "muestras_train": len(train_ds),
+                                               "muestras_val": len(val_ds)})
+
+        # 4. Bucle de Entrenamiento por Arquitectura
+        # Corte de esta versión: base del próximo reentrenamiento incremental
+        fecha_corte = fecha_corte_datasets(train_ds, val_ds)
+
+        if MLEngine.ENTRENAMIENTO_PARALELO and len(modelos_a_entrenar) > 1 and device.type == "cpu":
+            # Un proceso por arquitectura sobre la misma matriz compartida
+            por_id = {mod_db.IdModelo: mod_db for mod_db in modelos_a_entrenar}
+            tareas = {mod_db.IdModelo: _constructor_modelo(mod_db.Version) for mod_db in modelos_a_entrenar}
+            precisiones = {mod_db.IdModelo: MLEngine.PRECISION_POR_VERSION.get(mod_db.Version) for mod_db in modelos_a_entrenar}
+            checkpoints = {mod_db.IdModelo: version_manager.ruta_checkpoint(mod_db.IdModelo) for mod_db in modelos_a_entrenar}
+            for id_modelo, resultado in entrenar_en_paralelo(tareas, train_ds, val_ds, "CNN", "logs/cnn_training.log",
+                                                             max_procesos=MLEngine.PROCESOS_ENTRENAMIENTO,
+                                                             precisiones=precisiones, checkpoints=checkpoints):
+                _registrar_modelo(por_id[id_modelo], resultado, scaler, version_manager, n_empresas, fecha_corte,
+                                  tiempos_pipeline=tiempos_pipeline)
+        else:
+            for mod_db in modelos_a_entrenar:
+                logger.info("Iniciando entrenamiento de modelo", extra={"modelo": mod_db.Nombre, "version": mod_db.Version})
+                # Si un entrenamiento anterior de este modelo se cortó, se reanuda desde su checkpoint
+                ruta_checkpoint = version_manager.ruta_checkpoint(mod_db.IdModelo)
+
+                if MLEngine.PROCESOS_DDP > 1 and device.type == "cpu":
+                    # Data-parallel en varios procesos locales (métricas ya agregadas entre rangos)
+                    resultado_entrenamiento = entrenar_distribuido(
+                        _constructor_modelo(mod_db.Version), train_ds, val_ds, "CNN", "logs/cnn_training.log",
+                        procesos=MLEngine.PROCESOS_DDP, precision=MLEngine.PRECISION_POR_VERSION.get(mod_db.Version),
+                        ruta_checkpoint=ruta_checkpoint
+                    )
+                    _registrar_modelo(mod_db, resultado_entrenamiento, scaler, version_manager, n_empresas, fecha_corte,
+                                      tiempos_pipeline=tiempos_pipeline)
+                    continue
+
+                modelo_pt = _constructor_modelo(mod_db.Version)(dias_pasados = MLEngine.DIAS_MEMORIA_IA, num_features = len(MLEngine.FEATURES))
+                modelo_pt.to(device)
+
+                precision = MLEngine.PRECISION_POR_VERSION.get(mod_db.Version)
+                resultado_entrenamiento = ejecutar_entrenamiento_cnn(modelo_pt, train_loader, val_loader, device,
+                                                                      precision=precision, ruta_checkpoint=ruta_checkpoint)
 
-            logger.info("Modelo guardado exitosamente",
-                        extra={"version": mod_db.Version, "accuracy": metricas.get('accuracy', 0),
-                                "auc": metricas.get('auc', 0), "ruta": ruta_version})
+                # Evaluación con umbral optimizado (en la misma precisión del entrenamiento)
+                resultado_entrenamiento["metricas"] = evaluar_modelo_cnn(
+                    modelo_pt, val_loader, device, umbral_decision=resultado_entrenamiento["umbral_optimo"],
+                    precision=precision
+                )
+                _registrar_modelo(mod_db, resultado_entrenamiento, scaler, version_manager, n_empresas, fecha_corte,
+                                  tiempos_pipeline=tiempos_pipeline)
 
         # Guardar scaler global (para compatibilidad)
         joblib.dump(scaler, os.path.join(ruta_modelos, "scaler.pkl"))
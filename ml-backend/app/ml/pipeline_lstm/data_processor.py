@@ -1,11 +1,12 @@
 import pandas as pd
 from typing import List, Optional
-from app.ml.core.pipeline_base import extraer_y_procesar_empresa, preparar_datos, crear_dataloaders
+from app.ml.core.pipeline_base import (extraer_y_procesar_empresa, extraer_precios_empresa,
+                                       procesar_dataframes_crudos, preparar_datos, crear_dataloaders)
 
 def preparar_datos_lstm(lista_dfs: List[pd.DataFrame], batch_size: int = 50):
-    """Alias para consistencia con nomenclatura LSTM - usa MLEngine.BALANCE_METHOD automáticamente"""
+    """Alias para consistencia con nomenclatura LSTM"""
     return preparar_datos(lista_dfs, batch_size)
 
-def crear_dataloaders_lstm(x_t, yr_t, yc_t, x_v, yr_v, yc_v, batch_size=256):
-    """Alias para consistencia con nomenclatura LSTM"""
-    return crear_dataloaders(x_t, yr_t, yc_t, x_v, yr_v, yc_v, batch_size)
\ No newline at end of file
+def crear_dataloaders_lstm(train_ds, val_ds, batch_size=256):
+    """Alias para consistencia con nomenclatura LSTM - usa MLEngine.BALANCE_METHOD automáticamente"""
+    return crear_dataloaders(train_ds, val_ds, batch_size)
\ No newline at end of file
@@ -63,12 +63,13 @@ def diagnostico_ia():
     }
 
 @router.post("/analizar-todo")
-async def analizar_todas_las_empresas(background_tasks: BackgroundTasks):
+async def analizar_todas_las_empresas(background_tasks: BackgroundTasks,
+                                      reconstruir_estados: bool = Query(False, description="Recalcular los indicadores desde el historial (tras corregir precios antiguos)")):
     if not IA_AVAILABLE:
         error_msg = "Procesos de IA no disponibles. Errores: " + "; ".join(import_errors) if import_errors else "Módulo ML deshabilitado"
         raise HTTPException(status_code=501, detail=error_msg)
     
-    background_tasks.add_task(ejecutar_analisis_diario)
+    background_tasks.add_task(ejecutar_analisis_diario, reconstruir_estados=reconstruir_estados)
     return {"status": "success", "message": "Análisis masivo de IA iniciado en segundo plano."}
 
 @router.get("/metricas")
@@ -111,7 +112,8 @@ def obtener_rendimiento_sistema():
         return {"error": f"No se pudo obtener rendimiento del sistema: {str(e)}"}
     
 @router.post("/entrenar-modelo/{id_modelo}", status_code=status.HTTP_202_ACCEPTED)
-def entrenar_modelo_individual(id_modelo: int, background_tasks: BackgroundTasks):
+def entrenar_modelo_individual(id_modelo: int, background_tasks: BackgroundTasks,
+                               incremental: bool = Query(False, description="Ajuste fino desde la última versión sólo con los días nuevos")):
     if not IA_AVAILABLE:
         error_msg = "Entrenamiento no disponible. Errores: " + "; ".join(import_errors) if import_errors else "Módulo ML deshabilitado"
         raise HTTPException(status_code=501, detail=error_msg)
@@ -125,15 +127,16 @@ def entrenar_modelo_individual(id_modelo: int, background_tasks: BackgroundTasks
     finally:
         db.close()
     if version_modelo in ['v1', 'v2', 'v4']:
-        background_tasks.add_task(entrenar_pipeline_lstm, id_modelo=id_modelo)
+        background_tasks.add_task(entrenar_pipeline_lstm, id_modelo=id_modelo, incremental=incremental)
         tipo = "LSTM/BiLSTM/Híbrida"
     elif version_modelo == 'v3':
-        background_tasks.add_task(entrenar_pipeline_cnn, id_modelo=id_modelo)
+        background_tasks.add_task(entrenar_pipeline_cnn, id_modelo=id_modelo, incremental=incremental)
         tipo = "CNN"
     else:
         raise HTTPException(status_code=400, detail=f"Versión de modelo no soportada: {version_modelo}")
 
-    return {"message": f"Entrenamiento del modelo {tipo} (ID {id_modelo}) iniciado en segundo plano."}
+    modo = "incremental" if incremental else "completo"
+    return {"message": f"Entrenamiento {modo} del modelo {tipo} (ID {id_modelo}) iniciado en segundo plano."}
 
 @router.get("/prediccion/{empresa_id}")
 async def obtener_prediccion_empresa(
@@ -226,9 +229,10 @@ async def obtener_predicciones_masivas(
     return resultado_masivo
 
 @router.post("/analizar-por-modelo/{id_modelo}")
-def analizar_por_modelo(id_modelo: int , background_tasks: BackgroundTasks):
+def analizar_por_modelo(id_modelo: int , background_tasks: BackgroundTasks,
+                        reconstruir_estados: bool = Query(False, description="Recalcular los indicadores desde el historial (tras corregir precios antiguos)")):
     if not IA_AVAILABLE:
         raise HTTPException(status_code= 501, detail="Modulo ML deshabilitado")
     
-    background_tasks.add_task(ejecutar_analisis_diario, id_modelo)
+    background_tasks.add_task(ejecutar_analisis_diario, id_modelo, reconstruir_estados)
     return {"status": "ok", "mensaje": f"Predicciones iniciadas en segundo plano para el modelo {id_modelo}"}
\ No newline at end of file
@@ -1,6 +1,6 @@
 import os
 import torch
-from app.ml.core.pipeline_base import extraer_y_procesar_desde_csv
+from app.ml.core.pipeline_base import leer_csv_crudo, procesar_dataframes_crudos
 from app.ml.pipeline_lstm.data_processor import preparar_datos_lstm, crear_dataloaders_lstm
 from app.ml.core.pipeline_trainer import PipelineTrainer
 from app.ml.arquitectura.v1_lstm import obtener_modelo_v1 
@@ -8,6 +8,9 @@ from app.ml.arquitectura.v2_bidireccional import obtener_modelo_v2
 from app.ml.arquitectura.v3_cnn import obtener_modelo_v3
 from app.ml.arquitectura.v4_lstm_cnn import obtener_modelo_v4
 from app.ml.core.engine import MLEngine
+from app.ml.core.data_validation import DataValidator
+from app.ml.core.almacen_precios import AlmacenPrecios
+from app.ml.core.cache_datasets import CacheDatasets, huella_archivos
 import joblib 
 import json
 from sklearn.metrics import confusion_matrix
@@ -86,39 +89,87 @@ def guardar_metricas_json(modelo_nombre: str, resultados: dict, metricas_finales
     print(f"💾 Métricas guardadas en: {ruta_json}")
     return reporte_modelo
 
-def iniciar_entrenamiento_csv(modelos: list = [1]):
+def _leer_almacen_local(almacen: AlmacenPrecios) -> dict:
+    """Lee todas las empresas del almacén local de precios (memory-map, sin BD)"""
+    dfs_crudos = {}
+    for id_empresa, df in almacen.leer_todos().items():
+        ticker = almacen.manifiesto[str(id_empresa)].get('ticker') or id_empresa
+        dfs_crudos[f"almacen/{ticker}"] = df
+    return dfs_crudos
+
+def _leer_csvs(rutas_csv: list) -> dict:
+    """Lee los CSV locales como DataFrames OHLCV crudos"""
+    dfs_crudos = {}
+    for ruta in rutas_csv:
+        df_crudo = leer_csv_crudo(ruta)
+        if df_crudo is not None:
+            dfs_crudos[ruta] = df_crudo
+    return dfs_crudos
+
+def _preparar_datasets(dfs_crudos: dict):
+    """Indicadores en panel, puerta de calidad y ventaneo (lo que se guarda en la caché de datasets)"""
+    # Indicadores de todos los CSV a la vez (modo panel)
+    procesados = procesar_dataframes_crudos(dfs_crudos)
+    for ruta in procesados:
+        print(f"✅ {ruta} procesado correctamente.")
+
+    # Puerta de calidad: descarta CSV con demasiados outliers extremos
+    procesados, reporte_calidad = DataValidator.puerta_calidad(procesados)
+    for ruta in reporte_calidad['descartados']:
+        print(f"⚠️ {ruta} descartado por calidad ({reporte_calidad['fracciones'][ruta]:.1%} outliers)")
+    lista_dfs = list(procesados.values())
+    
+    if not lista_dfs:
+        return None, None, None
+
+    print("🧠 Generando tensores y ventanas de memoria...")
+    return preparar_datos_lstm(lista_dfs)
+
+def iniciar_entrenamiento_csv(modelos: list = [1], usar_almacen: bool = False):
     #Importacion de los archivos CSV Localess 
     #ruta de los archivos data/data_TICKET.csv
     rutas_csv = rutas
     
-    lista_dfs = []
-    
-    # 1. Extracción adaptada (Offline)
-    print("🚀 Extrayendo y procesando datos desde CSV...")
-    for ruta in rutas_csv:
-        if not os.path.exists(ruta):
-            print(f"⚠️ Advertencia: No se encontró el archivo {ruta}")
-            continue
-            
-        df_procesado = extraer_y_procesar_desde_csv(ruta)
-        if df_procesado is not None:
-            lista_dfs.append(df_procesado)
-            print(f"✅ {ruta} procesado correctamente.")
-    
-    if not lista_dfs:
+    # 1. Origen de los datos (Offline)
+    almacen = AlmacenPrecios() if usar_almacen else None
+    if almacen is not None and almacen.empresas:
+        # Almacén sincronizado con `python -m app.auto.descargar_precio`
+        print("🚀 Leyendo datos desde el almacén local de precios...")
+        huella_datos = f"almacen:{almacen.huella()}"
+        leer_crudos = lambda: _leer_almacen_local(almacen)
+    else:
+        if usar_almacen:
+            print("⚠️ El almacén local está vacío, se usan los CSV")
+        print("🚀 Extrayendo y procesando datos desde CSV...")
+        rutas_existentes = []
+        for ruta in rutas_csv:
+            if not os.path.exists(ruta):
+                print(f"⚠️ Advertencia: No se encontró el archivo {ruta}")
+                continue
+            rutas_existentes.append(ruta)
+        huella_datos = f"csv:{huella_archivos(rutas_existentes)}"
+        leer_crudos = lambda: _leer_csvs(rutas_existentes)
+
+    # 2. Preparación tensorial (caché en disco si los datos y la configuración no cambiaron)
+    train_ds, val_ds, scaler, desde_cache = CacheDatasets().obtener_o_preparar(
+        huella_datos, lambda: _preparar_datasets(leer_crudos()),
+        info={'origen': huella_datos.split(':')[0]}
+    )
+    if train_ds is None:
         print("❌ No hay datos válidos para entrenar. Verifica los CSV.")
         return
+    if desde_cache:
+        print("⚡ Dataset preparado leído de la caché (sin recalcular indicadores ni ventanas)")
 
-    # 2. Preparación tensorial con BALANCEO de clases (automático desde MLEngine.BALANCE_METHOD)
-    print("🧠 Generando tensores y ventanas de memoria...")
+    # Balanceo de clases en el DataLoader (automático desde MLEngine.BALANCE_METHOD)
     print(f"⚖️  Aplicando balanceo de clases ({MLEngine.BALANCE_METHOD.upper()})...")
-    x_t, yr_t, yc_t, x_v, yr_v, yc_v, scaler = preparar_datos_lstm(lista_dfs)
+    train_loader, val_loader = crear_dataloaders_lstm(train_ds, val_ds)
     
     print(f"✅ Balanceo completado")
-    print(f"   Train: {len(x_t)} muestras")
-    print(f"   Val:   {len(x_v)} muestras")
-    
-    train_loader, val_loader = crear_dataloaders_lstm(x_t, yr_t, yc_t, x_v, yr_v, yc_v)
+    # El balanceo vive en el sampler interno del batch_sampler; train_loader.sampler es el secuencial por defecto
+    por_epoca = len(train_loader.batch_sampler.sampler or train_ds)
+    print(f"   Train: {len(train_ds)} muestras ({por_epoca} por época)")
+    print(f"   Val:   {len(val_ds)} muestras")
     
     # 3. Configurar carpeta central de resultados
     carpeta_central = "app/ml/models/entrenamientos_offline"
@@ -193,7 +244,13 @@ def iniciar_entrenamiento_csv(modelos: list = [1]):
         ruta_scaler = os.path.join(carpeta_modelo, "scaler.pkl")
         joblib.dump(scaler, ruta_scaler)
         print(f"💾 Scaler guardado: {ruta_scaler}")
-        
+
+        # Perfil de rendimiento (tiempos por etapa, muestras/seg y RSS pico por época)
+        ruta_perfil = os.path.join(carpeta_modelo, "perfil.json")
+        with open(ruta_perfil, 'w', encoding='utf-8') as f:
+            json.dump(resultados['perfil'], f, indent=2, ensure_ascii=False)
+        print(f"⏱️  Perfil guardado: {ruta_perfil} ({resultados['perfil']['muestras_por_seg']} muestras/seg)")
+
         # Guardar métricas en JSON
         reporte = guardar_metricas_json(
             modelo_nombre=f"v{num_modelo}",
@@ -260,5 +317,8 @@ if __name__ == "__main__":
     
     # Cambiar esta lista para entrenar diferentes modelos
     modelos_a_entrenar = [1] 
+
+    # True: leer del almacén local (app/ml/models/almacen_precios) en vez de los CSV
+    usar_almacen = False
     
-    iniciar_entrenamiento_csv(modelos=modelos_a_entrenar)
\ No newline at end of file
+    iniciar_entrenamiento_csv(modelos=modelos_a_entrenar, usar_almacen=usar_almacen)
\ No newline at end of file